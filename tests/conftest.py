@@ -0,0 +1,75 @@
+#
+# The modules are imported the way the scripts in ursina_test/ import each other, by name
+#
+
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent.joinpath('ursina_test')))
+
+# What the image server sends
+IMAGE_BYTES = b'\xff\xd8' + bytes(range(256)) * 64 + b'\xff\xd9'
+
+
+class ImageServer(ThreadingHTTPServer):
+    """
+    A stand-in for picsum.photos. Each request gets the next behaviour from "failures", then the image:
+    "error" answers 503, "truncate" sends half of the image then hangs up, and "stall" sends half of the image
+    then waits for "resume" to be set.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ImageRequestHandler)
+        self.failures = []
+        self.requests = 0
+        self.stalled = threading.Event()
+        self.resume = threading.Event()
+        return
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/{{width}}/{{height}}'
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        failure = self.server.failures.pop(0) if self.server.failures else None
+        if failure == 'error':
+            self.send_error(503)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(IMAGE_BYTES)))
+        self.end_headers()
+        if failure in ('truncate', 'stall'):
+            self.wfile.write(IMAGE_BYTES[:len(IMAGE_BYTES) // 2])
+            self.wfile.flush()
+            if failure == 'truncate':
+                self.close_connection = True
+                return
+            self.server.stalled.set()
+            self.server.resume.wait(10)
+            self.wfile.write(IMAGE_BYTES[len(IMAGE_BYTES) // 2:])
+            return
+        self.wfile.write(IMAGE_BYTES)
+        return
+
+    def log_message(self, format, *args):
+        return
+
+
+@pytest.fixture
+def image_server():
+    server = ImageServer()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': .05}, daemon=True)
+    thread.start()
+    yield server
+    server.resume.set()
+    server.shutdown()
+    server.server_close()
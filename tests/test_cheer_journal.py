@@ -0,0 +1,87 @@
+import json
+import threading
+
+from cheer_journal import CheerJournal, replay_journal, save_snapshot
+
+
+def attendee(points: int, given: int = 0, name: str = 'Someone'):
+    return {'cheer_available': points, 'cheer_given': given, 'name': name}
+
+
+def write_journal(path, records, tail: str = ''):
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        f.write(tail)
+    return
+
+
+def test_replay_stops_at_a_truncated_record(tmp_path):
+    journal = tmp_path / 'cheer.journal'
+    write_journal(journal, [{'a': attendee(1)}, {'b': attendee(2)}, {'a': attendee(3)}],
+                  tail=json.dumps({'b': attendee(99)})[:-5])
+    cheer_data = {'c': attendee(7)}
+    assert replay_journal(str(journal), cheer_data) == 3
+    assert cheer_data == {'a': attendee(3), 'b': attendee(2), 'c': attendee(7)}
+
+
+def test_replay_without_a_journal(tmp_path):
+    cheer_data = {'a': attendee(1)}
+    assert replay_journal(str(tmp_path / 'missing.journal'), cheer_data) == 0
+    assert cheer_data == {'a': attendee(1)}
+
+
+def test_load_compacts_a_journal_with_a_truncated_tail(tmp_path):
+    snapshot = tmp_path / 'cheer.json'
+    journal = tmp_path / 'cheer.journal'
+    save_snapshot(str(snapshot), {'a': attendee(1), 'b': attendee(1)})
+    write_journal(journal, [{'a': attendee(5)}], tail='{"b": {"cheer_avail')
+    cheer_journal = CheerJournal(snapshot_filename=str(snapshot), journal_filename=str(journal))
+    cheer_data = cheer_journal.load()
+    assert cheer_data == {'a': attendee(5), 'b': attendee(1)}
+    # Nothing new can end up after the cut short record
+    assert journal.read_text() == ''
+    assert json.load(open(snapshot)) == cheer_data
+    assert json.load(open(f'{snapshot}.bak')) == {'a': attendee(1), 'b': attendee(1)}
+    cheer_journal.record({'b': attendee(4)})
+    cheer_journal.stop()
+    assert CheerJournal(snapshot_filename=str(snapshot), journal_filename=str(journal)).load() == \
+        {'a': attendee(5), 'b': attendee(4)}
+
+
+def test_records_are_compacted_into_the_snapshot(tmp_path):
+    snapshot = tmp_path / 'cheer.json'
+    journal = tmp_path / 'cheer.journal'
+    cheer_journal = CheerJournal(snapshot_filename=str(snapshot), journal_filename=str(journal), compact_every=3)
+    cheer_journal.load()
+    compacted = threading.Event()
+
+    def on_write(written: int):
+        if written >= 3:
+            compacted.set()
+        return
+    cheer_journal.on_write = on_write
+    for points in range(3):
+        cheer_journal.record({'a': attendee(points)})
+    assert compacted.wait(10)
+    cheer_journal.record({'b': attendee(10)})
+    cheer_journal.stop()
+    assert cheer_journal.written == cheer_journal.recorded == 4
+    assert json.load(open(snapshot)) == {'a': attendee(2), 'b': attendee(10)}
+    assert journal.read_text() == ''
+
+
+def test_a_crash_before_compacting_loses_nothing(tmp_path):
+    snapshot = tmp_path / 'cheer.json'
+    journal = tmp_path / 'cheer.journal'
+    cheer_journal = CheerJournal(snapshot_filename=str(snapshot), journal_filename=str(journal),
+                                 compact_every=1000)
+    cheer_journal.load()
+    written = threading.Event()
+    cheer_journal.on_write = lambda count: count == 2 and written.set()
+    cheer_journal.record({'a': attendee(1)})
+    cheer_journal.record({'a': attendee(0, given=1), 'b': attendee(1)})
+    assert written.wait(10)
+    # The records are on disk, but were never compacted: load them as if the process had died here
+    reloaded = CheerJournal(snapshot_filename=str(snapshot), journal_filename=str(journal)).load()
+    assert reloaded == {'a': attendee(0, given=1), 'b': attendee(1)}
@@ -0,0 +1,139 @@
+import random
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import cheer_ledger
+from cheer_ledger import SECONDS_PER_DAY, CheerLedger
+
+USERS = ['ann', 'bob', 'cat', 'dan', 'eve']
+# A Monday (2024-01-01), so the windows cover whole weeks, partial weeks and partial days
+START = 1704067200.
+
+
+def brute_force(transfers, stat: str, start: float, end: float, limit=None):
+    totals = {}
+    for timestamp, giver, receiver, points in transfers:
+        if start <= timestamp < end and giver != receiver:
+            username = giver if stat == 'given' else receiver
+            totals[username] = totals.get(username, 0) + points
+    leaderboard = sorted(((u, t) for u, t in totals.items() if t > 0), key=lambda item: (-item[1], item[0]))
+    return leaderboard[:limit] if limit is not None else leaderboard
+
+
+def random_transfers(rng: random.Random, count: int, days: int):
+    transfers = []
+    for _ in range(count):
+        timestamp = START + rng.random() * days * SECONDS_PER_DAY
+        transfers.append((timestamp, rng.choice(USERS), rng.choice(USERS), rng.randint(1, 20)))
+    return transfers
+
+
+def random_windows(rng: random.Random, count: int, days: int):
+    windows = [(START, START + days * SECONDS_PER_DAY),
+               # Exactly on day and week boundaries
+               (START + 7 * SECONDS_PER_DAY, START + 14 * SECONDS_PER_DAY),
+               (START + SECONDS_PER_DAY, START + SECONDS_PER_DAY)]
+    for _ in range(count):
+        start = START + rng.uniform(-1, days) * SECONDS_PER_DAY
+        windows.append((start, start + rng.uniform(0, days) * SECONDS_PER_DAY))
+    return windows
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = CheerLedger(str(tmp_path / 'cheer_ledger.sqlite'))
+    yield ledger
+    ledger.close()
+
+
+def record(ledger: CheerLedger, transfers):
+    for timestamp, giver, receiver, points in transfers:
+        ledger.record(giver, receiver, points, texture='star', timestamp=timestamp)
+    return
+
+
+@pytest.mark.parametrize('stat', ['given', 'received'])
+def test_windows_match_brute_force(ledger, stat):
+    rng = random.Random(stat)
+    transfers = random_transfers(rng, 500, days=40)
+    record(ledger, transfers)
+    ledger.flush()
+    for start, end in random_windows(rng, 100, days=40):
+        assert ledger.leaderboard(stat, start, end) == brute_force(transfers, stat, start, end)
+        assert ledger.leaderboard(stat, start, end, limit=2) == brute_force(transfers, stat, start, end, limit=2)
+
+
+def test_windows_include_transfers_that_are_not_written_yet(ledger):
+    rng = random.Random(1)
+    transfers = random_transfers(rng, 300, days=20)
+    record(ledger, transfers[:200])
+    ledger.flush()
+    # Not flushed: some or all of these are still waiting for the writer
+    record(ledger, transfers[200:])
+    for start, end in random_windows(rng, 30, days=20):
+        assert ledger.leaderboard('received', start, end, limit=3) == \
+            brute_force(transfers, 'received', start, end, limit=3)
+
+
+def test_transfers_are_kept_after_closing(tmp_path):
+    filename = str(tmp_path / 'cheer_ledger.sqlite')
+    transfers = random_transfers(random.Random(2), 50, days=10)
+    ledger = CheerLedger(filename)
+    record(ledger, transfers)
+    ledger.close()
+    reopened = CheerLedger(filename)
+    end = START + 10 * SECONDS_PER_DAY
+    assert reopened.leaderboard('given', START, end) == brute_force(transfers, 'given', START, end)
+    reopened.close()
+
+
+def failing_writes(monkeypatch, failures: int):
+    """
+    Make the next few writes fail, as a full or locked disk would
+    :return: How many writes have been tried, so far
+    """
+    attempts = []
+    write = CheerLedger._write
+
+    def flaky_write(connection, rows):
+        attempts.append(len(rows))
+        if len(attempts) <= failures:
+            raise sqlite3.OperationalError('database is locked')
+        return write(connection, rows)
+    monkeypatch.setattr(CheerLedger, '_write', staticmethod(flaky_write))
+    monkeypatch.setattr(cheer_ledger, 'RETRY_INTERVAL', .01)
+    return attempts
+
+
+def test_failed_writes_are_tried_again(ledger, monkeypatch):
+    attempts = failing_writes(monkeypatch, failures=3)
+    transfers = random_transfers(random.Random(3), 20, days=5)
+    record(ledger, transfers)
+    ledger.flush()
+    end = START + 5 * SECONDS_PER_DAY
+    # Written or not, the leaderboards have them
+    assert ledger.leaderboard('given', START, end) == brute_force(transfers, 'given', START, end)
+    deadline = time.perf_counter() + 10
+    while len(attempts) <= 3 and time.perf_counter() < deadline:
+        time.sleep(.01)
+    ledger.flush()
+    more = random_transfers(random.Random(4), 5, days=5)
+    record(ledger, more)
+    ledger.flush()
+    assert ledger.leaderboard('given', START, end) == brute_force(transfers + more, 'given', START, end)
+    assert ledger._connection.execute('SELECT COUNT(*) FROM transfers').fetchone()[0] == 25
+
+
+def test_flush_returns_when_writes_keep_failing(ledger, monkeypatch):
+    failing_writes(monkeypatch, failures=10 ** 9)
+    transfers = random_transfers(random.Random(5), 10, days=2)
+    record(ledger, transfers)
+    flushed = threading.Thread(target=ledger.flush, daemon=True)
+    flushed.start()
+    flushed.join(10)
+    assert not flushed.is_alive()
+    end = START + 2 * SECONDS_PER_DAY
+    assert ledger.leaderboard('received', START, end) == brute_force(transfers, 'received', START, end)
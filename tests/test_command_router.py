@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from command_router import CommandRouter
+
+BOT = 'UBOT'
+
+
+@pytest.fixture
+def router():
+    router = CommandRouter()
+    router.bot_user_id = BOT
+
+    @router.command('give', r'(?P<give_to>(<@[^>\s]+>\s+)+)(?P<how_much>[0-9]+)\s*(?P<texture>\S*)',
+                    usage='give @<user> <points> [texture]')
+    async def give(match, data, web_client):
+        return
+
+    @router.command('stats', r'(<@(?P<user>[^>|\s]+)[^>]*>)?')
+    async def stats(match, data, web_client):
+        return
+
+    @router.command('help')
+    async def help(match, data, web_client):
+        return
+    return router
+
+
+def parsed(router: CommandRouter, text: str, direct: bool = False):
+    """
+    :return: None if the message is not for the bot, otherwise the command name (None if it is not valid)
+    """
+    result = router.parse(text, direct=direct)
+    if result is None:
+        return None
+    command, match = result
+    return command.name if command is not None else None, match
+
+
+@pytest.mark.parametrize('text, expected', [
+    (f'<@{BOT}> help', 'help'),
+    (f'<@{BOT}>help', 'help'),
+    (f'<@{BOT}> HELP', 'help'),
+    (f'<@{BOT}> !help', 'help'),
+    (f'<@{BOT}> stats', 'stats'),
+    (f'<@{BOT}> stats <@U2|bob>', 'stats'),
+    (f'<@{BOT}> give <@U2> 5', 'give'),
+    (f'<@{BOT}> give <@U2> <@U3>  5 party', 'give'),
+])
+def test_commands_in_channels(router, text, expected):
+    assert parsed(router, text)[0] == expected
+
+
+@pytest.mark.parametrize('text', [
+    f'<@{BOT}> give <@U2>',
+    f'<@{BOT}> give 5',
+    f'<@{BOT}> help me',
+    f'<@{BOT}> dance',
+    f'<@{BOT}>',
+])
+def test_messages_to_the_bot_that_are_not_commands(router, text):
+    assert parsed(router, text) == (None, None)
+
+
+@pytest.mark.parametrize('text', [
+    'help',
+    'give <@U2> 5',
+    f'<@U2> help',
+    f'hey <@{BOT}> help',
+    '<!channel> help',
+    '',
+])
+def test_messages_not_for_the_bot(router, text):
+    assert parsed(router, text) is None
+
+
+def test_any_mention_counts_until_the_bot_knows_who_it_is(router):
+    router.bot_user_id = None
+    assert parsed(router, '<@U2> help')[0] == 'help'
+    assert parsed(router, '<@W2> help')[0] == 'help'
+
+
+def test_give_arguments(router):
+    name, match = parsed(router, f'<@{BOT}> give <@U2> <@U3> 12 party')
+    assert match.group('give_to').split() == ['<@U2>', '<@U3>']
+    assert match.group('how_much') == '12'
+    assert match.group('texture') == 'party'
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('help', 'help'),
+    ('!help', 'help'),
+    ('give <@U2> 5', 'give'),
+    # Unknown commands only get the help text if they were meant to be commands
+    ('!dance', None),
+    ('give 5', None),
+])
+def test_commands_in_direct_messages(router, text, expected):
+    assert parsed(router, text, direct=True)[0] == expected
+
+
+@pytest.mark.parametrize('text', ['hello, how are you?', 'thanks!', 'dance', ''])
+def test_small_talk_in_direct_messages(router, text):
+    assert parsed(router, text, direct=True) is None
+
+
+def test_dispatch(router):
+    calls = []
+
+    @router.command('echo', r'(?P<words>.*)')
+    async def echo(match, data, web_client):
+        calls.append(('echo', match.group('words'), data))
+        return
+
+    async def fallback(match, data, web_client):
+        calls.append(('fallback', match, data))
+        return
+    router.fallback = fallback
+
+    async def run():
+        return [
+            await router.dispatch(f'<@{BOT}> echo hi there', {'n': 1}, None),
+            await router.dispatch(f'<@{BOT}> dance', {'n': 2}, None),
+            await router.dispatch('just chatting', {'n': 3}, None),
+            await router.dispatch('just chatting', {'n': 4}, None, direct=True),
+            await router.dispatch('!dance', {'n': 5}, None, direct=True),
+        ]
+    assert asyncio.run(run()) == [True, True, False, False, True]
+    assert calls == [('echo', 'hi there', {'n': 1}), ('fallback', None, {'n': 2}), ('fallback', None, {'n': 5})]
@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import random_image
+from conftest import IMAGE_BYTES
+from random_image import PARTIAL_SUFFIX, PicsumSource, download_image, ensure_enough_random_images
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # Only the retries in random_image skip their back-off
+    monkeypatch.setattr(random_image, 'time', SimpleNamespace(sleep=lambda seconds: None))
+
+
+def image_url(server) -> str:
+    return server.url.format(width=20, height=10)
+
+
+def test_download_retries_server_errors(image_server, tmp_path):
+    image_server.failures = ['error', 'error']
+    destination = tmp_path / '0.jpg'
+    assert download_image(image_url(image_server), destination, retries=3) == destination
+    assert destination.read_bytes() == IMAGE_BYTES
+    assert image_server.requests == 3
+
+
+def test_download_retries_truncated_images(image_server, tmp_path):
+    image_server.failures = ['truncate']
+    destination = tmp_path / '0.jpg'
+    download_image(image_url(image_server), destination, retries=1)
+    assert destination.read_bytes() == IMAGE_BYTES
+    assert image_server.requests == 2
+
+
+def test_download_gives_up_and_cleans_up(image_server, tmp_path):
+    image_server.failures = ['truncate', 'error']
+    destination = tmp_path / '0.jpg'
+    with pytest.raises(OSError):
+        download_image(image_url(image_server), destination, retries=1)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_download_is_renamed_into_place(image_server, tmp_path):
+    image_server.failures = ['stall']
+    destination = tmp_path / '0.jpg'
+    download = threading.Thread(target=download_image, args=(image_url(image_server), destination))
+    download.start()
+    assert image_server.stalled.wait(10)
+    # Half of the image is on its way, and only the partial file gets it
+    partial = destination.with_name(f'0.jpg{PARTIAL_SUFFIX}')
+    deadline = time.perf_counter() + 10
+    while not partial.exists() and time.perf_counter() < deadline:
+        time.sleep(.01)
+    assert partial.exists()
+    assert not destination.exists()
+    image_server.resume.set()
+    download.join(10)
+    assert destination.read_bytes() == IMAGE_BYTES
+    assert [p.name for p in tmp_path.iterdir()] == ['0.jpg']
+
+
+def test_interrupted_downloads_are_fetched_again(image_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(random_image, 'image_source', PicsumSource(url=image_server.url, workers=2))
+    full_path = tmp_path / 'random' / '20' / '10'
+    full_path.mkdir(parents=True)
+    # A run that stopped after one image, part way through the second
+    (full_path / '0.jpg').write_bytes(IMAGE_BYTES)
+    (full_path / f'1.jpg{PARTIAL_SUFFIX}').write_bytes(IMAGE_BYTES[:100])
+    files = ensure_enough_random_images(width=20, height=10, count=3, path=tmp_path)
+    assert sorted(f.name for f in files) == ['0.jpg', '1.jpg', '2.jpg']
+    assert all(f.read_bytes() == IMAGE_BYTES for f in files)
+    assert not list(full_path.glob(f'*{PARTIAL_SUFFIX}'))
+    assert json.load(open(full_path / 'manifest.json')) == ['0.jpg', '1.jpg', '2.jpg']
+    assert image_server.requests == 2
+
+
+def test_concurrent_callers_download_each_image_once(image_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(random_image, 'image_source', PicsumSource(url=image_server.url, workers=4))
+    callers = [threading.Thread(target=ensure_enough_random_images, args=(20, 10, 6, tmp_path)) for _ in range(4)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join(10)
+    files = ensure_enough_random_images(width=20, height=10, count=6, path=tmp_path)
+    assert sorted(f.name for f in files) == [f'{i}.jpg' for i in range(6)]
+    assert image_server.requests == 6
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from voxel_store import ENCODING_RAW, ENCODING_RLE, ENCODING_UNIFORM, VoxelStore, decode_chunk, encode_chunk
+
+CHUNK_SIZE = 16
+
+
+def round_trip(blocks: np.ndarray):
+    encoding, value, data = encode_chunk(blocks)
+    decoded = decode_chunk(encoding, value, np.frombuffer(data, dtype=np.uint8), blocks.shape[0])
+    np.testing.assert_array_equal(decoded, blocks)
+    return encoding
+
+
+def layered_chunk(size: int = CHUNK_SIZE) -> np.ndarray:
+    blocks = np.zeros((size,) * 3, dtype=np.uint8)
+    blocks[:, :size // 2] = 3
+    blocks[:, :2] = 1
+    blocks[4, 9, 11] = 250
+    return blocks
+
+
+def test_uniform_chunks_have_no_data():
+    blocks = np.full((CHUNK_SIZE,) * 3, 7, dtype=np.uint8)
+    assert encode_chunk(blocks) == (ENCODING_UNIFORM, 7, b'')
+    assert round_trip(blocks) == ENCODING_UNIFORM
+
+
+def test_layered_chunks_are_run_length_encoded():
+    blocks = layered_chunk()
+    encoding, _, data = encode_chunk(blocks)
+    assert encoding == ENCODING_RLE
+    assert len(data) < blocks.size // 10
+    assert round_trip(blocks) == ENCODING_RLE
+
+
+def test_noisy_chunks_are_stored_raw():
+    blocks = np.random.default_rng(0).integers(0, 256, (CHUNK_SIZE,) * 3, dtype=np.uint8)
+    assert round_trip(blocks) == ENCODING_RAW
+
+
+def test_runs_too_long_for_uint16_are_stored_raw():
+    # 48 ** 3 blocks, nearly all in one run
+    blocks = np.zeros((48,) * 3, dtype=np.uint8)
+    blocks[-1, -1, -1] = 1
+    assert round_trip(blocks) == ENCODING_RAW
+
+
+def test_unknown_encodings_are_rejected():
+    with pytest.raises(ValueError):
+        decode_chunk(9, 0, np.zeros(0, dtype=np.uint8), CHUNK_SIZE)
+
+
+def test_store_round_trip(tmp_path):
+    rng = np.random.default_rng(1)
+    chunks = {
+        (0, 0, 0): np.full((CHUNK_SIZE,) * 3, 2, dtype=np.uint8),
+        (1, 0, -1): layered_chunk(),
+        (-3, 2, 5): rng.integers(0, 256, (CHUNK_SIZE,) * 3, dtype=np.uint8),
+    }
+    store = VoxelStore(chunk_size=CHUNK_SIZE, metadata={'seed': 42, 'block_images': ['3.jpg', '0.jpg']})
+    for key, blocks in chunks.items():
+        store.set_chunk(key, blocks.copy(), modified=True)
+    # Kept encoded once it is out of memory
+    store.remove_chunk((1, 0, -1))
+    path = tmp_path / 'world.vox'
+    store.save(path)
+
+    loaded = VoxelStore.load(path)
+    assert loaded.chunk_size == CHUNK_SIZE
+    assert loaded.metadata == store.metadata
+    assert sorted(loaded.keys()) == sorted(chunks)
+    for key, blocks in chunks.items():
+        assert loaded.has_saved(key)
+        np.testing.assert_array_equal(loaded.saved_chunk(key), blocks)
+    assert loaded.saved_chunk((9, 9, 9)) is None
+
+    # Saving a loaded store copies the chunks that were never decoded straight from the old file
+    changed = layered_chunk()
+    changed[0, 0, 0] = 99
+    loaded.set_chunk((1, 0, -1), changed, modified=True)
+    again = tmp_path / 'again.vox'
+    loaded.save(again)
+    reloaded = VoxelStore.load(again)
+    np.testing.assert_array_equal(reloaded.saved_chunk((1, 0, -1)), changed)
+    np.testing.assert_array_equal(reloaded.saved_chunk((-3, 2, 5)), chunks[(-3, 2, 5)])
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'not_a_world.vox'
+    path.write_bytes(b'\x00' * 64)
+    with pytest.raises(ValueError):
+        VoxelStore.load(path)
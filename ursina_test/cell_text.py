@@ -0,0 +1,322 @@
+#
+# Fixed-width text laid out on a grid of cells, where changing some text only rewrites the cells that changed
+#
+
+import re
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from panda3d.core import (Geom, GeomNode, GeomTriangles, GeomVertexData, GeomVertexFormat, GeomVertexWriter,
+                          SamplerState, Texture as PandaTexture, TransparencyAttrib)
+from PIL import Image, ImageDraw, ImageFont
+from ursina import *
+
+# Markup tags that change the colour of the text after them, such as <red>
+MARKUP_REGEX = re.compile(r'<(\w+)>')
+# Glyphs rendered into a new atlas before anything asks for them
+PRELOADED_GLYPHS = ''.join(chr(c) for c in range(32, 127))
+# Shown for glyphs once the atlas is full
+MISSING_GLYPH = '?'
+
+
+def find_font(font: str) -> Path:
+    """
+    Find a font file the same way ursina does: as given, then in the project, then in ursina itself
+    :param font: The font's file name, such as "VeraMono.ttf"
+    """
+    fonts_folder = getattr(application, 'fonts_folder', Path('fonts'))
+    internal_fonts_folder = getattr(application, 'internal_fonts_folder', application.package_folder / 'fonts')
+    for path in (Path(font), Path(fonts_folder) / font, Path(internal_fonts_folder) / font):
+        if path.exists():
+            return path
+    raise FileNotFoundError(f'Could not find font: {font}')
+
+
+class GlyphAtlas:
+    """
+    The glyphs of one fixed-width font, each rendered once into a tile of a shared texture.
+    Printable ASCII is rendered up front, and anything else the first time it is asked for.
+    """
+    def __init__(self, font: str = 'VeraMono.ttf', pixel_size: int = 32, tiles_per_side: int = 16):
+        """
+        :param font: The font's file name
+        :param pixel_size: How big to render the glyphs, in pixels
+        :param tiles_per_side: The atlas holds this many glyphs squared
+        """
+        self._font = ImageFont.truetype(str(find_font(font)), pixel_size)
+        ascent, descent = self._font.getmetrics()
+        self.tile_width = int(round(self._font.getlength('M')))
+        self.tile_height = ascent + descent
+        # Width of a cell compared to its height
+        self.aspect = self.tile_width / self.tile_height
+        self.tiles_per_side = tiles_per_side
+        self._pixels = np.zeros((tiles_per_side * self.tile_height, tiles_per_side * self.tile_width, 4),
+                                dtype=np.uint8)
+        self._pixels[..., :3] = 255
+        # (u0, v0, u1, v1) for each tile
+        self.uvs = np.zeros((tiles_per_side * tiles_per_side, 4), dtype=np.float32)
+        self._tiles: Dict[str, int] = {}
+        self.panda_texture = PandaTexture(f'glyphs_{Path(font).stem}_{pixel_size}')
+        self.panda_texture.setup_2d_texture(self._pixels.shape[1], self._pixels.shape[0],
+                                             PandaTexture.T_unsigned_byte, PandaTexture.F_rgba8)
+        self.panda_texture.set_wrap_u(SamplerState.WM_clamp)
+        self.panda_texture.set_wrap_v(SamplerState.WM_clamp)
+        for glyph in PRELOADED_GLYPHS:
+            self._render(glyph)
+        self._upload()
+        return
+
+    def _render(self, glyph: str) -> int:
+        tile = len(self._tiles)
+        column = tile % self.tiles_per_side
+        row = tile // self.tiles_per_side
+        mask = Image.new('L', (self.tile_width, self.tile_height), 0)
+        ImageDraw.Draw(mask).text((0, 0), glyph, font=self._font, fill=255)
+        x = column * self.tile_width
+        y = row * self.tile_height
+        self._pixels[y:y + self.tile_height, x:x + self.tile_width, 3] = np.asarray(mask)
+        height, width = self._pixels.shape[:2]
+        # Pull in by half a texel so neighbouring glyphs don't bleed in. Rows count down from the top
+        # of the image, but v counts up from the bottom.
+        self.uvs[tile] = ((x + .5) / width, 1 - (y + self.tile_height - .5) / height,
+                          (x + self.tile_width - .5) / width, 1 - (y + .5) / height)
+        self._tiles[glyph] = tile
+        return tile
+
+    def _upload(self):
+        # Panda wants the bottom row first
+        self.panda_texture.set_ram_image_as(np.ascontiguousarray(self._pixels[::-1]).tobytes(), 'RGBA')
+        return
+
+    def tile(self, glyph: str) -> int:
+        """
+        Get the tile a glyph is in, rendering it if this is the first time it is needed
+        :param glyph: One character
+        """
+        tile = self._tiles.get(glyph, None)
+        if tile is None:
+            if len(self._tiles) >= len(self.uvs):
+                return self._tiles[MISSING_GLYPH]
+            tile = self._render(glyph)
+            self._upload()
+        return tile
+
+
+# Glyph atlases, by (font, pixel size), shared by every CellText using the same font
+_glyph_atlases: Dict[Tuple[str, int], GlyphAtlas] = {}
+
+
+def glyph_atlas(font: str = 'VeraMono.ttf', pixel_size: int = 32) -> GlyphAtlas:
+    """
+    Get the glyph atlas for a font, making it the first time
+    :param font: The font's file name
+    :param pixel_size: How big to render the glyphs, in pixels
+    """
+    atlas = _glyph_atlases.get((font, pixel_size), None)
+    if atlas is None:
+        atlas = GlyphAtlas(font, pixel_size)
+        _glyph_atlases[(font, pixel_size)] = atlas
+    return atlas
+
+
+class CellText(Entity):
+    """
+    A Text replacement for text that changes often, such as the scoreboard or the debug overlay.
+    Each character is a quad in one mesh, on a grid of fixed-width cells. Setting new text compares it
+    with what is shown and only rewrites the UVs and colours of the cells that changed, and the background
+    is one quad that is moved and scaled rather than rebuilt.
+    Supports the same colour markup as Text, such as "<red>", and "<default>" for the starting colour.
+    """
+    def __init__(self, text: str = '', columns: int = 40, rows: int = 4, font: str = 'VeraMono.ttf',
+                 size: float = Text.size, origin=(-.5, .5), color=color.white,
+                 background_color: Optional[color.Color] = color.black66, **kwargs):
+        """
+        :param text: The text to show
+        :param columns: The starting width of the grid. It grows if the text is wider.
+        :param rows: The starting height of the grid. It grows if the text has more lines.
+        :param font: A fixed-width font
+        :param size: The height of a line, in the parent's units
+        :param origin: Which part of the text is at the position, like Text's origin
+        :param color: The colour of text that has no markup
+        :param background_color: The colour of the background, or None for no background
+        """
+        kwargs.setdefault('parent', camera.ui)
+        super().__init__(**kwargs)
+        self.size = size
+        self.text_origin = origin
+        self.default_color = color
+        self._atlas = glyph_atlas(font)
+        self._glyphs = self.attach_new_node(GeomNode('cell_text'))
+        self._glyphs.set_texture(self._atlas.panda_texture)
+        self._glyphs.set_transparency(TransparencyAttrib.M_alpha)
+        self._glyphs.set_scale(size)
+        self._background = None
+        if background_color is not None:
+            self._background = Entity(parent=self, model='quad', color=background_color, z=.01)
+        self._columns = 0
+        self._rows = 0
+        self._tiles = np.zeros((0, 0), dtype=np.int32)
+        self._colors = np.zeros((0, 0, 4), dtype=np.float32)
+        # The markup each row was last set to, so rows that did not change can be skipped without parsing
+        self._lines: List[str] = []
+        # How many characters are on each row
+        self._line_lengths: List[int] = []
+        # The colour each row ends with, which the next row starts with
+        self._end_colors: List[color.Color] = []
+        self._line_count = 0
+        self._resize(columns, rows)
+        self._text = ''
+        self.text = text
+        return
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @text.setter
+    def text(self, text: str):
+        self._text = text
+        lines = text.split('\n')
+        self._line_count = len(lines) if text else 0
+        if len(lines) > self._rows:
+            self._resize(self._columns, len(lines))
+        # Parse each line starting with the colour the previous line ended with, like Text does
+        line_color = self.default_color
+        for row in range(self._rows):
+            line = lines[row] if row < len(lines) else ''
+            line_color = self._set_line(row, line, line_color)
+        self._update_layout()
+        return
+
+    def _set_line(self, row: int, line: str, start_color: color.Color) -> color.Color:
+        """
+        Show one line of text, rewriting only the cells that changed
+        :param row: The row to show it on, starting from 0 at the top
+        :param line: The text, which may contain colour markup
+        :param start_color: The colour before any markup
+        :return: The colour at the end of the line
+        """
+        key = f'{tuple(start_color)}{line}'
+        if row < len(self._lines) and self._lines[row] == key:
+            return self._end_colors[row]
+        glyphs, colors, end_color = self._parse(line, start_color)
+        if len(glyphs) > self._columns or row >= self._rows:
+            self._resize(max(len(glyphs), self._columns), max(row + 1, self._rows))
+        tiles = np.full(self._columns, self._atlas.tile(' '), dtype=np.int32)
+        tiles[:len(glyphs)] = [self._atlas.tile(g) for g in glyphs]
+        row_colors = np.zeros((self._columns, 4), dtype=np.float32)
+        if colors:
+            row_colors[:len(colors)] = colors
+        changed = np.nonzero((self._tiles[row] != tiles) | (self._colors[row] != row_colors).any(axis=1))[0]
+        self._tiles[row] = tiles
+        self._colors[row] = row_colors
+        self._write_cells(row, changed.tolist())
+        self._lines[row] = key
+        self._end_colors[row] = end_color
+        self._line_lengths[row] = len(glyphs)
+        return end_color
+
+    def _parse(self, line: str, start_color: color.Color):
+        glyphs = []
+        colors = []
+        current_color = start_color
+        position = 0
+        for match in MARKUP_REGEX.finditer(line):
+            name = match.group(1)
+            tag_color = self.default_color if name == 'default' else getattr(color, name, None)
+            if not isinstance(tag_color, color.Color):
+                # Not a colour, so it is just text
+                continue
+            text = line[position:match.start()]
+            glyphs.extend(text)
+            colors.extend([tuple(current_color)] * len(text))
+            current_color = tag_color
+            position = match.end()
+        text = line[position:]
+        glyphs.extend(text)
+        colors.extend([tuple(current_color)] * len(text))
+        return glyphs, colors, current_color
+
+    def _resize(self, columns: int, rows: int):
+        """
+        Grow the grid, building a new mesh with one quad per cell. Only happens when text does not fit.
+        """
+        old_tiles = self._tiles
+        old_colors = self._colors
+        self._tiles = np.full((rows, columns), self._atlas.tile(' '), dtype=np.int32)
+        self._colors = np.zeros((rows, columns, 4), dtype=np.float32)
+        self._tiles[:old_tiles.shape[0], :old_tiles.shape[1]] = old_tiles
+        self._colors[:old_colors.shape[0], :old_colors.shape[1]] = old_colors
+        added_rows = rows - self._rows
+        self._lines += [''] * added_rows
+        self._line_lengths += [0] * added_rows
+        self._end_colors += [self.default_color] * added_rows
+        self._columns = columns
+        self._rows = rows
+
+        vertex_data = GeomVertexData('cell_text', GeomVertexFormat.get_v3c4t2(), Geom.UH_dynamic)
+        vertex_data.set_num_rows(rows * columns * 4)
+        vertex = GeomVertexWriter(vertex_data, 'vertex')
+        width = self._atlas.aspect
+        # Cell (0, 0) is at the top left, a line lower for each row. This is below ursina, where z is up.
+        for row in range(rows):
+            for column in range(columns):
+                x0 = column * width
+                x1 = x0 + width
+                vertex.add_data3(x0, 0, -row - 1)
+                vertex.add_data3(x1, 0, -row - 1)
+                vertex.add_data3(x1, 0, -row)
+                vertex.add_data3(x0, 0, -row)
+        triangles = GeomTriangles(Geom.UH_static)
+        for cell in range(rows * columns):
+            first = cell * 4
+            triangles.add_vertices(first, first + 1, first + 2)
+            triangles.add_vertices(first, first + 2, first + 3)
+        geom = Geom(vertex_data)
+        geom.add_primitive(triangles)
+        node = self._glyphs.node()
+        node.remove_all_geoms()
+        node.add_geom(geom)
+        for row in range(rows):
+            self._write_cells(row, range(columns))
+        return
+
+    def _write_cells(self, row: int, columns):
+        """
+        Write the UVs and colours of some cells in one row
+        """
+        vertex_data = self._glyphs.node().modify_geom(0).modify_vertex_data()
+        texcoord = GeomVertexWriter(vertex_data, 'texcoord')
+        vertex_color = GeomVertexWriter(vertex_data, 'color')
+        for column in columns:
+            first = (row * self._columns + column) * 4
+            u0, v0, u1, v1 = self._atlas.uvs[self._tiles[row, column]]
+            texcoord.set_row(first)
+            texcoord.set_data2(u0, v0)
+            texcoord.set_data2(u1, v0)
+            texcoord.set_data2(u1, v1)
+            texcoord.set_data2(u0, v1)
+            r, g, b, a = self._colors[row, column]
+            vertex_color.set_row(first)
+            for _ in range(4):
+                vertex_color.set_data4(r, g, b, a)
+        return
+
+    def _update_layout(self):
+        """
+        Move the glyphs and background so the origin of the text is at the entity's position
+        """
+        columns = max(self._line_lengths) if self._line_lengths else 0
+        rows = self._line_count
+        width = columns * self._atlas.aspect * self.size
+        height = rows * self.size
+        # Top left corner of the text, relative to the origin
+        left = -(self.text_origin[0] + .5) * width
+        top = (.5 - self.text_origin[1]) * height
+        self._glyphs.set_pos(left, 0, top)
+        if self._background:
+            padding = self.size * 2
+            self._background.visible = bool(self._text)
+            self._background.position = (left + width / 2, top - height / 2, .01)
+            self._background.scale = (width + padding, height + padding)
+        return
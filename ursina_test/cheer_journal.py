@@ -0,0 +1,171 @@
+#
+# Cheer persistence: a snapshot file plus an append-only journal of changes since the snapshot
+#
+
+import atexit
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+from shutil import copy2
+from typing import Any, Callable, Dict, Optional
+
+from frame_profiler import profiler
+
+# Stop the writer thread
+_STOP = object()
+
+
+def load_snapshot(filename: str) -> Dict[str, Any]:
+    """
+    Load cheer data from a snapshot file
+    :param filename: The snapshot file
+    """
+    if not Path(filename).exists():
+        return {}
+    return json.load(open(filename, 'r'))
+
+
+def save_snapshot(filename: str, cheer_data: Dict[str, Any]):
+    """
+    Write cheer data to a snapshot file, backing up the old one and replacing it atomically
+    :param filename: The snapshot file
+    :param cheer_data: The cheer data
+    """
+    if Path(filename).exists():
+        copy2(filename, f'{filename}.bak')
+    temp_filename = f'{filename}.tmp'
+    with open(temp_filename, 'w+') as f:
+        json.dump(cheer_data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_filename, filename)
+    return
+
+
+def replay_journal(filename: str, cheer_data: Dict[str, Any]) -> int:
+    """
+    Apply the records in a journal to cheer data
+    :param filename: The journal file
+    :param cheer_data: The cheer data to update
+    :return: The number of records applied
+    """
+    if not Path(filename).exists():
+        return 0
+    applied = 0
+    with open(filename, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be cut short if the process died while writing it
+                break
+            cheer_data.update(record)
+            applied += 1
+    return applied
+
+
+class CheerJournal:
+    """
+    Each change is one small record (the new values for the attendees that changed) appended to the journal
+    by a background thread, which writes everything that has queued up in one go with one fsync.
+    Every so often the journal is folded into the snapshot and emptied.
+    """
+    def __init__(self, snapshot_filename: str = 'cheer.json', journal_filename: str = 'cheer.journal',
+                 compact_every: int = 1000):
+        """
+        :param snapshot_filename: Where the full cheer data is stored
+        :param journal_filename: Where the changes since the snapshot are stored
+        :param compact_every: How many records to write before compacting
+        """
+        self.snapshot_filename = snapshot_filename
+        self.journal_filename = journal_filename
+        self.compact_every = compact_every
+        # The writer's own copy of the data, for compacting without touching the caller's copy
+        self._cheer_data: Dict[str, Any] = {}
+        self._records_since_compact = 0
+        # How many records have been queued, and how many of those are safely on disk
+        self.recorded = 0
+        self.written = 0
+        # Called from the writer thread with the new value of written, each time some records are on disk
+        self.on_write: Optional[Callable[[int], None]] = None
+        self._queue = queue.Queue()
+        self._thread = None
+        return
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Rebuild the cheer data from the snapshot and journal, and start the writer
+        :return: The cheer data
+        """
+        cheer_data = load_snapshot(self.snapshot_filename)
+        replay_journal(self.journal_filename, cheer_data)
+        self._cheer_data = json.loads(json.dumps(cheer_data))
+        if Path(self.journal_filename).exists() and Path(self.journal_filename).stat().st_size:
+            # Start from a clean snapshot, so nothing is appended after a record that was cut short
+            self._compact()
+        self._thread = threading.Thread(target=self._write_records, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return cheer_data
+
+    def record(self, changes: Dict[str, Dict[str, Any]]):
+        """
+        Queue the new values for some attendees to be written
+        :param changes: The attendees that changed, by username
+        """
+        self._queue.put(json.dumps(changes))
+        self.recorded += 1
+        return
+
+    def _write_records(self):
+        journal = open(self.journal_filename, 'a')
+        running = True
+        while running:
+            lines = [self._queue.get()]
+            # Group everything else that is waiting into the same write
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in lines:
+                running = False
+                lines = [line for line in lines if line is not _STOP]
+            if lines:
+                with profiler.section('journal write'):
+                    journal.write(''.join(f'{line}\n' for line in lines))
+                    journal.flush()
+                    os.fsync(journal.fileno())
+                for line in lines:
+                    self._cheer_data.update(json.loads(line))
+                self._records_since_compact += len(lines)
+                self.written += len(lines)
+                if self.on_write is not None:
+                    self.on_write(self.written)
+            if self._records_since_compact >= self.compact_every or (not running and self._records_since_compact):
+                journal.close()
+                self._compact()
+                journal = open(self.journal_filename, 'a')
+        journal.close()
+        return
+
+    def _compact(self):
+        # If this is interrupted after the snapshot is written, replaying the journal again is harmless,
+        # since each record holds new values rather than differences.
+        save_snapshot(self.snapshot_filename, self._cheer_data)
+        open(self.journal_filename, 'w').close()
+        self._records_since_compact = 0
+        return
+
+    def stop(self):
+        """
+        Write everything that is queued, compact, and stop the writer
+        """
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        return
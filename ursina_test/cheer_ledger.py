@@ -0,0 +1,311 @@
+#
+# Every cheer transfer, kept in SQLite with daily and weekly totals so leaderboards over any time window are quick
+#
+
+import atexit
+import datetime
+import math
+import queue
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+SECONDS_PER_DAY = 24 * 60 * 60
+# Day 0 (1970-01-01) was a Thursday, so weeks start on Monday this many days before a multiple of 7
+WEEK_START_OFFSET = 3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS transfers (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    giver TEXT NOT NULL,
+    receiver TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    texture TEXT
+);
+CREATE INDEX IF NOT EXISTS transfers_by_time ON transfers (timestamp);
+CREATE TABLE IF NOT EXISTS daily_totals (
+    day INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    given INTEGER NOT NULL DEFAULT 0,
+    received INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, username)
+);
+CREATE TABLE IF NOT EXISTS weekly_totals (
+    week INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    given INTEGER NOT NULL DEFAULT 0,
+    received INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (week, username)
+);
+'''
+
+# Add to a user's total for a day or week, creating the row if needed
+ADD_TO_TOTAL = '''
+INSERT INTO {table} ({period}, username, {stat}) VALUES (?, ?, ?)
+ON CONFLICT ({period}, username) DO UPDATE SET {stat} = {stat} + excluded.{stat}
+'''
+
+# Which column of the transfers table each stat comes from
+STAT_COLUMNS = {'given': 'giver', 'received': 'receiver'}
+
+# Queued to stop the writer
+_STOP = object()
+# How long to wait before trying again to write transfers that could not be written, in seconds
+RETRY_INTERVAL = 1
+
+# (id, timestamp, giver, receiver, points, texture)
+TransferRow = Tuple[int, float, str, str, int, Optional[str]]
+
+
+def day_of(timestamp: float) -> int:
+    """
+    Get the (UTC) day a time is in, counting from 1970-01-01
+    """
+    return int(timestamp // SECONDS_PER_DAY)
+
+
+def week_of_day(day: int) -> int:
+    """
+    Get the week (starting on Monday) a day is in
+    """
+    return (day + WEEK_START_OFFSET) // 7
+
+
+def start_of_day(now: float) -> float:
+    """
+    Get the local midnight before a time
+    """
+    return datetime.datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+
+def start_of_week(now: float) -> float:
+    """
+    Get the local midnight at the start of the Monday before a time
+    """
+    midnight = datetime.datetime.fromtimestamp(start_of_day(now))
+    return (midnight - datetime.timedelta(days=midnight.weekday())).timestamp()
+
+
+class CheerLedger:
+    """
+    An append-only record of cheer transfers. Each transfer also adds to the giver's and receiver's daily
+    and weekly totals, so a leaderboard over a window only reads whole weeks and days from the totals,
+    and just the partial days at either end from the transfers themselves.
+    Transfers to yourself are recorded, but do not count as given or received.
+
+    Recording a transfer does not wait for the disk: transfers are written by a background thread, with
+    everything that has queued up in one transaction. Until then, leaderboards add them in from memory.
+    Each transfer's id is given out when it is recorded, so a leaderboard can tell which of the transfers in
+    memory its query already found on disk. Only one process (the one that owns the cheer data) records
+    transfers; the others only read.
+    """
+    def __init__(self, filename: str = 'cheer_ledger.sqlite'):
+        """
+        :param filename: The SQLite database file
+        """
+        self.filename = filename
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode a power cut can lose the last few transfers, but never corrupts the ledger
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+        # Only one query at a time on the connection, which the writer does not use
+        self._read_lock = threading.Lock()
+        self._lock = threading.Lock()
+        # Transfers that have been recorded but not written yet, in the order they were recorded
+        self._pending: List[TransferRow] = []
+        self._next_id = self._connection.execute('SELECT COALESCE(MAX(id), 0) FROM transfers').fetchone()[0] + 1
+        self._queue = queue.Queue()
+        # Started by the first transfer, so ledgers that are only read from do not have one
+        self._thread = None
+        return
+
+    def record(self, giver: str, receiver: str, points: int, texture: Optional[str] = None,
+               timestamp: Optional[float] = None):
+        """
+        Record a transfer
+        :param giver: The username the points came from
+        :param receiver: The username the points went to
+        :param points: The number of points transferred
+        :param texture: The cheer texture that was shown
+        :param timestamp: When it happened, or None for now
+        """
+        self.record_many([(giver, receiver, points, texture)], timestamp=timestamp)
+        return
+
+    def record_many(self, transfers: List[Tuple[str, str, int, Optional[str]]], timestamp: Optional[float] = None):
+        """
+        Record several transfers, to be written in one transaction
+        :param transfers: (giver, receiver, points, texture) for each transfer
+        :param timestamp: When they happened, or None for now
+        """
+        if not transfers:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            rows = [(self._next_id + i, timestamp, giver, receiver, points, texture)
+                    for i, (giver, receiver, points, texture) in enumerate(transfers)]
+            self._next_id += len(rows)
+            # Queued under the lock, so the writer takes them in the same order as they are pending
+            self._pending.extend(rows)
+            self._queue.put(rows)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_transfers, daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+        return
+
+    def _write_transfers(self):
+        connection = sqlite3.connect(self.filename)
+        # Transfers that could not be written, which are tried again before anything newer
+        failed: List[TransferRow] = []
+        running = True
+        while running:
+            batches = []
+            try:
+                batches.append(self._queue.get(timeout=RETRY_INTERVAL if failed else None))
+            except queue.Empty:
+                pass
+            # Group everything else that is waiting into the same transaction
+            while True:
+                try:
+                    batches.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                running = _STOP not in batches
+                rows = failed + [row for batch in batches if batch is not _STOP for row in batch]
+                if not rows:
+                    continue
+                try:
+                    self._write(connection, rows)
+                except Exception as e:
+                    # Kept in memory (and in the leaderboards) until they can be written
+                    failed = rows
+                    print(f'Could not write {len(rows)} transfers to {self.filename} ({e}), '
+                          f'{"trying again" if running else "giving up"}')
+                    continue
+                failed = []
+                with self._lock:
+                    del self._pending[:len(rows)]
+            finally:
+                # Even if writing failed, so flush() never waits for a writer that has given up on them
+                for _ in batches:
+                    self._queue.task_done()
+        connection.close()
+        return
+
+    @staticmethod
+    def _write(connection: sqlite3.Connection, rows: List[TransferRow]):
+        with connection:
+            connection.executemany(
+                'INSERT INTO transfers (id, timestamp, giver, receiver, points, texture) VALUES (?, ?, ?, ?, ?, ?)',
+                rows)
+            for _, timestamp, giver, receiver, points, texture in rows:
+                if giver == receiver:
+                    continue
+                day = day_of(timestamp)
+                periods = (('daily_totals', 'day', day), ('weekly_totals', 'week', week_of_day(day)))
+                for table, period, value in periods:
+                    connection.execute(ADD_TO_TOTAL.format(table=table, period=period, stat='given'),
+                                       (value, giver, points))
+                    connection.execute(ADD_TO_TOTAL.format(table=table, period=period, stat='received'),
+                                       (value, receiver, points))
+        return
+
+    def flush(self):
+        """
+        Wait until the writer has tried to write every transfer recorded so far, for other processes
+        reading the ledger
+        """
+        if self._thread is not None:
+            self._queue.join()
+        return
+
+    def stop(self):
+        """
+        Write every transfer that is queued, and stop the writer
+        """
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        return
+
+    def leaderboard(self, stat: str, start: float, end: Optional[float] = None,
+                    limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        Get the users with the highest totals over a window of time
+        :param stat: "given" or "received"
+        :param start: The start of the window, as a timestamp
+        :param end: The end of the window (not included), or None for now
+        :param limit: The most users to return, or None for everyone
+        :return: (username, total) pairs, highest first
+        """
+        column = STAT_COLUMNS[stat]
+        end = time.time() if end is None else end
+        parts = []
+        parameters = []
+
+        def add_transfers(part_start, part_end):
+            parts.append(f'SELECT {column} AS username, points AS total FROM transfers '
+                         f'WHERE timestamp >= ? AND timestamp < ? AND giver != receiver')
+            parameters.extend((part_start, part_end))
+            return
+
+        def add_totals(table, period, part_start, part_end):
+            parts.append(f'SELECT username, {stat} AS total FROM {table} WHERE {period} >= ? AND {period} < ?')
+            parameters.extend((part_start, part_end))
+            return
+
+        # The whole days in the window, and the whole weeks within those
+        first_day = math.ceil(start / SECONDS_PER_DAY)
+        end_day = day_of(end)
+        if first_day >= end_day:
+            add_transfers(start, end)
+        else:
+            add_transfers(start, first_day * SECONDS_PER_DAY)
+            add_transfers(end_day * SECONDS_PER_DAY, end)
+            first_week = -(-(first_day + WEEK_START_OFFSET) // 7)
+            end_week = week_of_day(end_day)
+            if first_week >= end_week:
+                add_totals('daily_totals', 'day', first_day, end_day)
+            else:
+                add_totals('daily_totals', 'day', first_day, first_week * 7 - WEEK_START_OFFSET)
+                add_totals('daily_totals', 'day', end_week * 7 - WEEK_START_OFFSET, end_day)
+                add_totals('weekly_totals', 'week', first_week, end_week)
+        query = (f'SELECT username, SUM(total) AS window_total FROM ({" UNION ALL ".join(parts)}) '
+                 f'GROUP BY username HAVING window_total > 0 ORDER BY window_total DESC, username')
+        # Taken before the query, so anything that is not in it was written before the query started
+        with self._lock:
+            pending = [row for row in self._pending if start <= row[1] < end and row[2] != row[3]]
+        if limit is not None and not pending:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+        with self._read_lock:
+            # One read transaction, so the last id written matches what the query sees
+            self._connection.execute('BEGIN')
+            try:
+                written = self._connection.execute('SELECT COALESCE(MAX(id), 0) FROM transfers').fetchone()[0]
+                leaderboard = self._connection.execute(query, parameters).fetchall()
+            finally:
+                self._connection.execute('COMMIT')
+        pending = [row for row in pending if row[0] > written]
+        if not pending:
+            return leaderboard if limit is None else leaderboard[:limit]
+        totals = dict(leaderboard)
+        for _, timestamp, giver, receiver, points, texture in pending:
+            username = giver if stat == 'given' else receiver
+            totals[username] = totals.get(username, 0) + points
+        leaderboard = sorted(((username, total) for username, total in totals.items() if total > 0),
+                             key=lambda item: (-item[1], item[0]))
+        return leaderboard[:limit] if limit is not None else leaderboard
+
+    def close(self):
+        self.stop()
+        with self._read_lock:
+            self._connection.close()
+        return
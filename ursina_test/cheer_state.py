@@ -0,0 +1,235 @@
+#
+# Everyone's cheer points, kept ranked and saved, without anything to do with showing them
+#
+
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from cheer_journal import CheerJournal
+from cheer_ranking import CheerRanking
+from cheer_ledger import CheerLedger, start_of_day, start_of_week
+
+# Sort keys for leaderboards over a window of time: (title, ledger stat, start of the window from now)
+WINDOWED_SORT_KEYS = {
+    'given_today': ('Given today', 'given', start_of_day),
+    'received_today': ('Received today', 'received', start_of_day),
+    'given_this_week': ('Given this week', 'given', start_of_week),
+    'received_this_week': ('Received this week', 'received', start_of_week),
+    'given_this_sprint': ('Given this sprint', 'given', lambda now: now - 14 * 24 * 60 * 60),
+}
+
+# Where the textures for cheers are, one file per cheer
+CHEERS_TEXTURES_FOLDER = 'textures/cheers'
+# The cheer to show when no texture, or an unknown one, is asked for
+DEFAULT_CHEER_TEXTURE = 'star'
+
+# The new values for the attendees that changed, by username
+Changes = Dict[str, Dict[str, Any]]
+
+# The textures in CHEERS_TEXTURES_FOLDER, found the first time they are needed
+_cheers_textures: Optional[List[str]] = None
+
+
+def find_cheers_textures() -> List[str]:
+    globbed = Path(CHEERS_TEXTURES_FOLDER).glob('*')
+    textures = [p.stem for p in globbed]
+    return textures
+
+
+def cheers_textures() -> List[str]:
+    """
+    Get the textures there are for cheers, looking for them the first time
+    """
+    global _cheers_textures
+    if _cheers_textures is None:
+        _cheers_textures = find_cheers_textures()
+    return _cheers_textures
+
+
+def cheer_texture(texture: Optional[str], textures: List[str]) -> str:
+    """
+    Get the texture to show for a cheer
+    :param texture: The texture that was asked for
+    :param textures: The textures there are
+    """
+    if not texture or texture not in textures:
+        texture = DEFAULT_CHEER_TEXTURE
+    return texture
+
+
+class CheerState:
+    """
+    The cheer data, its rankings, the journal it is saved to and the ledger of transfers.
+    Without a journal it is a replica: another process owns the data and sends it changes to apply().
+    """
+    def __init__(self, cheer_data: Dict[str, Dict[str, Any]], ledger: CheerLedger,
+                 journal: Optional[CheerJournal] = None):
+        """
+        :param cheer_data: The cheer data, by username
+        :param ledger: The ledger of transfers, which replicas only read from
+        :param journal: Where changes are saved, or None for a replica
+        """
+        self.cheer_data = cheer_data
+        self.ranking = CheerRanking(cheer_data)
+        self.ledger = ledger
+        self.journal = journal
+        return
+
+    @classmethod
+    def open(cls, snapshot_filename: str, journal_filename: str, ledger_filename: str) -> 'CheerState':
+        """
+        Load the cheer data, and save changes to it from now on
+        """
+        journal = CheerJournal(snapshot_filename=snapshot_filename, journal_filename=journal_filename)
+        return cls(journal.load(), CheerLedger(ledger_filename), journal=journal)
+
+    @classmethod
+    def replica(cls, cheer_data: Dict[str, Dict[str, Any]], ledger_filename: str) -> 'CheerState':
+        """
+        Follow cheer data that another process owns
+        :param cheer_data: A copy of the owner's cheer data
+        :param ledger_filename: The owner's ledger, for windowed leaderboards
+        """
+        return cls(cheer_data, CheerLedger(ledger_filename))
+
+    def add_attendee(self, username, name: str) -> bool:
+        """
+        :return: Whether they were new
+        """
+        if username in self.cheer_data:
+            return False
+        self.cheer_data[username] = {
+            "cheer_available": 0,
+            "cheer_given": 0,
+            "name": name
+        }
+        self.attendees_changed(username)
+        return True
+
+    def attendees_changed(self, *usernames: str):
+        """
+        Re-rank and save attendees after their cheer data changed
+        :param usernames: The attendees that changed
+        """
+        self.ranking.update(*usernames)
+        self.save_attendees(*usernames)
+        return
+
+    def changes(self, *usernames: str) -> Changes:
+        return {username: dict(self.cheer_data[username]) for username in usernames}
+
+    def save_attendees(self, *usernames: str):
+        """
+        Record the current values for some attendees
+        :param usernames: The attendees that changed
+        """
+        if self.journal is not None:
+            self.journal.record(self.changes(*usernames))
+        return
+
+    def apply(self, changes: Changes):
+        """
+        Take on changes made by the process that owns the data
+        :param changes: The new values for the attendees that changed
+        """
+        self.cheer_data.update(changes)
+        self.ranking.update(*changes)
+        return
+
+    def give_everyone_points(self, points) -> List[str]:
+        """
+        Give everyone points, without updating the "Given" stat
+        :param points: The number of points to give
+        :return: Everyone who changed
+        """
+        for attendee in self.cheer_data:
+            self.cheer_data[attendee]['cheer_available'] += points
+        self.attendees_changed(*self.cheer_data.keys())
+        return list(self.cheer_data)
+
+    def transfer_many(self, name_from: str, transfers: List[Tuple[str, int]], texture: Optional[str]) -> List[str]:
+        """
+        Transfer points from one attendee to several others all at once, saving them once.
+        If the giver runs out of points, the transfers later in the list get less (or nothing).
+        :param name_from: Who to transfer the points from
+        :param transfers: (who to transfer the points to, the number of points) for each transfer
+        :param texture: The texture shown, for the ledger (see cheer_texture)
+        :return: Everyone who changed
+        """
+        # Check everyone first, so either every transfer is made or none are
+        unknown = [name for name in [name_from] + [name_to for name_to, _ in transfers]
+                   if name not in self.cheer_data]
+        if unknown:
+            raise KeyError(f'Unknown attendees: {unknown}')
+        attendee_from = self.cheer_data[name_from]
+        ledger_transfers = []
+        for name_to, points in transfers:
+            attendee_to = self.cheer_data[name_to]
+            from_points = attendee_from['cheer_available']
+            from_points -= points
+            from_points = max(0, from_points)
+            transferred = attendee_from['cheer_available'] - from_points
+            attendee_from['cheer_available'] = from_points
+            if not name_from == name_to:
+                attendee_from['cheer_given'] += transferred
+            attendee_to['cheer_available'] += transferred
+            if transferred:
+                ledger_transfers.append((name_from, name_to, transferred, texture))
+        changed = list(dict.fromkeys([name_from] + [name_to for name_to, _ in transfers]))
+        self.attendees_changed(*changed)
+        self.ledger.record_many(ledger_transfers)
+        return changed
+
+    def rank(self, username: str, sort_key: str) -> Optional[int]:
+        """
+        Get an attendee's place, starting from 0
+        :param username: The attendee
+        :param sort_key: Which cheer_data key or windowed sort key to rank by
+        """
+        if sort_key in WINDOWED_SORT_KEYS:
+            order = [u for u, _ in self.windowed_leaderboard(sort_key)]
+            return order.index(username) if username in order else None
+        return self.ranking.index(sort_key).rank(username)
+
+    def sort_keys(self) -> List[str]:
+        """
+        Get every sort key there is a leaderboard for
+        """
+        return self.ranking.keys + list(WINDOWED_SORT_KEYS)
+
+    def windowed_leaderboard(self, sort_key: str, limit: Optional[int] = None):
+        """
+        Get the leaderboard for one of WINDOWED_SORT_KEYS
+        :param sort_key: The windowed sort key
+        :param limit: The most attendees to get, or None for everyone
+        :return: (username, points) pairs, highest first
+        """
+        title, stat, window_start = WINDOWED_SORT_KEYS[sort_key]
+        now = time.time()
+        return self.ledger.leaderboard(stat, start=window_start(now), end=now, limit=limit)
+
+    def stats_text(self, username: str) -> str:
+        """
+        Describe one attendee's cheers, for the Slack bot's stats command
+        :param username: The attendee
+        """
+        attendee = self.cheer_data.get(username, None)
+        if attendee is None:
+            return f'{username} is not on the scoreboard'
+        text = f'{attendee["name"]}:\n'
+        text += f'- Points: {attendee["cheer_available"]} (#{self.rank(username, "cheer_available") + 1})\n'
+        text += f'- Given: {attendee["cheer_given"]} (#{self.rank(username, "cheer_given") + 1})\n'
+        for sort_key, (title, _, _) in WINDOWED_SORT_KEYS.items():
+            points = dict(self.windowed_leaderboard(sort_key)).get(username, 0)
+            text += f'- {title}: {points}\n'
+        return text
+
+    def close(self):
+        """
+        Finish writing everything to disk
+        """
+        if self.journal is not None:
+            self.journal.stop()
+        self.ledger.close()
+        return
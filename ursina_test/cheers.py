@@ -1,89 +1,214 @@
-import json
-from pathlib import Path
-from shutil import copy2
+import time
+import numpy as np
+from contextlib import contextmanager
 from ursina import *
-from typing import Dict, Any, Optional, List
+from panda3d.core import Geom, GeomNode, GeomTriangles, GeomVertexArrayFormat, GeomVertexData, GeomVertexFormat
+from panda3d.core import InternalName
+from typing import Dict, Any, Optional, List, Set, Tuple
+
+from cheer_state import CheerState, Changes, WINDOWED_SORT_KEYS, cheer_texture, cheers_textures
+from cell_text import CellText
+from frame_profiler import profiler
 
 # Where cheer data is stored
 cheer_data_filename = 'cheer.json'
-# All of the "cheers"
-cheers = []
+# Where changes to the cheer data since it was last stored are kept
+cheer_journal_filename = 'cheer.journal'
+# Where every transfer is recorded, for leaderboards over a window of time
+cheer_ledger_filename = 'cheer_ledger.sqlite'
+# All of the "cheers", one particle system per texture
+cheers = {}
+# Random numbers for the particle systems
+_rng = np.random.default_rng()
 
 
-def _cheers_textures() -> List[str]:
-    globbed = Path('textures/cheers').glob('*')
-    textures = [p.stem for p in globbed]
-    return textures
+# Corners of each face of a unit cube, counter-clockwise when seen from outside
+CUBE_FACES = [
+    [(.5, -.5, -.5), (.5, -.5, .5), (.5, .5, .5), (.5, .5, -.5)],
+    [(-.5, -.5, .5), (-.5, -.5, -.5), (-.5, .5, -.5), (-.5, .5, .5)],
+    [(-.5, .5, -.5), (.5, .5, -.5), (.5, .5, .5), (-.5, .5, .5)],
+    [(-.5, -.5, .5), (.5, -.5, .5), (.5, -.5, -.5), (-.5, -.5, -.5)],
+    [(.5, -.5, .5), (-.5, -.5, .5), (-.5, .5, .5), (.5, .5, .5)],
+    [(-.5, -.5, -.5), (.5, -.5, -.5), (.5, .5, -.5), (-.5, .5, -.5)],
+]
+CUBE_VERTICES = np.array(CUBE_FACES, dtype=np.float32).reshape(-1, 3)
+CUBE_UVS = np.tile(np.array([(0, 0), (1, 0), (1, 1), (0, 1)], dtype=np.float32), (len(CUBE_FACES), 1))
+CUBE_TRIANGLES = (np.arange(len(CUBE_FACES))[:, None] * 4 + np.array([0, 1, 2, 0, 2, 3])).ravel()
 
 
-cheers_textures = _cheers_textures()
+def particle_vertex_format() -> GeomVertexFormat:
+    """
+    Positions and uvs in separate arrays, since the positions are rewritten every frame and the uvs are not
+    """
+    vertex_format = GeomVertexFormat()
+    for name, components, contents in (('vertex', 3, Geom.C_point), ('texcoord', 2, Geom.C_texcoord)):
+        array_format = GeomVertexArrayFormat()
+        array_format.add_column(InternalName.make(name), components, Geom.NT_float32, contents)
+        vertex_format.add_array(array_format)
+    return GeomVertexFormat.register_format(vertex_format)
 
 
-def load_cheer_data() -> Dict[str, Any]:
+def rotation_matrices(rotations: np.ndarray) -> np.ndarray:
     """
-    Load cheer data from the file
+    Build one rotation matrix per row of euler angles
+    :param rotations: An (N, 3) array of x, y, z rotations, in degrees
+    :return: An (N, 3, 3) array of rotation matrices
     """
-    cheer_data = json.load(open(cheer_data_filename, 'r'))
-    return cheer_data
+    x, y, z = np.radians(rotations).T
+    cx, sx = np.cos(x), np.sin(x)
+    cy, sy = np.cos(y), np.sin(y)
+    cz, sz = np.cos(z), np.sin(z)
+    matrices = np.empty((len(rotations), 3, 3), dtype=np.float32)
+    matrices[:, 0, 0] = cz * cy
+    matrices[:, 0, 1] = cz * sy * sx - sz * cx
+    matrices[:, 0, 2] = cz * sy * cx + sz * sx
+    matrices[:, 1, 0] = sz * cy
+    matrices[:, 1, 1] = sz * sy * sx + cz * cx
+    matrices[:, 1, 2] = sz * sy * cx - cz * sx
+    matrices[:, 2, 0] = -sy
+    matrices[:, 2, 1] = cy * sx
+    matrices[:, 2, 2] = cy * cx
+    return matrices
 
 
-def save_cheer_data(cheer_data: Dict):
-    # Back up the file first
-    copy2(cheer_data_filename, f'{cheer_data_filename}.bak')
-    json.dump(cheer_data, open(cheer_data_filename, 'w+'), indent=2)
-    return
-
+class CheerParticles(Entity):
+    """
+    All of the cheers that use one texture.
 
-class Cheer(Entity):
-    def __init__(self, position, scale, texture, duration=10):
-        self._duration = duration
-        self._initial_scale = Vec3(scale)
-        self._expiry_time = time.monotonic() + duration
-        rotation_scale = 100
-        self._rotation_speed = Vec3(random.random() * rotation_scale,
-                                    random.random() * rotation_scale,
-                                    random.random() * rotation_scale)
+    Particle state lives in NumPy arrays and every particle is advanced in one step per frame,
+    then drawn as a single merged mesh instead of one entity per cheer. The mesh's vertex data is written
+    straight from NumPy each frame, and its uvs and triangles only when the particle count changes.
+    """
+    def __init__(self, texture: str, **kwargs):
+        self._positions = np.empty((0, 3), dtype=np.float32)
+        self._rotations = np.empty((0, 3), dtype=np.float32)
+        self._rotation_speeds = np.empty((0, 3), dtype=np.float32)
+        self._initial_scales = np.empty(0, dtype=np.float32)
+        self._durations = np.empty(0, dtype=np.float32)
+        self._expiry_times = np.empty(0, dtype=np.float64)
+        # Triangles only change when the particle count does
+        self._triangle_count = 0
+        triangles = GeomTriangles(Geom.UH_dynamic)
+        triangles.set_index_type(Geom.NT_uint32)
+        geom = Geom(GeomVertexData('cheers', particle_vertex_format(), Geom.UH_dynamic))
+        geom.add_primitive(triangles)
+        node = GeomNode('cheers')
+        node.add_geom(geom)
         super().__init__(
-            model='cube',
-            position=position,
-            scale=scale,
-            texture=texture
+            model=NodePath(node),
+            texture=texture,
+            **kwargs
         )
-        destroy(self, duration)
+        self.visible = False
+        return
+
+    @property
+    def particle_count(self) -> int:
+        return len(self._expiry_times)
+
+    def add(self, positions: np.ndarray, scales: np.ndarray, duration: float = 10):
+        """
+        Spawn a batch of particles
+        :param positions: An (N, 3) array of starting positions
+        :param scales: An (N,) array of starting scales
+        :param duration: How long the particles live for, in seconds
+        """
+        count = len(positions)
+        rotation_scale = 100
+        self._positions = np.concatenate((self._positions, np.asarray(positions, dtype=np.float32)))
+        self._rotations = np.concatenate((self._rotations, np.zeros((count, 3), dtype=np.float32)))
+        self._rotation_speeds = np.concatenate(
+            (self._rotation_speeds, (_rng.random((count, 3)) * rotation_scale).astype(np.float32)))
+        self._initial_scales = np.concatenate((self._initial_scales, np.asarray(scales, dtype=np.float32)))
+        self._durations = np.concatenate((self._durations, np.full(count, duration, dtype=np.float32)))
+        self._expiry_times = np.concatenate(
+            (self._expiry_times, np.full(count, time.monotonic() + duration)))
+        self.visible = True
         return
 
     def update(self):
-        # Slowly fade the entity out
-        self.set_scale_for_remaining_time()
+        if not self.particle_count:
+            return
+        now = time.monotonic()
+        self.remove_expired(now)
+        if not self.particle_count:
+            self.visible = False
+            return
+        # Slowly fade the particles out
+        remaining = (self._expiry_times - now) / self._durations
+        scales = self._initial_scales * remaining.astype(np.float32)
         # Jitter around a bit
-        self.move_jittery()
+        move_per_second = 1
+        jitter = _rng.random(self._positions.shape, dtype=np.float32) - .5
+        self._positions += jitter * (move_per_second * time.dt)
         # Rotate
-        self.rotate()
+        self._rotations += self._rotation_speeds * time.dt
+        self.update_mesh(scales)
         return
 
-    def set_scale_for_remaining_time(self):
-        remaining = self._expiry_time - time.monotonic()
-        scale = self._initial_scale * (remaining / self._duration)
-        self.scale = scale
+    def remove_expired(self, now: float):
+        alive = self._expiry_times > now
+        if alive.all():
+            return
+        self._positions = self._positions[alive]
+        self._rotations = self._rotations[alive]
+        self._rotation_speeds = self._rotation_speeds[alive]
+        self._initial_scales = self._initial_scales[alive]
+        self._durations = self._durations[alive]
+        self._expiry_times = self._expiry_times[alive]
         return
 
-    def move_jittery(self):
-        move_per_second = 1
-        x = random.random() * move_per_second - move_per_second / 2
-        y = random.random() * move_per_second - move_per_second / 2
-        z = random.random() * move_per_second - move_per_second / 2
-        self.position = self.position + Vec3(x, y, z) * time.dt
-        return
-
-    def rotate(self):
-        self.rotation += self._rotation_speed * time.dt
+    def update_mesh(self, scales: np.ndarray):
+        """
+        Write every particle into the merged mesh
+        :param scales: The current scale of each particle
+        """
+        count = self.particle_count
+        geom = self.model.node().modify_geom(0)
+        vertex_data = geom.modify_vertex_data()
+        if count != self._triangle_count:
+            vertex_data.unclean_set_num_rows(count * len(CUBE_VERTICES))
+            uvs = np.frombuffer(memoryview(vertex_data.modify_array(1)), dtype=np.float32)
+            uvs[:] = np.tile(CUBE_UVS, (count, 1)).ravel()
+            offsets = np.arange(count, dtype=np.uint32)[:, None] * len(CUBE_VERTICES)
+            indices = (offsets + CUBE_TRIANGLES[None, :]).ravel()
+            handle = geom.modify_primitive(0).modify_vertices()
+            handle.unclean_set_num_rows(len(indices))
+            np.frombuffer(memoryview(handle), dtype=np.uint32)[:] = indices
+            self._triangle_count = count
+        # Rotated, scaled and moved straight into the vertex data
+        vertices = np.frombuffer(memoryview(vertex_data.modify_array(0)), dtype=np.float32)
+        vertices = vertices.reshape(count, len(CUBE_VERTICES), 3)
+        transforms = rotation_matrices(self._rotations) * scales[:, None, None]
+        np.matmul(CUBE_VERTICES[None, :, :], transforms.transpose(0, 2, 1), out=vertices)
+        vertices += self._positions[:, None, :]
         return
 
 
-class CheerScoreboard(Text):
-    def __init__(self, attendees: Dict[str,str]):
+class CheerScoreboard(CellText):
+    def __init__(self, attendees: Dict[str,str], max_rows: Optional[int] = 20, state: Optional[CheerState] = None,
+                 participant_names: Optional[List[str]] = None):
+        """
+        :param attendees: Usernames, by name
+        :param max_rows: The most attendees to show, or None to show everyone
+        :param state: The cheer data to show, or None to load (and save) the data in cheer_data_filename
+        :param participant_names: Only show the attendees with these names, or None to show everyone in the
+                                  cheer data. Boards in multi-board mode share the cheer data of every board.
+        """
         self._sort_key = 'cheer_available'
-        self._cheer_data = load_cheer_data()
+        self._max_rows = max_rows
+        self._participant_names = None if participant_names is None else set(participant_names)
+        # The usernames of the participants, found again whenever someone is added to the cheer data
+        self._shown_usernames: Set[str] = set()
+        self._shown_count = -1
+        # While batching, redraws wait until the end of the batch
+        self._batch_depth = 0
+        self._pending_redraw = None
+        if state is None:
+            state = CheerState.open(cheer_data_filename, cheer_journal_filename, cheer_ledger_filename)
+        self._state = state
+        self._cheer_data = state.cheer_data
+        self._ranking = state.ranking
         for name in attendees.keys():
             username = attendees[name]
             self.add_attendee(username, name)
@@ -95,23 +220,77 @@ class CheerScoreboard(Text):
                          origin=(.5, -.5),
                          # scale = (.05, .025),
                          color=color.white.tint(-.2),
-                         font='VeraMono.ttf'
+                         font='VeraMono.ttf',
+                         columns=24,
+                         rows=(max_rows or len(participant_names or self._cheer_data)) + 3
                          )
         self.update_cheer_text()
         return
 
+    @property
+    def state(self) -> CheerState:
+        return self._state
+
     def set_sort_key(self, sort_key: str):
         self._sort_key = sort_key
         self.update_cheer_text()
         return
 
     def add_attendee(self, username, name: str):
-        if not username in self._cheer_data:
-            self._cheer_data[username] = {
-                "cheer_available": 0,
-                "cheer_given": 0,
-                "name": name
-            }
+        self._state.add_attendee(username, name)
+        return
+
+    def attendees_changed(self, *usernames: str):
+        """
+        Re-rank and save attendees after their cheer data changed
+        :param usernames: The attendees that changed
+        """
+        self._state.attendees_changed(*usernames)
+        return
+
+    def rank(self, username: str, sort_key: Optional[str] = None) -> Optional[int]:
+        """
+        Get an attendee's place on the scoreboard, starting from 0
+        :param username: The attendee
+        :param sort_key: Which cheer_data key or windowed sort key to rank by, or None for the current sort key
+        """
+        return self._state.rank(username, sort_key or self._sort_key)
+
+    def sort_keys(self) -> List[str]:
+        """
+        Get every sort key the scoreboard can show
+        """
+        return self._state.sort_keys()
+
+    def stats_text(self, username: str) -> str:
+        """
+        Describe one attendee's cheers, for the Slack bot's stats command
+        :param username: The attendee
+        """
+        return self._state.stats_text(username)
+
+    def windowed_leaderboard(self, sort_key: str, limit: Optional[int] = None):
+        """
+        Get the leaderboard for one of WINDOWED_SORT_KEYS
+        :param sort_key: The windowed sort key
+        :param limit: The most attendees to get, or None for everyone
+        :return: (username, points) pairs, highest first
+        """
+        return self._state.windowed_leaderboard(sort_key, limit=limit)
+
+    def save_attendees(self, *usernames: str):
+        """
+        Record the current values for some attendees
+        :param usernames: The attendees that changed
+        """
+        self._state.save_attendees(*usernames)
+        return
+
+    def close(self):
+        """
+        Finish writing everything to disk
+        """
+        self._state.close()
         return
 
     def give_everyone_points(self, points):
@@ -119,71 +298,158 @@ class CheerScoreboard(Text):
         Give everyone points, without updating the "Given" stat
         :param points: The number of points to give
         """
-        for attendee in self._cheer_data:
-            self._cheer_data[attendee]['cheer_available'] += points
+        self._state.give_everyone_points(points)
         self.update_cheer_text()
-        save_cheer_data(self._cheer_data)
         return
 
-    def transfer_points(self, name_from: str, name_to: str, points: int, texture: Optional[str]):
+    def transfer_points(self, name_from: str, name_to: str, points: int, texture: Optional[str] = None):
         """
         Transfer points from one attendee to another
         :param name_from: Who to transfer the points from
         :param name_to: Who to transfer the points to
         :param points: The number of points to transfer
+        :param texture: The texture to use, or None for the default cheer
+        """
+        self.transfer_many(name_from, [(name_to, points)], texture=texture)
+        return
+
+    def transfer_many(self, name_from: str, transfers: List[Tuple[str, int]], texture: Optional[str]):
+        """
+        Transfer points from one attendee to several others all at once: the points are saved once, the
+        scoreboard is redrawn once and one burst of cheers is shown for all of them.
+        If the giver runs out of points, the transfers later in the list get less (or nothing).
+        :param name_from: Who to transfer the points from
+        :param transfers: (who to transfer the points to, the number of points) for each transfer
         :param texture: The texture to use
         """
-        attendee_from = self._cheer_data[name_from]
-        attendee_to = self._cheer_data[name_to]
-        from_points = attendee_from['cheer_available']
-        from_points -= points
-        from_points = max(0, from_points)
-        transferred = attendee_from['cheer_available'] - from_points
-        attendee_from['cheer_available'] = from_points
-        if not name_from == name_to:
-            attendee_from['cheer_given'] += transferred
-        attendee_to['cheer_available'] += transferred
-        self.update_cheer_text(name_from=attendee_from['name'], name_to=attendee_to['name'])
-        save_cheer_data(self._cheer_data)
-        if not texture or texture not in cheers_textures:
-            texture = 'star'
-        self.add_cheers(count=points, texture=f'textures/cheers/{texture}')
+        texture = cheer_texture(texture, cheers_textures())
+        self._state.transfer_many(name_from, transfers, texture)
+        self.show_transfer(name_from, transfers, texture)
+        return
+
+    def show_transfer(self, name_from: str, transfers: List[Tuple[str, int]], texture: str):
+        """
+        Highlight a transfer that has already been made, and cheer
+        :param name_from: Who the points were transferred from
+        :param transfers: (who the points were transferred to, the number of points) for each transfer
+        :param texture: The texture to use
+        """
+        self.update_cheer_text(name_from=self._cheer_data[name_from]['name'],
+                               names_to=[self._cheer_data[name_to]['name'] for name_to, _ in transfers])
+        self.add_cheers(count=sum(points for _, points in transfers), texture=f'textures/cheers/{texture}')
+        return
+
+    def apply_changes(self, changes: Changes, transfer: Optional[Dict[str, Any]] = None):
+        """
+        Show changes made by another process that owns the cheer data, as a board in multi-board mode does
+        :param changes: The new values for the attendees that changed
+        :param transfer: The arguments for show_transfer, if the changes were a transfer to cheer for here
+        """
+        self._state.apply(changes)
+        if transfer is not None:
+            self.show_transfer(**transfer)
+        else:
+            self.update_cheer_text()
+        return
+
+    @contextmanager
+    def batch(self):
+        """
+        Redraw once at the end of a block, however many changes are made in it
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._pending_redraw is not None:
+                pending_redraw = self._pending_redraw
+                self._pending_redraw = None
+                self.update_cheer_text(**pending_redraw)
         return
 
     def add_cheers(self, count: int, texture: str):
-        for i in range(min(50, count)):
-            max_pos = 2
-            position = (random.random() * max_pos - max_pos / 2,
-                        random.random() * max_pos - max_pos / 2,
-                        -2)
-            max_scale = .2
-            random_scale = random.random() * max_scale - max_scale
-            scale = Vec3(random_scale, random_scale, random_scale, )
-            e = Cheer(position=position, scale=scale, texture=texture, duration=10)
-            cheers.append(e)
+        particles = cheers.get(texture, None)
+        if particles is None:
+            particles = CheerParticles(texture=texture)
+            cheers[texture] = particles
+        max_pos = 2
+        positions = _rng.random((count, 3)) * max_pos - max_pos / 2
+        positions[:, 2] = -2
+        max_scale = .2
+        scales = _rng.random(count) * max_scale - max_scale
+        particles.add(positions=positions, scales=scales, duration=10)
         return
 
-    def update_cheer_text(self, name_from=None, name_to=None):
+    @profiler.timed('update_cheer_text')
+    def update_cheer_text(self, name_from=None, names_to=()):
         """
         Update the cheer text
-        :param sort_key: Which cheer_data key to sort by
+        :param name_from: The name of the attendee who gave points, to highlight
+        :param names_to: The names of the attendees who received points, to highlight
         """
-        order = reversed(sorted(self._cheer_data,
-                                key=lambda item: self._cheer_data[item][self._sort_key]))
+        if self._batch_depth:
+            # Only the last redraw in a batch matters
+            self._pending_redraw = {'name_from': name_from, 'names_to': names_to}
+            return
+        if self._sort_key in WINDOWED_SORT_KEYS:
+            self.text = self.windowed_cheer_text(name_from=name_from, names_to=names_to)
+            return
+        index = self._ranking.index(self._sort_key)
+        usernames = self.participant_usernames()
+        if usernames is None:
+            order = index.top(self._max_rows)
+        else:
+            order = sorted(usernames, key=index.rank)[:self._max_rows]
         text = 'Name   Points   Given\n'
         text += '-----+--------+------\n'
         for username in order:
             participant = self._cheer_data[username]
-            participant_name = participant['name']
-            if name_from == name_to and name_from == participant_name:
-                color = 'yellow'
-            elif name_from == participant_name:
-                color = 'red'
-            elif name_to == participant_name:
-                color = 'green'
-            else:
-                color = 'white'
+            color = self.highlight_color(participant['name'], name_from, names_to)
             text += f'<{color}>{participant["name"]}<white> | {participant["cheer_available"]:6} | {participant["cheer_given"]:5}\n'
         self.text = text
-        self.create_background()
         return
+
+    def participant_usernames(self) -> Optional[Set[str]]:
+        """
+        Get the usernames of the attendees to show, or None to show everyone
+        """
+        if self._participant_names is not None and self._shown_count != len(self._cheer_data):
+            self._shown_usernames = set(username for username, attendee in self._cheer_data.items()
+                                        if attendee['name'] in self._participant_names)
+            self._shown_count = len(self._cheer_data)
+        return None if self._participant_names is None else self._shown_usernames
+
+    @staticmethod
+    def highlight_color(participant_name: str, name_from=None, names_to=()) -> str:
+        if name_from == participant_name and participant_name in names_to:
+            color = 'yellow'
+        elif name_from == participant_name:
+            color = 'red'
+        elif participant_name in names_to:
+            color = 'green'
+        else:
+            color = 'white'
+        return color
+
+    def windowed_cheer_text(self, name_from=None, names_to=()) -> str:
+        """
+        Get the cheer text for one of WINDOWED_SORT_KEYS
+        :param name_from: The name of the attendee who gave points, to highlight
+        :param names_to: The names of the attendees who received points, to highlight
+        """
+        title = WINDOWED_SORT_KEYS[self._sort_key][0]
+        text = f'{title}\n'
+        text += 'Name   Points\n'
+        text += '-----+-------\n'
+        usernames = self.participant_usernames()
+        if usernames is None:
+            leaderboard = self.windowed_leaderboard(self._sort_key, limit=self._max_rows)
+        else:
+            leaderboard = [(username, points) for username, points in self.windowed_leaderboard(self._sort_key)
+                           if username in usernames][:self._max_rows]
+        for username, points in leaderboard:
+            participant_name = self._cheer_data.get(username, {}).get('name', username)
+            color = self.highlight_color(participant_name, name_from, names_to)
+            text += f'<{color}>{participant_name}<white> | {points:6}\n'
+        return text
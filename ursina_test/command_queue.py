@@ -0,0 +1,65 @@
+#
+# Hand work from other threads (such as the Slack bot) to the Ursina main loop
+#
+
+import time
+from collections import deque
+from typing import Callable
+
+
+class CommandQueue:
+    """
+    Other threads put commands in, and the main loop runs them a frame at a time.
+    Putting a command never waits: appending to a deque is atomic, so no lock is needed, and if the main loop
+    has fallen so far behind that the queue is full, the command is dropped instead.
+    """
+    def __init__(self, max_size: int = 1000):
+        """
+        :param max_size: The most commands to hold at once
+        """
+        self.max_size = max_size
+        self.dropped = 0
+        self._commands = deque()
+        return
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def put(self, function: Callable, *args, **kwargs) -> bool:
+        """
+        Queue a function to be called on the main loop. Safe to call from any thread.
+        :param function: The function to call
+        :param args: Its arguments
+        :param kwargs: Its keyword arguments
+        :return: Whether it was queued, rather than dropped because the queue is full
+        """
+        if len(self._commands) >= self.max_size:
+            self.dropped += 1
+            print(f'Command queue is full, dropping {function.__name__}')
+            return False
+        self._commands.append((function, args, kwargs))
+        return True
+
+    def drain(self, budget: float = .004) -> int:
+        """
+        Run queued commands until the queue is empty or the time budget is used up. At least one command
+        is run, so the queue always makes progress. Call from the main loop only.
+        :param budget: How long to spend, in seconds
+        :return: How many commands were run
+        """
+        start = time.perf_counter()
+        ran = 0
+        while self._commands:
+            function, args, kwargs = self._commands.popleft()
+            try:
+                function(*args, **kwargs)
+            except Exception as e:
+                print(f'Command {function.__name__} failed: {e!r}')
+            ran += 1
+            if time.perf_counter() - start >= budget:
+                break
+        return ran
+
+
+# Commands for the Ursina main loop to run
+main_thread_commands = CommandQueue()
@@ -0,0 +1,95 @@
+#
+# Route Slack messages addressed to the bot to command handlers
+#
+
+import re
+from collections import namedtuple
+from typing import Awaitable, Callable, Dict, List, Match, Optional, Tuple
+
+# A mention at the start of a message: <@U12345> the rest
+MENTION_REGEX = re.compile(r'^<@(|[WU].+?)>(.*)', re.DOTALL)
+
+Command = namedtuple('Command', ['name', 'pattern', 'handler', 'usage'])
+
+# Called with (the match of the command's arguments, the message data, the web client)
+Handler = Callable[..., Awaitable[None]]
+
+
+class CommandRouter:
+    """
+    Commands are "@bot <name> <arguments>", or just "<name> <arguments>" in a direct message. The name can start
+    with "!". In a direct message, only an unknown name that starts with "!" (or a known one with bad arguments)
+    is handed to the fallback, since most direct messages are just people talking.
+    Most messages the bot sees are not meant for it, so those are turned away by looking at the first two
+    characters. Anything else is looked up by command name in a dictionary, and only then are the arguments
+    matched against that one command's precompiled pattern.
+    """
+    def __init__(self):
+        # Set once the bot knows who it is. Until then, a mention of anyone at the start of a message counts.
+        self.bot_user_id: Optional[str] = None
+        # Called for messages addressed to the bot that are not a known command (or have bad arguments)
+        self.fallback: Optional[Handler] = None
+        self._commands: Dict[str, Command] = {}
+        return
+
+    def command(self, name: str, arguments: str = '', usage: str = ''):
+        """
+        Register a command handler, as a decorator
+        :param name: The first word of the command
+        :param arguments: A regular expression that must match everything after the name
+        :param usage: How to use it, for the help text
+        """
+        def register(handler: Handler) -> Handler:
+            self._commands[name.lower()] = Command(name, re.compile(arguments, re.IGNORECASE), handler,
+                                                   usage or name)
+            return handler
+        return register
+
+    def usages(self) -> List[str]:
+        return [command.usage for command in self._commands.values()]
+
+    def parse(self, text: str, direct: bool = False) -> Optional[Tuple[Optional[Command], Optional[Match]]]:
+        """
+        Work out which command a message is
+        :param text: The message text
+        :param direct: Whether it is a direct message, which does not need to mention the bot
+        :return: None if the message is not for the bot, or (the command, the match of its arguments),
+                 where both are None if it is for the bot but is not a valid command
+        """
+        if not direct:
+            if not text.startswith('<@'):
+                return None
+            mention = MENTION_REGEX.match(text)
+            if mention is None or (self.bot_user_id is not None and mention.group(1) != self.bot_user_id):
+                return None
+            text = mention.group(2)
+        name, _, arguments = text.strip().partition(' ')
+        explicit = name.startswith('!')
+        command = self._commands.get(name.lstrip('!').lower(), None)
+        if command is None:
+            if direct and not explicit:
+                return None
+            return None, None
+        match = command.pattern.fullmatch(arguments.strip())
+        if match is None:
+            return None, None
+        return command, match
+
+    async def dispatch(self, text: str, data: dict, web_client, direct: bool = False) -> bool:
+        """
+        Run the handler for a message, if it is a command
+        :param text: The message text
+        :param data: The message data, passed to the handler
+        :param web_client: The web client, passed to the handler
+        :param direct: Whether it is a direct message, which does not need to mention the bot
+        :return: Whether the message was for the bot
+        """
+        parsed = self.parse(text, direct=direct)
+        if parsed is None:
+            return False
+        command, match = parsed
+        if command is not None:
+            await command.handler(match, data, web_client)
+        elif self.fallback is not None:
+            await self.fallback(None, data, web_client)
+        return True
@@ -1,5 +1,13 @@
 from ursina import *
 from ursina.prefabs.first_person_controller import FirstPersonController
+from cell_text import CellText
+from frame_profiler import profiler
+from kinematics import kinematics
+
+# Profile from the start. F3 switches the profiler on and off, and F4 exports what it has.
+PROFILE = False
+# Where the profiler exports to: Chrome trace format for .json, one frame per line for .jsonl
+PROFILE_FILENAME = 'frame_profile.json'
 
 app = Ursina()
 
@@ -28,6 +36,7 @@ class Voxel(Button):
     @rotation_speed.setter
     def rotation_speed(self, rotation_speed: Vec3):
         self._rotation_speed = rotation_speed
+        kinematics.set_velocity(self, angular=rotation_speed)
         return
 
     def rotating(self):
@@ -49,17 +58,15 @@ class Voxel(Button):
                 self.rotate_randomly()
         return
 
-    def update(self):
-        self.rotation_x += time.dt * self._rotation_speed.x
-        self.rotation_y += time.dt * self._rotation_speed.y
-        self.rotation_z += time.dt * self._rotation_speed.z
+    def on_destroy(self):
+        kinematics.remove(self)
         return
 
 
 def set_debug_text(text: str):
     text_box = objects.get('debug_console', None)
     if not text_box:
-        text_box = Text(
+        text_box = CellText(
             name='debug_console',
             position=window.top_left,
             z=-999,
@@ -70,8 +77,8 @@ def set_debug_text(text: str):
             color=color.red.tint(-.2),
             text=text)
         objects['debug_console'] = text_box
+    # Called every frame, but only the characters that changed are rewritten
     text_box.text = text
-    text_box.create_background()
     return
 
 
@@ -80,6 +87,8 @@ def init():
     objects['voxel'] = Voxel(position=(0, 0, 0))
     Text.default_resolution = 1080 * Text.size
     window.exit_button.visible = False
+    if PROFILE:
+        profiler.enable()
     return
 
 
@@ -87,6 +96,8 @@ def input(key):
     print(f'{key=}')
     if key == 'escape':
         print('Bye')
+        if profiler.frames:
+            profiler.export(PROFILE_FILENAME)
         application.quit()
     elif key == 'scroll up':
         camera.z += 2
@@ -95,10 +106,16 @@ def input(key):
     elif key == 'space':
         camera.look_at(objects['voxel'].origin)
         objects['voxel'].rotate_randomly()
+    elif key == 'f3':
+        profiler.toggle()
+    elif key == 'f4':
+        profiler.export(PROFILE_FILENAME)
+        print(f'Exported the profile to {PROFILE_FILENAME}')
     return
 
 
 def update():
+    kinematics.update(time.dt)
     text = f'\nCamera position: {camera.position}'
     text += f'\nCamera rotation: {camera.rotation}'
     set_debug_text(text)
@@ -0,0 +1,177 @@
+#
+# A local stand-in for the parts of the Slack RTM and Web APIs the bot uses, for testing and benchmarking offline
+#
+
+import asyncio
+import itertools
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from aiohttp import web, WSMsgType
+
+# The bot's own user id, and the id its messages carry
+BOT_USER_ID = 'UBOT'
+BOT_ID = 'BBOT'
+
+
+def fake_members(count: int) -> List[Dict[str, Any]]:
+    """
+    Make up some workspace members
+    :param count: How many
+    """
+    return [{'id': f'U{i:05}', 'name': f'user{i}', 'real_name': f'User {i}', 'deleted': False}
+            for i in range(count)]
+
+
+class FakeSlack:
+    """
+    Serves rtm.connect, users.list (paginated), users.info and chat.postMessage, and an RTM websocket that
+    sends whatever messages it is given. Runs on its own thread, so it does not share a loop with the bot.
+    """
+    def __init__(self, members: List[Dict[str, Any]], host: str = '127.0.0.1', port: int = 0,
+                 echo_bot_messages: bool = False):
+        """
+        :param members: The workspace's members
+        :param host: The address to listen on
+        :param port: The port to listen on, or 0 for any free port
+        :param echo_bot_messages: Send the bot's own posts back to it as message events, like Slack does
+        """
+        self.members = members
+        self.echo_bot_messages = echo_bot_messages
+        self.host = host
+        self.port = port
+        # (time the reply arrived, the reply), for each chat.postMessage
+        self.replies: List[tuple] = []
+        self._timestamps = itertools.count(1)
+        self._sockets: List[web.WebSocketResponse] = []
+        self._connected = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        self._runner = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        return
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}/api/'
+
+    def start(self):
+        """
+        Start serving, returning once the server is listening
+        """
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+        return
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_route('*', '/api/rtm.connect', self._rtm_connect)
+        app.router.add_route('*', '/api/users.list', self._users_list)
+        app.router.add_route('*', '/api/users.info', self._users_info)
+        app.router.add_route('*', '/api/chat.postMessage', self._post_message)
+        app.router.add_get('/rtm', self._rtm)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return
+
+    def wait_for_connection(self, timeout: float = 10) -> bool:
+        """
+        Wait for the bot to connect to the RTM websocket
+        :param timeout: How long to wait, in seconds
+        :return: Whether it connected
+        """
+        return self._connected.wait(timeout)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        return
+
+    @staticmethod
+    async def _parameters(request: web.Request) -> Dict[str, Any]:
+        parameters = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == 'application/json':
+                parameters.update(await request.json())
+            else:
+                parameters.update(await request.post())
+        return parameters
+
+    async def _rtm_connect(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'ok': True,
+            'url': f'ws://{self.host}:{self.port}/rtm',
+            'self': {'id': BOT_USER_ID, 'name': 'scrum_bot'},
+            'team': {'id': 'T00000', 'name': 'Fake', 'domain': 'fake'},
+        })
+
+    async def _users_list(self, request: web.Request) -> web.Response:
+        parameters = await self._parameters(request)
+        start = int(parameters.get('cursor') or 0)
+        limit = int(parameters.get('limit') or 200)
+        end = start + limit
+        next_cursor = str(end) if end < len(self.members) else ''
+        return web.json_response({'ok': True, 'members': self.members[start:end],
+                                  'response_metadata': {'next_cursor': next_cursor}})
+
+    async def _users_info(self, request: web.Request) -> web.Response:
+        parameters = await self._parameters(request)
+        for member in self.members:
+            if member['id'] == parameters.get('user'):
+                return web.json_response({'ok': True, 'user': member})
+        return web.json_response({'ok': False, 'error': 'user_not_found'})
+
+    async def _post_message(self, request: web.Request) -> web.Response:
+        parameters = await self._parameters(request)
+        self.replies.append((time.perf_counter(), parameters))
+        ts = self._next_ts()
+        if self.echo_bot_messages:
+            event = {'type': 'message', 'channel': parameters.get('channel'), 'user': BOT_USER_ID, 'bot_id': BOT_ID,
+                     'text': parameters.get('text', ''), 'ts': ts}
+            if parameters.get('thread_ts'):
+                event['thread_ts'] = parameters['thread_ts']
+            await self._broadcast(json.dumps(event))
+        return web.json_response({'ok': True, 'channel': parameters.get('channel'), 'ts': ts})
+
+    async def _rtm(self, request: web.Request) -> web.WebSocketResponse:
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+        await socket.send_str(json.dumps({'type': 'hello'}))
+        self._sockets.append(socket)
+        self._connected.set()
+        async for message in socket:
+            if message.type == WSMsgType.TEXT and json.loads(message.data).get('type') == 'ping':
+                await socket.send_str(json.dumps({'type': 'pong', 'reply_to': json.loads(message.data)['id']}))
+        self._sockets.remove(socket)
+        return socket
+
+    def _next_ts(self) -> str:
+        return f'{int(time.time())}.{next(self._timestamps):06}'
+
+    def send_message(self, text: str, user: str, channel: str = 'C00000', ts: Optional[str] = None) -> str:
+        """
+        Send a message to every connected bot, as if someone posted it. Safe to call from any thread.
+        :param text: The message text
+        :param user: The id of the member who posted it
+        :param channel: The channel it was posted in
+        :param ts: The message's timestamp, which Slack uses as its id, or None to make one up
+        :return: The message's timestamp
+        """
+        ts = ts or self._next_ts()
+        event = json.dumps({'type': 'message', 'channel': channel, 'user': user, 'text': text, 'ts': ts})
+        asyncio.run_coroutine_threadsafe(self._broadcast(event), self._loop)
+        return ts
+
+    async def _broadcast(self, event: str):
+        for socket in list(self._sockets):
+            await socket.send_str(event)
+        return
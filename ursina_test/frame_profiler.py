@@ -0,0 +1,363 @@
+#
+# A frame profiler: per-frame phase times, update() cost per entity class and named sections, shown in an
+# overlay and exported for offline analysis. It costs next to nothing until it is enabled.
+#
+
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+# Phases of a frame, in order, and the panda3d task sort that ends each one.
+# input covers panda's data loop (sort -50), update covers ursina's update and the event manager that calls
+# input() (both sort 0), tasks covers intervals and collisions, and render covers igLoop (sort 50).
+PHASES = [('input', -1), ('update', 1), ('tasks', 49), ('render', 51)]
+# Time from the end of render to the start of the next frame, such as waiting for the frame rate limit
+IDLE_PHASE = 'idle'
+# The upper bounds of the overlay's frame time histogram buckets, in seconds
+HISTOGRAM_BUCKETS = [1 / 120, 1 / 60, 1 / 30, 1 / 15, .1]
+# How often to look for entity classes that have not been instrumented yet, in frames
+DISCOVER_EVERY = 30
+# How often the overlay is redrawn, in seconds
+OVERLAY_INTERVAL = .25
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Get a percentile of some values, such as fraction=.99 for p99
+    """
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class _NullSection:
+    """
+    What section() returns while the profiler is off
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+class FrameProfiler:
+    """
+    Times each frame of an Ursina app while enabled:
+    - phases, by adding panda3d tasks between the ones that read input, update and render
+    - update() for each entity class, by wrapping the update method of every class it sees in the scene
+    - named sections of the app, from section() and timed(), on any thread
+    The last `history` frames are kept for the overlay and for export().
+    """
+    def __init__(self, history: int = 600, max_events: int = 100000):
+        """
+        :param history: How many frames to keep
+        :param max_events: How many section events to keep, for the Chrome trace
+        """
+        self.enabled = False
+        self.frames = deque(maxlen=history)
+        # (name, thread id, start, duration), for every section on any thread
+        self.events = deque(maxlen=max_events)
+        self._frame: Optional[Dict[str, Any]] = None
+        self._frame_count = 0
+        self._last_mark = 0.0
+        self._epoch = time.perf_counter()
+        self._main_thread = threading.main_thread().ident
+        self._tasks = []
+        # Entity classes whose update() is wrapped, and the update() they had
+        self._wrapped: Dict[type, Callable] = {}
+        # Whether an entity update is being timed, so one calling super().update() is not counted twice
+        self._in_entity_update = False
+        self._main_update = None
+        self._overlay = None
+        self._overlay_drawn_at = 0.0
+        return
+
+    def enable(self, overlay: bool = True):
+        """
+        Start profiling
+        :param overlay: Whether to show the overlay
+        """
+        if self.enabled:
+            return
+        from ursina import application
+        import __main__
+        task_manager = application.base.taskMgr
+        self._tasks = [task_manager.add(self._frame_start, 'profiler_frame_start', sort=-1000)]
+        for phase, sort in PHASES:
+            self._tasks.append(task_manager.add(functools.partial(self._phase_end, phase), f'profiler_{phase}',
+                                                sort=sort))
+        # ursina looks __main__.update up every frame, so it can be swapped for a timed one
+        self._main_update = getattr(__main__, 'update', None)
+        if self._main_update is not None:
+            __main__.update = self.timed('app update')(self._main_update)
+        self.enabled = True
+        self._discover_entity_classes()
+        if overlay:
+            self._show_overlay()
+        return
+
+    def disable(self):
+        """
+        Stop profiling, and put everything that was instrumented back
+        """
+        if not self.enabled:
+            return
+        import __main__
+        self.enabled = False
+        for task in self._tasks:
+            task.remove()
+        self._tasks = []
+        for cls, update in self._wrapped.items():
+            cls.update = update
+        self._wrapped.clear()
+        if self._main_update is not None:
+            __main__.update = self._main_update
+            self._main_update = None
+        self._frame = None
+        if self._overlay is not None:
+            self._overlay.enabled = False
+        return
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+        return
+
+    def section(self, name: str):
+        """
+        Time a block as a named section: `with profiler.section('name'):`. Safe to use from any thread.
+        :param name: The section's name
+        """
+        if not self.enabled:
+            return _NULL_SECTION
+        return self._section(name)
+
+    @contextmanager
+    def _section(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record_section(name, start, time.perf_counter() - start)
+        return
+
+    def timed(self, name: Optional[str] = None):
+        """
+        Time every call to a function as a named section, as a decorator
+        :param name: The section's name, or None for the function's name
+        """
+        def decorate(function: Callable) -> Callable:
+            section_name = name or function.__qualname__
+
+            @functools.wraps(function)
+            def timed_function(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self._record_section(section_name, start, time.perf_counter() - start)
+            return timed_function
+        return decorate
+
+    def _record_section(self, name: str, start: float, duration: float):
+        thread_id = threading.get_ident()
+        self.events.append((name, thread_id, start, duration))
+        # Other threads do not hold up the frame, so only the main thread's sections count towards it
+        if thread_id == self._main_thread and self._frame is not None:
+            sections = self._frame['sections']
+            sections[name] = sections.get(name, 0.0) + duration
+        return
+
+    def _frame_start(self, task):
+        now = time.perf_counter()
+        if self._frame is not None:
+            self._frame['phases'][IDLE_PHASE] = now - self._last_mark
+            self._frame['duration'] = now - self._frame['start']
+            self.frames.append(self._frame)
+        self._frame_count += 1
+        self._frame = {'frame': self._frame_count, 'start': now, 'duration': 0.0,
+                       'phases': {}, 'entities': {}, 'sections': {}}
+        self._last_mark = now
+        if not self._frame_count % DISCOVER_EVERY:
+            self._discover_entity_classes()
+        if self._overlay is not None and now - self._overlay_drawn_at > OVERLAY_INTERVAL:
+            with self.section('profiler overlay'):
+                self._overlay.text = self.overlay_text()
+            self._overlay_drawn_at = now
+        return task.cont
+
+    def _phase_end(self, phase: str, task):
+        now = time.perf_counter()
+        if self._frame is not None:
+            self._frame['phases'][phase] = now - self._last_mark
+        self._last_mark = now
+        return task.cont
+
+    def _discover_entity_classes(self):
+        """
+        Wrap the update() of every entity class in the scene that has one, and has not been wrapped yet
+        """
+        from ursina import scene
+        for cls in set(type(entity) for entity in scene.entities):
+            for klass in cls.__mro__:
+                if 'update' in klass.__dict__ and klass not in self._wrapped and callable(klass.__dict__['update']):
+                    self._wrap_update(klass)
+        return
+
+    def _wrap_update(self, cls: type):
+        update = cls.__dict__['update']
+        profiler = self
+
+        @functools.wraps(update)
+        def timed_update(entity):
+            if not profiler.enabled or profiler._in_entity_update:
+                return update(entity)
+            profiler._in_entity_update = True
+            start = time.perf_counter()
+            try:
+                return update(entity)
+            finally:
+                profiler._in_entity_update = False
+                profiler._record_entity_update(type(entity).__name__, time.perf_counter() - start)
+        self._wrapped[cls] = update
+        cls.update = timed_update
+        return
+
+    def _record_entity_update(self, class_name: str, duration: float):
+        if self._frame is not None:
+            entities = self._frame['entities']
+            entities[class_name] = entities.get(class_name, 0.0) + duration
+        return
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Get p50 and p99 of the frame time, each phase, each entity class and each section, over the kept frames
+        """
+        frames = list(self.frames)
+
+        def stats(values: List[float]) -> Dict[str, float]:
+            return {'p50': percentile(values, .5), 'p99': percentile(values, .99)}
+
+        names = {'phases': [phase for phase, _ in PHASES] + [IDLE_PHASE], 'entities': set(), 'sections': set()}
+        for frame in frames:
+            names['entities'].update(frame['entities'])
+            names['sections'].update(frame['sections'])
+        summary = {'frames': len(frames), 'frame': stats([frame['duration'] for frame in frames])}
+        for kind, kind_names in names.items():
+            # Frames where something did not run count as 0, so the percentiles are per frame
+            summary[kind] = {name: stats([frame[kind].get(name, 0.0) for frame in frames]) for name in kind_names}
+        return summary
+
+    def histogram(self) -> List[int]:
+        """
+        Count the kept frames in each of HISTOGRAM_BUCKETS, plus one more bucket for anything slower
+        """
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for frame in self.frames:
+            bucket = 0
+            while bucket < len(HISTOGRAM_BUCKETS) and frame['duration'] > HISTOGRAM_BUCKETS[bucket]:
+                bucket += 1
+            counts[bucket] += 1
+        return counts
+
+    def overlay_text(self, top: int = 5) -> str:
+        """
+        Describe the kept frames, for the overlay
+        :param top: How many entity classes and sections to list
+        """
+        summary = self.summary()
+        ms = 1000
+        text = f'Frame p50 {summary["frame"]["p50"] * ms:5.1f} p99 {summary["frame"]["p99"] * ms:5.1f} ms\n'
+        counts = self.histogram()
+        total = max(1, sum(counts))
+        labels = [f'<{bound * ms:.0f}' for bound in HISTOGRAM_BUCKETS] + [f'>{HISTOGRAM_BUCKETS[-1] * ms:.0f}']
+        for label, count in zip(labels, counts):
+            text += f'{label:>5}ms {"#" * round(20 * count / total):20} {100 * count / total:3.0f}%\n'
+        for kind, title in (('phases', 'Phase'), ('entities', 'update()'), ('sections', 'Section')):
+            rows = sorted(summary[kind].items(), key=lambda item: item[1]['p99'], reverse=True)
+            if kind != 'phases':
+                rows = rows[:top]
+            if not rows:
+                continue
+            text += f'<yellow>{title:<18}  p50   p99<default>\n'
+            for name, stats in rows:
+                text += f'{name[:18]:<18} {stats["p50"] * ms:5.1f} {stats["p99"] * ms:5.1f}\n'
+        return text
+
+    def _show_overlay(self):
+        from ursina import window, color
+        from cell_text import CellText
+        if self._overlay is None:
+            self._overlay = CellText(
+                name='profiler_overlay',
+                position=window.top_right,
+                z=-999,
+                eternal=True,
+                origin=(.5, .5),
+                color=color.white,
+                font='VeraMono.ttf',
+                columns=31,
+                rows=30,
+                text='')
+        self._overlay.enabled = True
+        return
+
+    def export(self, filename: str):
+        """
+        Write the kept frames and sections to a file: Chrome trace format (for chrome://tracing or Perfetto)
+        if it ends in .json, or one JSON object per frame if it ends in .jsonl
+        :param filename: Where to write them
+        """
+        if filename.endswith('.jsonl'):
+            with open(filename, 'w') as f:
+                for frame in self.frames:
+                    f.write(json.dumps(dict(frame, start=frame['start'] - self._epoch)) + '\n')
+        else:
+            with open(filename, 'w') as f:
+                json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f)
+        return
+
+    def trace_events(self) -> List[Dict[str, Any]]:
+        """
+        Get the kept frames and sections as Chrome trace events: phases and sections as complete events, and
+        the update() cost of each entity class as a counter
+        """
+        def microseconds(seconds: float) -> float:
+            return round(seconds * 1000000, 1)
+
+        events = []
+        for frame in self.frames:
+            start = frame['start']
+            events.append({'name': f'frame {frame["frame"]}', 'cat': 'frame', 'ph': 'X', 'pid': 0,
+                           'tid': self._main_thread, 'ts': microseconds(start - self._epoch),
+                           'dur': microseconds(frame['duration'])})
+            for phase, _ in PHASES + [(IDLE_PHASE, None)]:
+                duration = frame['phases'].get(phase, 0.0)
+                events.append({'name': phase, 'cat': 'phase', 'ph': 'X', 'pid': 0, 'tid': self._main_thread,
+                               'ts': microseconds(start - self._epoch), 'dur': microseconds(duration)})
+                start += duration
+            if frame['entities']:
+                events.append({'name': 'update() ms', 'cat': 'entities', 'ph': 'C', 'pid': 0,
+                               'ts': microseconds(frame['start'] - self._epoch),
+                               'args': {name: duration * 1000 for name, duration in frame['entities'].items()}})
+        for name, thread_id, start, duration in list(self.events):
+            events.append({'name': name, 'cat': 'section', 'ph': 'X', 'pid': 0, 'tid': thread_id,
+                           'ts': microseconds(start - self._epoch), 'dur': microseconds(duration)})
+        return events
+
+
+# The profiler for the app
+profiler = FrameProfiler()
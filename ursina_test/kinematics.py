@@ -0,0 +1,134 @@
+#
+# Spin and move entities from packed velocity arrays, all of them in one pass each frame
+#
+
+from typing import Dict, List, Tuple
+
+import numpy as np
+from ursina import Entity, Vec3
+
+from frame_profiler import profiler
+
+
+class Kinematics:
+    """
+    Entities with an angular velocity (degrees per second around x, y and z, like Entity.rotation) and a linear
+    velocity (units per second, like Entity.position).
+
+    Only entities that are moving are kept, packed into the first rows of the arrays, so stopping an entity
+    costs nothing from then on. Each frame the new rotations and positions are worked out in one numpy step,
+    then written with one panda3d call per entity, instead of going through ursina's rotation_x/y/z setters
+    (each of which reads the whole rotation back).
+
+    While an entity is moving, its rotation (and position, if it has a linear velocity) belong to this.
+    Calling set_velocity() again picks up any changes made to them in the meantime.
+    """
+    def __init__(self, capacity: int = 16):
+        """
+        :param capacity: How many moving entities there is room for before the arrays have to grow
+        """
+        self._entities: List[Entity] = []
+        # Each entity's row, by id
+        self._rows: Dict[int, int] = {}
+        # float64, so adding a little every frame does not drift
+        self._rotations = np.zeros((capacity, 3))
+        self._angular = np.zeros((capacity, 3))
+        self._positions = np.zeros((capacity, 3))
+        self._linear = np.zeros((capacity, 3))
+        # Whether each entity has a linear velocity, so the ones that only spin do not have their position written
+        self._translating = np.zeros(capacity, dtype=bool)
+        return
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+    def __contains__(self, entity: Entity) -> bool:
+        return id(entity) in self._rows
+
+    def set_velocity(self, entity: Entity, angular=Vec3(0, 0, 0), linear=Vec3(0, 0, 0)):
+        """
+        Start (or change, or stop) an entity moving
+        :param entity: The entity
+        :param angular: Degrees per second around each axis
+        :param linear: Units per second along each axis
+        """
+        angular = tuple(angular)
+        linear = tuple(linear)
+        if not any(angular) and not any(linear):
+            self.remove(entity)
+            return
+        row = self._rows.get(id(entity), None)
+        if row is None:
+            row = self._add(entity)
+        self._rotations[row] = tuple(entity.rotation)
+        self._angular[row] = angular
+        self._positions[row] = tuple(entity.position)
+        self._linear[row] = linear
+        self._translating[row] = any(linear)
+        return
+
+    def velocity(self, entity: Entity) -> Tuple[Vec3, Vec3]:
+        """
+        :return: (angular velocity, linear velocity), which are zero if the entity is not moving
+        """
+        row = self._rows.get(id(entity), None)
+        if row is None:
+            return Vec3(0, 0, 0), Vec3(0, 0, 0)
+        return Vec3(*self._angular[row]), Vec3(*self._linear[row])
+
+    def _add(self, entity: Entity) -> int:
+        row = len(self._entities)
+        if row == len(self._rotations):
+            for name in ('_rotations', '_angular', '_positions', '_linear', '_translating'):
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate((array, np.zeros_like(array))))
+        self._entities.append(entity)
+        self._rows[id(entity)] = row
+        return row
+
+    def remove(self, entity: Entity):
+        """
+        Stop moving an entity, leaving it where it is. Entities that are destroyed must be removed.
+        """
+        row = self._rows.pop(id(entity), None)
+        if row is None:
+            return
+        # Keep the moving entities packed by moving the last one into the gap
+        last = len(self._entities) - 1
+        if row != last:
+            moved = self._entities[last]
+            self._entities[row] = moved
+            self._rows[id(moved)] = row
+            for array in (self._rotations, self._angular, self._positions, self._linear, self._translating):
+                array[row] = array[last]
+        self._entities.pop()
+        return
+
+    @profiler.timed('kinematics')
+    def update(self, dt: float):
+        """
+        Move everything along
+        :param dt: The time since the last frame, in seconds
+        """
+        count = len(self._entities)
+        if not count:
+            return
+        rotations = self._rotations[:count]
+        rotations += self._angular[:count] * dt
+        np.remainder(rotations, 360, out=rotations)
+        positions = self._positions[:count]
+        positions += self._linear[:count] * dt
+        # Entity.rotation is (x, y, z) while panda3d wants (heading, pitch, roll), which is (y, x, z) with some
+        # axes flipped
+        hprs = rotations[:, [1, 0, 2]] * Entity.rotation_directions
+        for entity, hpr, position, translating in zip(self._entities, hprs.tolist(), positions.tolist(),
+                                                       self._translating[:count].tolist()):
+            if translating:
+                entity.setPosHpr(*position, *hpr)
+            else:
+                entity.setHpr(*hpr)
+        return
+
+
+# The moving entities for the whole process
+kinematics = Kinematics()
@@ -1,51 +1,125 @@
 from ursina import *
 from ursina.prefabs.first_person_controller import FirstPersonController
+import numpy as np
+from typing import List, Optional
 
-from random_image import random_image
+from random_image import ensure_enough_random_images
+from texture_cache import texture_cache
+from voxel_store import VoxelStore
+from voxel_world import VoxelWorld, AIR, CHUNK_SIZE
+from terrain import TerrainGenerator, ChunkStreamer, TERRAIN_BLOCK_COLORS
 
 app = Ursina()
 
+# Placed blocks get one of the random images, each with its own block ID starting here
+RANDOM_BLOCKS_START = 16
+RANDOM_BLOCK_COUNT = 30
+# How far away blocks can be picked
+reach = 8
+# Where the world is saved
+world_filename = 'world.vox'
 
-class Voxel(Button):
-    def __init__(self, position=(0,0,0)):
-        texture = Texture(random_image(width=200, height=200, path=Path(application.textures_folder), minimum_count=30))
-        super().__init__(
-            parent = scene,
-            position = position,
-            model = 'cube',
-            origin_y = .5,
-            texture = texture,
-            color = color.color(0, 0, random.uniform(.9, 1.0)),
-            highlight_color = color.lime,
-        )
-        return
 
-    def input(self, key):
-        if self.hovered:
-            if key == 'left mouse down':
-                voxel = Voxel(position=self.position + mouse.normal)
+def load_store() -> VoxelStore:
+    """
+    Load the saved world, or start a new one with a random seed
+    """
+    if Path(world_filename).exists():
+        return VoxelStore.load(world_filename)
+    return VoxelStore(chunk_size=CHUNK_SIZE, metadata={'seed': random.randint(0, 2 ** 16)})
 
-            if key == 'right mouse down':
-                destroy(self)
-        return
 
+def block_images(store: VoxelStore, images: List[Path]) -> List[Path]:
+    """
+    Get the image for each random block, which is the same every time the world is loaded. The order the random
+    images are listed in changes from run to run, so which block has which image is kept in the world's metadata.
+    :param store: The world
+    :param images: The random images there are
+    """
+    by_name = {image.name: image for image in images}
+    saved = store.metadata.get('block_images', [])
 
-for z in range(8):
-    for x in range(8):
-        voxel = Voxel(position=(x,0,z))
+    def number_first(name: str):
+        stem = Path(name).stem
+        return (0, int(stem), name) if stem.isdigit() else (1, 0, name)
+    # Images that have gone missing are replaced by ones no other block has, lowest number first
+    unused = sorted(set(by_name) - set(saved), key=number_first)
+    names = []
+    for name in saved:
+        if name not in by_name:
+            name = unused.pop(0) if unused else names[0] if names else sorted(by_name, key=number_first)[0]
+        names.append(name)
+    names += unused[:RANDOM_BLOCK_COUNT - len(names)]
+    store.metadata['block_images'] = names
+    return [by_name[name] for name in names]
 
 
 def input(key):
     print(f'{key=}')
     if key == 'escape':
         print('Bye')
+        streamer.stop()
+        store.save(world_filename)
         application.quit()
+    elif key == 'f5':
+        store.save(world_filename)
+        print(f'Saved {world_filename}')
     elif key == 'scroll up':
         player.y += 2
     elif key == 'scroll down':
         player.y -= 2
+    elif key in ('left mouse down', 'right mouse down'):
+        hit = world.raycast(camera.world_position, camera.forward, max_distance=reach)
+        if not hit:
+            return
+        position, normal = hit
+        if key == 'left mouse down':
+            block = RANDOM_BLOCKS_START + random.randrange(len(random_images))
+            world.set_block(position + normal, block)
+        else:
+            world.set_block(position, AIR)
     return
 
 
-player = FirstPersonController()
-app.run()
+def update():
+    # Show which block is being pointed at
+    hit = world.raycast(camera.world_position, camera.forward, max_distance=reach)
+    highlight.visible = hit is not None
+    if hit:
+        highlight.position = hit[0]
+    return
+
+
+def init(walker: Optional[Entity] = None):
+    """
+    :param walker: What to stream the world around, or None for a first person controller (which needs a window
+                   that can lock the mouse)
+    """
+    global store, random_images, world, generator, player, highlight, streamer
+    store = load_store()
+    # Every block texture is packed into one atlas, so all of the chunks share one texture
+    random_images = block_images(store, ensure_enough_random_images(width=200, height=200, count=RANDOM_BLOCK_COUNT,
+                                                                    path=Path(application.textures_folder)))
+    atlas = texture_cache.atlas(random_images, tile_size=(200, 200))
+    block_uvs = np.tile(np.array(atlas.white_uv, dtype=np.float32), (256, 1))
+    for i, image in enumerate(random_images):
+        block_uvs[RANDOM_BLOCKS_START + i] = atlas.uv_rect(image)
+    world = VoxelWorld(texture=atlas.texture, block_uvs=block_uvs, block_colors=TERRAIN_BLOCK_COLORS, store=store)
+    generator = TerrainGenerator(seed=store.metadata['seed'])
+    # Start just above the ground
+    spawn_height = int(generator.heightmap(0, 0)[0, 0]) + 2
+    player = walker or FirstPersonController()
+    player.position = Vec3(0, spawn_height, 0)
+    highlight = Entity(model='cube', color=color.color(120, 1, 1, .3), scale=1.01, visible=False)
+    streamer = ChunkStreamer(world, generator, target=player)
+    streamer.preload()
+    return
+
+
+def main():
+    init()
+    app.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,422 @@
+#
+# Convert the models in models/ into a compact binary mesh format in models_compressed/, which is memory-mapped
+# when it is loaded. Each conversion is named by a hash of what it was made from, so a fresh checkout or deploy
+# (which changes the timestamps but not the contents) does not convert anything again. Models that do need
+# converting are converted in a pool of processes, one per core.
+#
+
+import hashlib
+import mmap
+import multiprocessing
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from panda3d.core import Geom, GeomNode, GeomTriangles, GeomVertexArrayFormat, GeomVertexData, GeomVertexFormat
+from panda3d.core import InternalName, NodePath
+
+# Where the models are, and where they are converted to
+MODELS_FOLDER = 'models'
+COMPRESSED_MODELS_FOLDER = 'models_compressed'
+# The kinds of models that are converted, in the order they are looked for
+SOURCE_SUFFIXES = ('.obj', '.blend')
+MESH_SUFFIX = '.umesh'
+
+# The binary mesh format: a header, then float32 columns, one after the other, each one vertex_count rows long.
+# Triangles are not indexed: every three rows are one triangle.
+MESH_MAGIC = b'UMSH'
+# Part of every hash, so changing the format (or the conversion) converts everything again
+MESH_VERSION = 1
+# magic, version, vertex count, which of the optional columns there are
+MESH_HEADER = struct.Struct('<4sIII')
+HAS_NORMALS = 1
+HAS_UVS = 2
+HAS_COLORS = 4
+# (flag, name, components) for each column, in the order they are in the file. Vertices are always there.
+MESH_COLUMNS = [
+    (0, 'vertex', 3),
+    (HAS_NORMALS, 'normal', 3),
+    (HAS_UVS, 'texcoord', 2),
+    (HAS_COLORS, 'color', 4),
+]
+
+
+def read_mtl(path: Path) -> Dict[str, Tuple[float, float, float, float]]:
+    """
+    Read the diffuse colour of each material in a .mtl file
+    :return: Colours, by material name
+    """
+    colors = {}
+    if not path.exists():
+        return colors
+    material = None
+    for line in open(path, 'r'):
+        if line.startswith('newmtl '):
+            material = line[7:].strip()
+        elif line.startswith('Kd ') and material is not None:
+            r, g, b = (float(part) for part in line.split()[1:4])
+            colors[material] = (r, g, b, 1.)
+    return colors
+
+
+def mtl_paths(path: Path) -> List[Path]:
+    """
+    Get the .mtl files a .obj file uses, from its mtllib lines
+    """
+    paths = []
+    for line in open(path, 'r'):
+        if line.startswith('mtllib '):
+            paths += [path.parent / name for name in line.split()[1:]]
+    return paths
+
+
+def obj_index(text: str, count: int) -> int:
+    """
+    Turn an index in a .obj face into a list index
+    :param text: The index, which counts from 1, or back from the latest element if it is negative
+    :param count: How many elements of its kind (positions, uvs or normals) there are so far
+    """
+    index = int(text)
+    return index - 1 if index > 0 else count + index
+
+
+def read_obj(path: Path) -> Dict[str, np.ndarray]:
+    """
+    Read a .obj file (and the .mtl files it names) the way ursina does: x is flipped, faces are split into triangles and
+    each face gets its material's colour
+    :return: Each column, by name, with a row per triangle corner. Columns the file does not have are left out.
+    """
+    positions = []
+    vertex_colors = []
+    uvs = []
+    normals = []
+    materials = {}
+    current_color = None
+    # For every triangle corner: the position, uv and normal indices, and the material colour
+    corner_positions = []
+    corner_uvs = []
+    corner_normals = []
+    corner_colors = []
+    for line in open(path, 'r'):
+        if line.startswith('v '):
+            parts = [float(part) for part in line.split()[1:]]
+            positions.append(parts[:3])
+            if len(parts) > 3:
+                vertex_colors.append(parts[3:6] + [1.])
+        elif line.startswith('vn '):
+            normals.append([float(part) for part in line.split()[1:4]])
+        elif line.startswith('vt '):
+            uvs.append([float(part) for part in line.split()[1:3]])
+        elif line.startswith('f '):
+            corners = [corner.split('/') for corner in line.split()[1:]]
+            if len(corners) == 3:
+                order = (0, 1, 2)
+            elif len(corners) == 4:
+                order = (0, 1, 2, 2, 3, 0)
+            else:
+                order = [i for first in range(1, len(corners) - 1) for i in (first, first + 1, 0)]
+            for i in order:
+                corner = corners[i] + ['', '']
+                corner_positions.append(obj_index(corner[0], len(positions)))
+                corner_uvs.append(obj_index(corner[1], len(uvs)) if corner[1] else -1)
+                corner_normals.append(obj_index(corner[2], len(normals)) if corner[2] else -1)
+                corner_colors.append(current_color)
+        elif line.startswith('mtllib '):
+            for name in line.split()[1:]:
+                materials.update(read_mtl(path.parent / name))
+        elif line.startswith('usemtl '):
+            current_color = materials.get(line[7:].strip(), current_color)
+
+    columns = {}
+    vertices = np.array(positions, dtype=np.float32).reshape(-1, 3)[corner_positions]
+    vertices[:, 0] *= -1
+    columns['vertex'] = vertices
+    if normals and min(corner_normals, default=-1) >= 0:
+        corner_normal_values = np.array(normals, dtype=np.float32)[corner_normals]
+        corner_normal_values[:, 0] *= -1
+        columns['normal'] = corner_normal_values
+    if uvs and min(corner_uvs, default=-1) >= 0:
+        columns['texcoord'] = np.array(uvs, dtype=np.float32)[corner_uvs]
+    if any(c is not None for c in corner_colors) or vertex_colors:
+        packed = np.array(vertex_colors, dtype=np.float32).reshape(-1, 4)
+        colors = np.ones((len(corner_positions), 4), dtype=np.float32)
+        for row, (position, material_color) in enumerate(zip(corner_positions, corner_colors)):
+            if material_color is not None:
+                colors[row] = material_color
+            elif position < len(packed):
+                colors[row] = packed[position]
+        columns['color'] = colors
+    return columns
+
+
+def write_mesh(path: Path, columns: Dict[str, np.ndarray]):
+    """
+    Write a mesh in the binary format, replacing any old one atomically
+    :param columns: As returned by read_obj()
+    """
+    vertex_count = len(columns['vertex'])
+    flags = 0
+    for flag, name, _ in MESH_COLUMNS:
+        if name in columns:
+            flags |= flag
+    # A temporary file of its own, since several processes (boards in multi-board mode) can convert the
+    # same model at once
+    handle, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f'{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(MESH_HEADER.pack(MESH_MAGIC, MESH_VERSION, vertex_count, flags))
+            for flag, name, components in MESH_COLUMNS:
+                if name in columns:
+                    column = np.ascontiguousarray(columns[name], dtype='<f4')
+                    assert column.shape == (vertex_count, components), f'{name} is {column.shape}'
+                    f.write(column.tobytes())
+        os.replace(temp_name, path)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+    return
+
+
+def convert_model(source: Path, destination: Path, blender: Optional[str] = None,
+                  export_script: Optional[str] = None) -> Path:
+    """
+    Convert a model to the binary format. This runs in the conversion processes.
+    :param source: The .obj or .blend file
+    :param destination: Where to write the mesh
+    :param blender: The blender to export .blend files to .obj with
+    :param export_script: ursina's export script for blender
+    :return: The destination
+    """
+    if source.suffix == '.obj':
+        write_mesh(destination, read_obj(source))
+        return destination
+    if blender is None:
+        raise RuntimeError(f'{source} needs blender to convert it, and it was not found')
+    with tempfile.TemporaryDirectory() as folder:
+        obj_path = Path(folder) / f'{source.stem}.obj'
+        subprocess.run((blender, str(source), '--background', '--python', export_script, str(obj_path)),
+                       check=True, stdout=subprocess.DEVNULL)
+        write_mesh(destination, read_obj(obj_path))
+    return destination
+
+
+def load_mesh(path: Path) -> Geom:
+    """
+    Load a mesh in the binary format, copying each column straight from the file into the vertex data
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        magic, version, vertex_count, flags = MESH_HEADER.unpack_from(mapped)
+        if magic != MESH_MAGIC or version != MESH_VERSION:
+            raise ValueError(f'{path} is not a version {MESH_VERSION} mesh')
+        columns = [(name, components) for flag, name, components in MESH_COLUMNS if not flag or flags & flag]
+        # One array per column, so each one is a single copy
+        vertex_format = GeomVertexFormat()
+        for name, components in columns:
+            array_format = GeomVertexArrayFormat()
+            contents = {'vertex': Geom.C_point, 'normal': Geom.C_normal, 'texcoord': Geom.C_texcoord,
+                        'color': Geom.C_color}[name]
+            array_format.add_column(InternalName.make(name), components, Geom.NT_float32, contents)
+            vertex_format.add_array(array_format)
+        vertex_data = GeomVertexData(path.stem, GeomVertexFormat.register_format(vertex_format), Geom.UH_static)
+        vertex_data.unclean_set_num_rows(vertex_count)
+        offset = MESH_HEADER.size
+        for i, (name, components) in enumerate(columns):
+            size = vertex_count * components * 4
+            memoryview(vertex_data.modify_array(i)).cast('B')[:] = mapped[offset:offset + size]
+            offset += size
+    triangles = GeomTriangles(Geom.UH_static)
+    triangles.add_consecutive_vertices(0, vertex_count)
+    geom = Geom(vertex_data)
+    geom.add_primitive(triangles)
+    return geom
+
+
+def source_hash(source: Path) -> str:
+    """
+    Hash everything a conversion is made from
+    """
+    digest = hashlib.sha256(f'{MESH_VERSION}\0{source.suffix}\0'.encode())
+    paths = [source]
+    if source.suffix == '.obj':
+        paths += mtl_paths(source)
+    for path in paths:
+        if path.exists():
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        digest.update(b'\0')
+    return digest.hexdigest()[:32]
+
+
+class ModelCache:
+    """
+    The converted models. Thread safe, so models can be loaded in the background. The lock is never held
+    while converting or loading: anyone who needs a model that is already being converted waits for just
+    that model.
+    """
+    def __init__(self, models_folder: str = MODELS_FOLDER, compressed_folder: str = COMPRESSED_MODELS_FOLDER,
+                 workers: Optional[int] = None):
+        """
+        :param models_folder: Where the models are
+        :param compressed_folder: Where to keep the converted models
+        :param workers: The most models to convert at once, or None for one per core
+        """
+        self.models_folder = Path(models_folder)
+        self.compressed_folder = Path(compressed_folder)
+        self.workers = workers or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        # The model files, by name, found the first time they are needed
+        self._sources: Optional[Dict[str, Path]] = None
+        self._geoms: Dict[str, Geom] = {}
+        # The conversions in progress, by name, each finishing with whether it worked
+        self._converting: Dict[str, Future] = {}
+        return
+
+    def sources(self) -> Dict[str, Path]:
+        with self._lock:
+            if self._sources is None:
+                self._sources = {}
+                for suffix in reversed(SOURCE_SUFFIXES):
+                    for path in sorted(self.models_folder.glob(f'**/*{suffix}')):
+                        self._sources[path.stem] = path
+        return self._sources
+
+    def mesh_path(self, name: str) -> Optional[Path]:
+        """
+        Get where a model is (or will be) converted to, or None if it is not in models_folder
+        """
+        source = self.sources().get(name, None)
+        if source is None:
+            return None
+        return self.compressed_folder / f'{name}-{source_hash(source)}{MESH_SUFFIX}'
+
+    def build(self, names: Optional[Iterable[str]] = None) -> Dict[str, Path]:
+        """
+        Convert the models that have not been converted yet
+        :param names: The models to convert, or None for all of them. Names not in models_folder are skipped.
+        :return: The converted models, by name. Models that could not be converted are left out.
+        """
+        sources = self.sources()
+        names = list(sources) if names is None else [name for name in names if name in sources]
+        paths = {name: self.mesh_path(name) for name in names}
+        # Each model is converted by whoever asks for it first; everyone else waits for that conversion
+        mine = {}
+        waiting = {}
+        with self._lock:
+            for name, path in paths.items():
+                future = self._converting.get(name, None)
+                if future is None:
+                    if path.exists():
+                        continue
+                    future = Future()
+                    self._converting[name] = future
+                    mine[name] = future
+                waiting[name] = future
+        if mine:
+            try:
+                self.compressed_folder.mkdir(parents=True, exist_ok=True)
+                self._convert(mine, paths)
+            finally:
+                # Anything the conversion did not get to has failed
+                for name, future in mine.items():
+                    if not future.done():
+                        self._finish(name, future, False)
+        for name, future in waiting.items():
+            if not future.result():
+                del paths[name]
+        return paths
+
+    def _convert(self, conversions: Dict[str, Future], paths: Dict[str, Path]):
+        """
+        Convert models in a pool of processes, finishing each conversion as soon as its model is done
+        :param conversions: The conversions to do, by name
+        :param paths: Where to convert each model to
+        """
+        names = list(conversions)
+        blender, export_script = None, None
+        if any(self.sources()[name].suffix == '.blend' for name in names):
+            blender, export_script = find_blender(self.sources()[names[0]])
+        print(f'Converting {len(names)} models')
+        # Spawned, so the workers do not inherit the window and the app's threads
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(names)),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {pool.submit(convert_model, self.sources()[name], paths[name], blender, export_script): name
+                       for name in names}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    future.result()
+                    self._remove_old_conversions(name, paths[name])
+                    converted = True
+                except Exception as e:
+                    print(f'Could not convert {name}: {e!r}')
+                    converted = False
+                self._finish(name, conversions[name], converted)
+        return
+
+    def _finish(self, name: str, conversion: Future, converted: bool):
+        with self._lock:
+            del self._converting[name]
+        conversion.set_result(converted)
+        return
+
+    def _remove_old_conversions(self, name: str, current: Path):
+        for path in self.compressed_folder.glob(f'{name}-*{MESH_SUFFIX}'):
+            if path != current:
+                path.unlink()
+        return
+
+    def load(self, name: str) -> Optional[Geom]:
+        """
+        Get a model's mesh, converting it first if it has not been converted
+        :return: The mesh, or None if the model is not in models_folder or could not be converted
+        """
+        # Most models (like "cube") are ursina's own, and never wait for anything here
+        if name not in self.sources():
+            return None
+        with self._lock:
+            geom = self._geoms.get(name, None)
+        if geom is not None:
+            return geom
+        path = self.build([name]).get(name, None)
+        if path is None:
+            return None
+        geom = load_mesh(path)
+        with self._lock:
+            # Another thread may have loaded it meanwhile, and everyone should share one mesh
+            geom = self._geoms.setdefault(name, geom)
+        return geom
+
+    def model(self, name: str) -> Optional[NodePath]:
+        """
+        Get a model for an entity. The mesh is shared with every other entity using the same model.
+        :return: The model, or None if the model is not in models_folder or could not be converted
+        """
+        geom = self.load(name)
+        if geom is None:
+            return None
+        node = GeomNode(name)
+        node.add_geom(geom)
+        return NodePath(node)
+
+
+def find_blender(blend_file: Path) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Find the blender ursina would use for a .blend file, and ursina's export script
+    :return: (blender, export script), or (None, None) if there is no blender
+    """
+    from ursina import application
+    from ursina.mesh_importer import get_blender
+    if not application.blender_paths:
+        return None, None
+    return str(get_blender(blend_file)), str(application.internal_scripts_folder / '_blend_export.py')
+
+
+# The converted models for the whole process
+model_cache = ModelCache()
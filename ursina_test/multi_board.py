@@ -0,0 +1,306 @@
+#
+# Several stand-ups, each with its own window, roster and scoreboard, sharing one Slack connection.
+# Usage: python multi_board.py boards.json
+#
+# boards.json lists the boards, and the channels whose commands go to each one:
+# {"boards": [{"name": "Team A", "channels": ["C0123ABCD"],
+#              "participants": [{"name": "Mark Carlson", "image": "textures/simpsons-climbing.mp4"}, ...]},
+#             ...]}
+#
+# This process is the hub: it runs the Slack bot and the user directory, and is the only one that changes the
+# cheer data, journal and ledger. Each board is a process of its own, started with a copy of the cheer data,
+# sent the changes after each command, and reading windowed leaderboards straight from the shared ledger.
+# Commands from channels that no board listens to (including direct messages) are ignored.
+#
+
+import argparse
+import json
+import multiprocessing
+import time
+from multiprocessing.connection import Connection, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+import slack_bot
+from cheer_state import CheerState, cheer_texture, cheers_textures
+from command_queue import main_thread_commands
+
+# The most time to spend each frame on changes from the hub, in seconds
+BOARD_BUDGET = .004
+# The most time to spend on commands from the Slack bot before checking on the boards, in seconds
+HUB_BUDGET = .01
+# How long the hub waits for the boards when there is nothing to do, in seconds
+HUB_POLL_INTERVAL = .02
+
+# The board this process shows, in board processes
+board = None
+
+
+class BoardProxy:
+    """
+    Stands in for one board's scoreboard on the hub, so the Slack bot's commands work as they do with a
+    single scoreboard. Like a scoreboard, it is only used from the hub's main loop.
+    """
+    def __init__(self, hub: 'BoardHub', config: Dict[str, Any]):
+        """
+        :param hub: The hub
+        :param config: The board's entry in boards.json
+        """
+        self.hub = hub
+        self.name = config['name']
+        self.channels = config.get('channels', [])
+        self.participants = config['participants']
+        self.process = None
+        self.connection: Optional[Connection] = None
+        return
+
+    def attendee_names(self) -> List[str]:
+        return list(set(p['name'] for p in self.participants))
+
+    def send(self, message: tuple):
+        """
+        Send a message to the board, unless it has been closed
+        """
+        if self.connection is None:
+            return
+        try:
+            self.connection.send(message)
+        except (BrokenPipeError, EOFError, OSError):
+            self.hub.board_closed(self)
+        return
+
+    def transfer_many(self, name_from: str, transfers: List[Tuple[str, int]], texture: Optional[str]):
+        self.hub.transfer_many(self, name_from, transfers, texture)
+        return
+
+    def stats_text(self, username: str) -> str:
+        return self.hub.state.stats_text(username)
+
+    def sort_keys(self) -> List[str]:
+        return self.hub.state.sort_keys()
+
+    def set_sort_key(self, sort_key: str):
+        self.send(('sort', sort_key))
+        return
+
+
+class BoardHub:
+    """
+    Owns the cheer data for every board, and keeps the boards up to date
+    """
+    def __init__(self, boards: List[Dict[str, Any]], state: CheerState, ledger_filename: str):
+        """
+        :param boards: The boards in boards.json
+        :param state: The cheer data, which only the hub changes
+        :param ledger_filename: The ledger the state writes to, which the boards read
+        """
+        self.state = state
+        self.ledger_filename = ledger_filename
+        self.boards = [BoardProxy(self, config) for config in boards]
+        self._by_channel = {channel: proxy for proxy in self.boards for channel in proxy.channels}
+        return
+
+    def board_for_message(self, data: dict) -> Optional[BoardProxy]:
+        """
+        Get the board a Slack message is for, for slack_bot.scoreboard_for
+        :param data: The message data
+        """
+        return self._by_channel.get(data.get('channel', None), None)
+
+    def start(self):
+        """
+        Start a process for each board
+        """
+        # Spawned, so the boards do not inherit the bot's thread and the hub's open files
+        context = multiprocessing.get_context('spawn')
+        for proxy in self.boards:
+            hub_end, board_end = context.Pipe()
+            proxy.connection = hub_end
+            proxy.process = context.Process(
+                target=run_board, name=proxy.name,
+                args=(proxy.name, proxy.participants, board_end, self.state.cheer_data, self.ledger_filename))
+            proxy.process.start()
+            # Only the board uses its end
+            board_end.close()
+        return
+
+    def running(self) -> bool:
+        return any(proxy.connection is not None for proxy in self.boards)
+
+    def board_closed(self, proxy: BoardProxy):
+        if proxy.connection is not None:
+            proxy.connection.close()
+            proxy.connection = None
+            print(f'{proxy.name} closed')
+        return
+
+    def broadcast(self, changes, transfer_board: Optional[BoardProxy] = None, transfer=None):
+        """
+        Send changes to the cheer data to every board
+        :param changes: The new values for the attendees that changed
+        :param transfer_board: The board to cheer on, if the changes were a transfer
+        :param transfer: The transfer, for CheerScoreboard.show_transfer
+        """
+        for proxy in self.boards:
+            proxy.send(('changes', changes, transfer if proxy is transfer_board else None))
+        return
+
+    def transfer_many(self, proxy: BoardProxy, name_from: str, transfers: List[Tuple[str, int]],
+                      texture: Optional[str]):
+        """
+        Transfer points for a give command, and cheer on the board it came from
+        :param proxy: The board the command came from
+        """
+        texture = cheer_texture(texture, cheers_textures())
+        changed = self.state.transfer_many(name_from, transfers, texture)
+        # The boards read windowed leaderboards from the ledger as soon as they get the changes
+        self.state.ledger.flush()
+        self.broadcast(self.state.changes(*changed), proxy,
+                       {'name_from': name_from, 'transfers': transfers, 'texture': texture})
+        return
+
+    def give_everyone_points(self, points: int):
+        self.broadcast(self.state.changes(*self.state.give_everyone_points(points)))
+        return
+
+    def add_new_attendees(self, directory):
+        """
+        Add every board's participants to the cheer data once they show up in the user directory
+        :param directory: The slack_bot UserDirectory
+        """
+        added = []
+        for proxy in self.boards:
+            for name, username in directory.find_attendees(proxy.attendee_names()).items():
+                if self.state.add_attendee(username, name):
+                    added.append(username)
+        if added:
+            self.broadcast(self.state.changes(*added))
+        return
+
+    def poll(self, timeout: float):
+        """
+        Handle messages from the boards
+        :param timeout: How long to wait for one, in seconds
+        """
+        connections = {proxy.connection: proxy for proxy in self.boards if proxy.connection is not None}
+        for connection in wait(list(connections), timeout=timeout):
+            proxy = connections[connection]
+            try:
+                message = connection.recv()
+            except EOFError:
+                self.board_closed(proxy)
+                continue
+            if message[0] == 'give_everyone_points':
+                self.give_everyone_points(message[1])
+        return
+
+    def stop(self):
+        for proxy in self.boards:
+            proxy.send(('quit',))
+            self.board_closed(proxy)
+        for proxy in self.boards:
+            if proxy.process is not None:
+                proxy.process.join(timeout=5)
+        return
+
+
+class Board:
+    """
+    The board's end of its connection to the hub, in a board process
+    """
+    def __init__(self, connection: Connection):
+        self.connection = connection
+        return
+
+    def update(self, scoreboard):
+        """
+        Show whatever the hub has sent, redrawing once
+        :param scoreboard: The board's CheerScoreboard
+        """
+        from ursina import application
+        deadline = time.perf_counter() + BOARD_BUDGET
+        with scoreboard.batch():
+            try:
+                while time.perf_counter() < deadline and self.connection.poll():
+                    message = self.connection.recv()
+                    if message[0] == 'changes':
+                        scoreboard.apply_changes(message[1], message[2])
+                    elif message[0] == 'sort':
+                        scoreboard.set_sort_key(message[1])
+                    elif message[0] == 'quit':
+                        application.quit()
+            except (EOFError, OSError):
+                print('Lost the hub')
+                application.quit()
+        return
+
+
+def run_board(name: str, participants: List[Dict[str, Any]], connection: Connection,
+              cheer_data: Dict[str, Dict[str, Any]], ledger_filename: str):
+    """
+    Show one board. This is the board process.
+    :param name: The board's name, for its window title
+    :param participants: Everyone in the board's meeting
+    :param connection: The connection to the hub
+    :param cheer_data: The hub's cheer data when the board started
+    :param ledger_filename: The hub's ledger
+    """
+    global board
+    # Imported here, since importing scrum_meeting opens a window, which the hub does not have
+    import scrum_meeting
+    scrum_meeting.USE_SLACK_BOT = False
+    scrum_meeting.window.title = name
+    board = Board(connection)
+    scrum_meeting.main(participants=participants, cheer_state=CheerState.replica(cheer_data, ledger_filename))
+    return
+
+
+# ursina calls these from the main module, which is this one in the board processes
+def update():
+    import scrum_meeting
+    board.update(scrum_meeting.objects['cheer_scoreboard'])
+    scrum_meeting.update()
+    return
+
+
+def input(key):
+    import scrum_meeting
+    if key == 'g':
+        # Only the hub changes the cheer data
+        board.connection.send(('give_everyone_points', 5))
+        return
+    scrum_meeting.input(key)
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run several scrum meeting boards from one Slack connection')
+    parser.add_argument('config', help='The boards, as JSON')
+    parser.add_argument('--cheer-data', default='cheer.json', help='Where cheer data is stored')
+    parser.add_argument('--cheer-journal', default='cheer.journal', help='Where changes to the cheer data are kept')
+    parser.add_argument('--cheer-ledger', default='cheer_ledger.sqlite', help='Where every transfer is recorded')
+    args = parser.parse_args()
+
+    boards = json.load(open(args.config, 'r'))['boards']
+    state = CheerState.open(args.cheer_data, args.cheer_journal, args.cheer_ledger)
+    hub = BoardHub(boards, state, args.cheer_ledger)
+    slack_bot.scoreboard_for = hub.board_for_message
+    # The directory is refreshed on the bot's thread, so add anyone new from the main loop
+    slack_bot.directory.add_listener(lambda d: main_thread_commands.put(hub.add_new_attendees, d))
+    slack_bot.init({})
+    hub.add_new_attendees(slack_bot.directory)
+    hub.start()
+    try:
+        while hub.running():
+            main_thread_commands.drain(HUB_BUDGET)
+            hub.poll(0 if len(main_thread_commands) else HUB_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    print('Bye')
+    hub.stop()
+    slack_bot.stop()
+    state.close()
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#
+# Make random images locally, without the network
+#
+
+import zlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List
+from PIL import Image
+
+# The kinds of pattern that can be laid over the gradient
+PATTERN_STRIPES = 0
+PATTERN_RINGS = 1
+PATTERN_CHECKERS = 2
+PATTERN_PLAIN = 3
+PATTERN_COUNT = 4
+
+
+def _smooth_noise(rng_values: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    Bilinearly scale coarse random grids up to full size
+    :param rng_values: An (N, rows, columns) array of random values
+    :param width: The width of the output, in pixels
+    :param height: The height of the output, in pixels
+    :return: An (N, height, width) array of values between 0 and 1
+    """
+    rows, columns = rng_values.shape[1:]
+    ys = np.linspace(0, rows - 1, height)
+    xs = np.linspace(0, columns - 1, width)
+    y0 = np.minimum(ys.astype(np.int64), rows - 2)
+    x0 = np.minimum(xs.astype(np.int64), columns - 2)
+    ty = (ys - y0)[None, :, None]
+    tx = (xs - x0)[None, None, :]
+    v00 = rng_values[:, y0][:, :, x0]
+    v01 = rng_values[:, y0][:, :, x0 + 1]
+    v10 = rng_values[:, y0 + 1][:, :, x0]
+    v11 = rng_values[:, y0 + 1][:, :, x0 + 1]
+    top = v00 + (v01 - v00) * tx
+    bottom = v10 + (v11 - v10) * tx
+    return top + (bottom - top) * ty
+
+
+def generate_images(width: int, height: int, seeds: List[int]) -> np.ndarray:
+    """
+    Generate a batch of images (a gradient, a pattern and some noise) all at once.
+    The same seed always gives the same image.
+    :param width: The width of the images, in pixels
+    :param height: The height of the images, in pixels
+    :param seeds: One seed per image
+    :return: An (N, height, width, 3) uint8 array
+    """
+    count = len(seeds)
+    noise_cells = 8
+    colors = np.empty((count, 2, 3), dtype=np.float32)
+    angles = np.empty((count, 2), dtype=np.float32)
+    frequencies = np.empty(count, dtype=np.float32)
+    patterns = np.empty(count, dtype=np.int64)
+    coarse_noise = np.empty((count, noise_cells, noise_cells), dtype=np.float32)
+    for i, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        colors[i] = rng.random((2, 3))
+        angles[i] = rng.random(2) * 2 * np.pi
+        frequencies[i] = rng.uniform(2, 12)
+        patterns[i] = rng.integers(PATTERN_COUNT)
+        coarse_noise[i] = rng.random((noise_cells, noise_cells))
+    ys, xs = np.meshgrid(np.linspace(-.5, .5, height, dtype=np.float32),
+                         np.linspace(-.5, .5, width, dtype=np.float32), indexing='ij')
+    xs = xs[None]
+    ys = ys[None]
+    # Gradient between the two colours, in a random direction
+    cos_a = np.cos(angles[:, 0])[:, None, None]
+    sin_a = np.sin(angles[:, 0])[:, None, None]
+    gradient = np.clip(xs * cos_a + ys * sin_a + .5, 0, 1)
+    # Each pattern is only worked out for the images that use it
+    pattern = np.ones((count, height, width), dtype=np.float32)
+    two_pi_f = (frequencies * 2 * np.pi)[:, None, None]
+    stripes = patterns == PATTERN_STRIPES
+    if stripes.any():
+        along = xs * np.cos(angles[stripes, 1])[:, None, None] + ys * np.sin(angles[stripes, 1])[:, None, None]
+        pattern[stripes] = .5 + .5 * np.sin(along * two_pi_f[stripes])
+    rings = patterns == PATTERN_RINGS
+    if rings.any():
+        pattern[rings] = .5 + .5 * np.sin(np.hypot(xs, ys) * two_pi_f[rings])
+    checkers = patterns == PATTERN_CHECKERS
+    if checkers.any():
+        frequency = frequencies[checkers][:, None, None]
+        pattern[checkers] = (np.floor(xs * frequency) + np.floor(ys * frequency)) % 2
+    noise = _smooth_noise(coarse_noise, width, height)
+    t = gradient[..., None]
+    images = colors[:, None, None, 0] * (1 - t) + colors[:, None, None, 1] * t
+    images *= (.6 + .4 * pattern)[..., None]
+    images += (noise[..., None] - .5) * .2
+    np.clip(images, 0, 1, out=images)
+    images *= 255
+    return images.astype(np.uint8)
+
+
+class ProceduralImageSource:
+    """
+    An image source for random_image that makes images locally instead of downloading them
+    """
+    suffix = '.jpg'
+
+    def __init__(self, seed: int = 0, workers: int = 4):
+        """
+        :param seed: Combined with each image's file name to seed it, so the images are always the same
+        :param workers: The most images to encode at once
+        """
+        self.seed = seed
+        self.workers = workers
+        return
+
+    def __call__(self, width: int, height: int, destinations: List[Path]) -> Iterator[Path]:
+        """
+        Generate images
+        :param width: The width of the images, in pixels
+        :param height: The height of the images, in pixels
+        :param destinations: Where to save the images
+        :return: Each image that was saved, as soon as it is saved
+        """
+        seeds = [[self.seed, width, height, zlib.crc32(d.stem.encode('utf-8'))] for d in destinations]
+        images = generate_images(width, height, seeds)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            yield from pool.map(save_image, images, destinations)
+        return
+
+
+def save_image(image: np.ndarray, destination: Path) -> Path:
+    """
+    Encode an image, writing it to a temporary file first so a half written image is never used
+    :param image: A (height, width, 3) uint8 array
+    :param destination: Where to save the image
+    :return: The destination
+    """
+    temp_path = destination.with_name(f'{destination.name}.tmp')
+    image_format = destination.suffix.lstrip('.').upper().replace('JPG', 'JPEG')
+    Image.fromarray(image).save(temp_path, format=image_format)
+    temp_path.replace(destination)
+    return destination
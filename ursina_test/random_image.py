@@ -2,13 +2,168 @@
 # Get a random image (downloading some if needed)
 #
 
-from pathlib import Path
+import http.client
+import json
+import os
+import shutil
+import threading
+import time
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 from random import sample
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List
+
+# Where random images come from. Point this somewhere else (e.g. a local HTTP server) for testing.
+IMAGE_URL = 'https://picsum.photos/{width}/{height}'
+# The file in each image directory listing the images that are there
+MANIFEST_NAME = 'manifest.json'
+# Suffix for downloads that have not finished yet
+PARTIAL_SUFFIX = '.part'
+
+# The images in each directory, so picking one never has to touch the filesystem
+_manifests: Dict[Path, List[Path]] = {}
+_manifests_lock = threading.Lock()
+# Held while images are downloaded into a directory, so two callers never pick the same names
+_download_locks: Dict[Path, threading.Lock] = {}
+
+
+def _read_manifest(full_path: Path) -> List[Path]:
+    """
+    Read the list of images in a directory from its manifest, or build the manifest if there isn't one
+    :param full_path: The directory containing the images
+    """
+    manifest_path = full_path.joinpath(MANIFEST_NAME)
+    if manifest_path.exists():
+        names = json.load(open(manifest_path, 'r'))
+        files = [full_path.joinpath(name) for name in names]
+        files = [f for f in files if f.exists()]
+    else:
+        files = [f for f in full_path.glob('*')
+                 if f.name != MANIFEST_NAME and not f.name.endswith(('.tmp', PARTIAL_SUFFIX))]
+    # Anything left over from an interrupted run gets downloaded again
+    for partial in full_path.glob(f'*{PARTIAL_SUFFIX}'):
+        partial.unlink()
+    _write_manifest(full_path, files)
+    return files
+
+
+def _write_manifest(full_path: Path, files: List[Path]):
+    """
+    Write the manifest for a directory, replacing the old one atomically
+    :param full_path: The directory containing the images
+    :param files: The images in the directory
+    """
+    manifest_path = full_path.joinpath(MANIFEST_NAME)
+    temp_path = full_path.joinpath(f'{MANIFEST_NAME}.tmp')
+    json.dump(sorted(f.name for f in files), open(temp_path, 'w+'), indent=2)
+    os.replace(temp_path, manifest_path)
+    return
+
+
+def manifest(full_path: Path) -> List[Path]:
+    """
+    Get the images in a directory, reading the manifest from disk only the first time
+    :param full_path: The directory containing the images
+    """
+    with _manifests_lock:
+        files = _manifests.get(full_path, None)
+        if files is None:
+            full_path.mkdir(parents=True, exist_ok=True)
+            files = _read_manifest(full_path)
+            _manifests[full_path] = files
+    return files
+
+
+def _download_lock(full_path: Path) -> threading.Lock:
+    """
+    Get the lock for downloading images into a directory
+    :param full_path: The directory containing the images
+    """
+    with _manifests_lock:
+        return _download_locks.setdefault(full_path, threading.Lock())
 
 
-def ensure_enough_random_images(width: int, height: int, count:int, path:Path) -> List[Path]:
+def download_image(url: str, destination: Path, retries: int = 3, timeout: float = 30) -> Path:
+    """
+    Download an image to a temporary file, then rename it into place so a half written image is never used
+    :param url: Where to download the image from
+    :param destination: Where to save the image
+    :param retries: How many times to try again if the download fails
+    :param timeout: How long to wait for the server, in seconds
+    :return: The destination
+    """
+    partial = destination.with_name(f'{destination.name}{PARTIAL_SUFFIX}')
+    for attempt in range(retries + 1):
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response, open(partial, 'wb') as f:
+                shutil.copyfileobj(response, f)
+                expected = response.headers.get('Content-Length', None)
+                # A connection that drops part way through just ends the image early
+                if expected is not None and f.tell() != int(expected):
+                    raise http.client.IncompleteRead(b'', int(expected) - f.tell())
+            os.replace(partial, destination)
+            return destination
+        except (OSError, http.client.HTTPException) as e:
+            if partial.exists():
+                partial.unlink()
+            if attempt == retries:
+                raise
+            print(f'Download of {url} failed ({e}), retrying')
+            time.sleep(.5 * 2 ** attempt)
+    return destination
+
+
+class PicsumSource:
+    """
+    Downloads random photos, several at a time
+    """
+    suffix = '.jpg'
+
+    def __init__(self, url: str = IMAGE_URL, workers: int = 8):
+        """
+        :param url: Where to download images from, formatted with the width and height
+        :param workers: The most images to download at once
+        """
+        self.url = url
+        self.workers = workers
+        return
+
+    def __call__(self, width: int, height: int, destinations: List[Path]) -> Iterator[Path]:
+        """
+        Download images
+        :param width: The width of the images, in pixels
+        :param height: The height of the images, in pixels
+        :param destinations: Where to save the images
+        :return: Each image that was saved, as soon as it is saved
+        """
+        image_url = self.url.format(width=width, height=height)
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(destinations))) as pool:
+            futures = [pool.submit(download_image, image_url, destination) for destination in destinations]
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except (OSError, http.client.HTTPException) as e:
+                    print(f'Giving up on a download: {e}')
+        return
+
+
+# Where new images come from (see set_image_source())
+image_source = PicsumSource()
+
+
+def set_image_source(source: Callable[[int, int, List[Path]], Iterable[Path]]):
+    """
+    Change where new random images come from
+    :param source: Called with the width, height and destinations of the images to make,
+                   yielding each image that was saved. Its "suffix" attribute is the file extension to use.
+    """
+    global image_source
+    image_source = source
+    return
+
+
+def ensure_enough_random_images(width: int, height: int, count: int, path: Path) -> List[Path]:
     """
     Make sure there are enough random images available
     :param width: The width of the image, in pixels
@@ -17,19 +172,42 @@ def ensure_enough_random_images(width: int, height: int, count:int, path:Path) -
     :param path: The path containing the images
     """
     full_path = path.joinpath('random', f'{width}', f'{height}')
-    if not full_path.exists():
-        full_path.mkdir(parents=True, exist_ok=True)
-    files = list(full_path.glob('*'))
-    existing = len(files)
-    to_get = count - existing
+    files = manifest(full_path)
+    if len(files) >= count:
+        return files
+    # Anyone else downloading into the same directory finishes first, then there may be nothing left to get
+    with _download_lock(full_path):
+        _download_random_images(width, height, count, full_path, files)
+    return files
+
+
+def _download_random_images(width: int, height: int, count: int, full_path: Path, files: List[Path]):
+    """
+    Download images until there are enough. Only call this with the directory's download lock held.
+    :param full_path: The directory containing the images
+    :param files: The directory's manifest, which the images are added to
+    """
+    to_get = count - len(files)
+    if to_get <= 0:
+        return
     print(f'Need to get {to_get} files')
-    if to_get > 0:
-        for i in range(to_get):
-            urllib.request.urlretrieve(f'https://picsum.photos/{width}/{height}',
-                                       str(full_path.joinpath(f'{existing + i}.jpg')))
-            remaining = to_get - i
-            print(f'Downloading ... {remaining=}')
-    return list(full_path.glob('*'))
+    source = image_source
+    used_names = set(f.stem for f in files)
+    destinations = []
+    i = 0
+    while len(destinations) < to_get:
+        if f'{i}' not in used_names:
+            destinations.append(full_path.joinpath(f'{i}{source.suffix}'))
+        i += 1
+    remaining = to_get
+    for saved in source(width, height, destinations):
+        remaining -= 1
+        # Record each image as soon as it arrives, so an interrupted run can pick up where it left off
+        with _manifests_lock:
+            files.append(saved)
+            _write_manifest(full_path, files)
+        print(f'Getting images ... {remaining=}')
+    return
 
 
 def random_image(width: int, height: int, path:Path, minimum_count: int=20) -> Path:
@@ -0,0 +1,368 @@
+#
+# Benchmark the scenes offscreen, with a software renderer and scripted load, so it runs on a CPU-only CI box.
+# Usage: python scene_benchmark.py --frames 300 --report scene_benchmark.json [--baseline old.json]
+#
+# Each scenario runs in a fresh process, since ursina only allows one app per process and the scenes keep their
+# state in module globals. The process makes an offscreen app before it imports the scene, so the scene's own
+# Ursina() gets that app back, then calls the scene's init() and steps frames itself instead of app.run().
+#
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from frame_profiler import percentile
+
+# Environment variables that make Mesa render on the CPU
+SOFTWARE_GL_ENVIRONMENT = {'LIBGL_ALWAYS_SOFTWARE': '1', 'GALLIUM_DRIVER': 'llvmpipe'}
+
+# The scene module in the benchmark process, which ursina's update() and input() are passed on to
+scene_module = None
+
+
+def rss() -> int:
+    """
+    Get how much memory this process is using, in bytes
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Only the peak is available, in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def benchmark_participants(count: int) -> List[Dict[str, Any]]:
+    """
+    Make up meeting participants that only need images the benchmark can make itself
+    :param count: How many
+    """
+    return [{'name': f'Participant {i}', 'image': 'random'} for i in range(count)]
+
+
+def setup_scrum_meeting(params: Dict[str, Any], data_folder: Path) -> Callable[[int], None]:
+    """
+    The scrum meeting, with a scoreboard but no Slack bot.
+    Load: `cheers` cheers kept alive, `gives` transfers per frame, and `switches` participant switches
+    spread over the run.
+    """
+    global scene_module
+    import cheers
+    import scrum_meeting
+    from cheers import CheerScoreboard
+    scene_module = scrum_meeting
+    cheers.cheer_data_filename = str(data_folder / 'cheer.json')
+    cheers.cheer_journal_filename = str(data_folder / 'cheer.journal')
+    cheers.cheer_ledger_filename = str(data_folder / 'cheer_ledger.sqlite')
+    scrum_meeting.USE_SLACK_BOT = False
+    # Downloaded images would make the run depend on the network
+    scrum_meeting.USE_PROCEDURAL_IMAGES = True
+    participants = benchmark_participants(params['participants'])
+    scrum_meeting.init(participants=participants)
+    attendees = {p['name']: f'participant{i}' for i, p in enumerate(participants)}
+    scoreboard = CheerScoreboard(attendees=attendees)
+    scoreboard.give_everyone_points(10 ** 9)
+    scrum_meeting.objects['cheer_scoreboard'] = scoreboard
+    usernames = list(attendees.values())
+    texture = 'textures/cheers/star'
+    switch_every = max(1, params['frames'] // params['switches']) if params['switches'] else 0
+
+    def load(frame: int):
+        if params['cheers']:
+            particles = cheers.cheers.get(texture, None)
+            alive = particles.particle_count if particles else 0
+            if alive < params['cheers']:
+                scoreboard.add_cheers(params['cheers'] - alive, texture)
+        with scoreboard.batch():
+            for i in range(params['gives']):
+                name_from, name_to = random.sample(usernames, 2)
+                scoreboard.transfer_many(name_from, [(name_to, 1)], texture='star')
+        if switch_every and frame % switch_every == 0:
+            scrum_meeting.objects['scrum_list'].select_participant('next')
+        return
+    return load
+
+
+def setup_cube_spinner(params: Dict[str, Any], data_folder: Path) -> Callable[[int], None]:
+    """
+    The cube spinner, with a `grid` x `grid` wall of spinning voxels
+    """
+    global scene_module
+    import cube_spinner
+    from ursina import Vec3, camera
+    scene_module = cube_spinner
+    cube_spinner.init()
+    size = params['grid']
+    for x in range(size):
+        for y in range(size):
+            voxel = cube_spinner.Voxel(position=(x - size / 2, y - size / 2, 0))
+            voxel.rotation_speed = Vec3(random.random() - .5, random.random() - .5, random.random() - .5) * 1000
+    camera.z = -2 * size - 10
+
+    def load(frame: int):
+        return
+    return load
+
+
+def setup_minecraft_clone(params: Dict[str, Any], data_folder: Path) -> Callable[[int], None]:
+    """
+    The minecraft clone, walking `walk_speed` blocks per second in a straight line (at 60 frames per second,
+    whatever the real frame rate) and making `edits` block edits per frame around the player
+    """
+    global scene_module
+    import minecraft_clone_example
+    from ursina import Entity, Vec3
+    from procedural_image import ProceduralImageSource
+    from random_image import set_image_source
+    from voxel_world import AIR
+    scene_module = minecraft_clone_example
+    # Downloaded images would make the run depend on the network
+    set_image_source(ProceduralImageSource())
+    minecraft_clone_example.world_filename = str(data_folder / 'world.vox')
+    # A first person controller locks the mouse, which an offscreen buffer cannot do
+    minecraft_clone_example.init(walker=Entity())
+
+    def load(frame: int):
+        player = minecraft_clone_example.player
+        player.position += Vec3(params['walk_speed'] / 60, 0, 0)
+        for i in range(params['edits']):
+            position = player.position + Vec3(random.randint(-4, 4), random.randint(-3, 0), random.randint(-4, 4))
+            block = minecraft_clone_example.RANDOM_BLOCKS_START if i % 2 else AIR
+            minecraft_clone_example.world.set_block(position, block)
+        return
+    return load
+
+
+# Each scenario: (setup function, default parameters)
+SCENARIOS = {
+    'scrum_idle': (setup_scrum_meeting, {'participants': 8, 'cheers': 0, 'gives': 0, 'switches': 0}),
+    'scrum_cheers': (setup_scrum_meeting, {'participants': 8, 'cheers': 2000, 'gives': 0, 'switches': 0}),
+    'scrum_gives': (setup_scrum_meeting, {'participants': 40, 'cheers': 0, 'gives': 4, 'switches': 0}),
+    'scrum_switches': (setup_scrum_meeting, {'participants': 40, 'cheers': 0, 'gives': 0, 'switches': 100}),
+    'cube_grid': (setup_cube_spinner, {'grid': 30}),
+    'minecraft_walk': (setup_minecraft_clone, {'walk_speed': 20, 'edits': 2}),
+}
+
+
+def entity_count() -> int:
+    from ursina import scene
+    return len(scene.entities)
+
+
+def run_scenario(name: str, params: Dict[str, Any], frames: int, warmup: int, renderer: str, phases: bool,
+                 connection):
+    """
+    Run one scenario and send back its results. This is the benchmark process.
+    """
+    from panda3d.core import loadPrcFileData
+    if renderer == 'tinydisplay':
+        # panda3d's own software renderer, which does not run shaders
+        loadPrcFileData('', 'load-display p3tinydisplay')
+    loadPrcFileData('', 'audio-library-name null')
+    from ursina import Ursina, application
+    from frame_profiler import profiler
+    from startup import startup
+    random.seed(params.get('seed', 0))
+    import numpy as np
+    np.random.seed(params.get('seed', 0))
+
+    started = time.perf_counter()
+    rss_start = rss()
+    app = Ursina(window_type='offscreen', development_mode=False)
+    data_folder = Path(tempfile.mkdtemp(prefix=f'scene_benchmark_{name}_'))
+    setup, _ = SCENARIOS[name]
+    load = setup(dict(params, frames=frames), data_folder)
+    # Scenes that load in the background are measured once everything has been loaded
+    while not startup.done:
+        app.step()
+    setup_time = time.perf_counter() - started
+    rss_setup = rss()
+
+    for frame in range(warmup):
+        load(frame)
+        app.step()
+    if phases:
+        profiler.enable(overlay=False)
+    frame_times = []
+    entity_counts = []
+    for frame in range(frames):
+        start = time.perf_counter()
+        load(warmup + frame)
+        app.step()
+        frame_times.append(time.perf_counter() - start)
+        entity_counts.append(entity_count())
+    result = {
+        'scenario': name,
+        'scene': scene_module.__name__,
+        'params': params,
+        'setup_time': setup_time,
+        'frame_time': {
+            'mean': sum(frame_times) / len(frame_times),
+            'p50': percentile(frame_times, .5),
+            'p95': percentile(frame_times, .95),
+            'p99': percentile(frame_times, .99),
+            'max': max(frame_times),
+        },
+        'fps': len(frame_times) / sum(frame_times),
+        'memory': {'start': rss_start, 'after_setup': rss_setup, 'end': rss(), 'peak': peak_rss()},
+        'entities': {'start': entity_counts[0], 'end': entity_counts[-1], 'max': max(entity_counts)},
+        'startup': startup.timings(),
+    }
+    if phases:
+        result['profile'] = profiler.summary()
+        profiler.disable()
+    connection.send(result)
+    # Threads in the scenes (the journal writer, the chunk streamer) are daemons, so they do not hold this up
+    application.quit()
+    return
+
+
+def run_in_process(name: str, params: Dict[str, Any], frames: int, warmup: int, renderer: str,
+                   phases: bool, timeout: float) -> Dict[str, Any]:
+    """
+    Run one scenario in a fresh process
+    :return: Its results, or the error it failed with
+    """
+    context = multiprocessing.get_context('spawn')
+    parent_end, child_end = context.Pipe(duplex=False)
+    process = context.Process(target=run_scenario, name=name,
+                              args=(name, params, frames, warmup, renderer, phases, child_end))
+    process.start()
+    child_end.close()
+    result = None
+    if parent_end.poll(timeout):
+        try:
+            result = parent_end.recv()
+        except EOFError:
+            pass
+    process.join(timeout=10)
+    if process.is_alive():
+        process.kill()
+    if result is None:
+        result = {'scenario': name, 'params': params, 'error': f'exited with {process.exitcode}'}
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """
+    Compare a report's frame times with an older one
+    :param max_regression: How much slower (as a fraction) p50 or p99 can get before it counts as a regression
+    :return: The regressions
+    """
+    old_results = {r['scenario']: r for r in baseline['results'] if 'error' not in r}
+    regressions = []
+    for result in report['results']:
+        old = old_results.get(result['scenario'], None)
+        if old is None or 'error' in result:
+            continue
+        for stat in ('p50', 'p99'):
+            new_time = result['frame_time'][stat]
+            old_time = old['frame_time'][stat]
+            change = new_time / old_time - 1
+            print(f'{result["scenario"]:>16} {stat}: {old_time * 1000:7.2f} -> {new_time * 1000:7.2f} ms '
+                  f'({change:+.0%})')
+            if change > max_regression:
+                regressions.append(f'{result["scenario"]} {stat} {change:+.0%}')
+    return regressions
+
+
+def parse_param(text: str):
+    name, _, value = text.partition('=')
+    return name, json.loads(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the scenes offscreen, with scripted load')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Which scenarios to run, in order')
+    parser.add_argument('--frames', type=int, default=300, help='How many frames to measure')
+    parser.add_argument('--warmup', type=int, default=30,
+                        help='How many frames to run first, so shaders and textures are loaded')
+    parser.add_argument('--param', action='append', type=parse_param, default=[],
+                        help='Change a load parameter for every scenario that has it, e.g. --param cheers=5000')
+    parser.add_argument('--renderer', choices=['llvmpipe', 'tinydisplay', 'default'], default='llvmpipe',
+                        help="llvmpipe is Mesa's software OpenGL, tinydisplay is panda3d's software renderer "
+                             "(no shaders), and default is whatever OpenGL the machine has")
+    parser.add_argument('--phases', action='store_true', help='Break frame times down with the frame profiler')
+    parser.add_argument('--timeout', type=float, default=600, help='The longest a scenario can take, in seconds')
+    parser.add_argument('--report', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='Compare with an earlier report')
+    parser.add_argument('--max-regression', type=float, default=.2,
+                        help='How much slower a scenario can get than the baseline before this fails')
+    args = parser.parse_args()
+
+    if args.renderer == 'llvmpipe':
+        # The benchmark processes inherit these
+        os.environ.update(SOFTWARE_GL_ENVIRONMENT)
+    overrides = dict(args.param)
+    results = []
+    for name in args.scenarios.split(','):
+        _, defaults = SCENARIOS[name]
+        params = {key: overrides.get(key, value) for key, value in defaults.items()}
+        result = run_in_process(name, params, args.frames, args.warmup, args.renderer, args.phases, args.timeout)
+        results.append(result)
+        if 'error' in result:
+            print(f'{name}: {result["error"]}')
+            continue
+        frame_time = result['frame_time']
+        print(f'{name:>16}: p50 {frame_time["p50"] * 1000:6.2f} ms p99 {frame_time["p99"] * 1000:6.2f} ms, '
+              f'{result["entities"]["max"]} entities, {result["memory"]["peak"] / 2 ** 20:.0f} MB peak, '
+              f'setup {result["setup_time"]:.1f} s')
+
+    report = {
+        'commit': git_commit(),
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'renderer': args.renderer,
+        'frames': args.frames,
+        'warmup': args.warmup,
+        'results': results,
+    }
+    if args.report:
+        json.dump(report, open(args.report, 'w'), indent=2)
+    failed = any('error' in result for result in results)
+    if args.baseline:
+        regressions = compare(report, json.load(open(args.baseline, 'r')), args.max_regression)
+        if regressions:
+            print(f'Slower than {args.baseline}: {", ".join(regressions)}')
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+# ursina calls these from the main module, which is this one in the benchmark processes
+def update():
+    if scene_module is not None and hasattr(scene_module, 'update'):
+        scene_module.update()
+    return
+
+
+def input(key):
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,33 @@
+# First, so the startup timings start as early as they can
+from startup import startup
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from typing import List
+from typing import Any, Dict, List, Optional
 
 from ursina import *
-from random_image import random_image
-from cheers import CheerScoreboard, cheers_textures
+from random_image import random_image, set_image_source, ensure_enough_random_images
+from texture_cache import texture_cache, TextureAtlas
+from video_texture import video_textures, is_video
+import cheers
+from cheers import CheerScoreboard
+from cheer_state import CheerState
+from cell_text import CellText
+from command_queue import main_thread_commands
+from frame_profiler import profiler
+from kinematics import kinematics
+from model_cache import model_cache
 
 USE_SLACK_BOT = True
+# Make random images locally instead of downloading them
+USE_PROCEDURAL_IMAGES = False
 slack_thread = None
+# The most time to spend each frame on commands from the Slack bot, in seconds
+COMMAND_BUDGET = .004
+# Profile from the start. F3 switches the profiler on and off, and F4 exports what it has.
+PROFILE = False
+# Where the profiler exports to: Chrome trace format for .json, one frame per line for .jsonl
+PROFILE_FILENAME = 'frame_profile.json'
 
 app = Ursina()
 
@@ -23,6 +43,33 @@ def set_if_not_exists(d, key, value):
     return
 
 
+def random_image_atlas() -> TextureAtlas:
+    """
+    Get the atlas of all of the random images
+    """
+    images = ensure_enough_random_images(width=200, height=200, count=30, path=Path(application.textures_folder))
+    return texture_cache.atlas(images, tile_size=(200, 200))
+
+
+def prewarm_participant(participant: Dict[str, Any]):
+    """
+    Load everything a participant needs, so showing them later does not have to wait on the disk.
+    Safe to call from a worker thread.
+    :param participant: One of ScrumList.ALL_PARTICIPANTS
+    """
+    image = participant.get('image', 'random')
+    if image == 'random':
+        random_image_atlas()
+    elif is_video(image):
+        video_textures.clip(image)
+    else:
+        texture_cache.texture(image)
+    model = participant.get('model', None)
+    if model and model_cache.load(model) is None:
+        load_model(model)
+    return
+
+
 class ScrumParticipant(Button):
     def __init__(self, name: str, image: str='random', **kwargs):
         self.participant_name = name
@@ -32,22 +79,36 @@ class ScrumParticipant(Button):
         set_if_not_exists(kwargs, 'origin', Vec3(0, 0, 0))
         set_if_not_exists(kwargs, 'texture', None)
         set_if_not_exists(kwargs, 'color', color.color(0, 0, random.uniform(.9, 1.0)))
+        if isinstance(kwargs['model'], str):
+            # Models from models/ are converted once and shared, anything else (like 'cube') is left to ursina
+            kwargs['model'] = model_cache.model(kwargs['model']) or kwargs['model']
+        # Random images come from a shared atlas, so only the part of it to show differs between participants
+        self._atlas_image = None
         kwargs['texture'] = self.which_texture(kwargs['texture'])
         super().__init__(parent=scene, **kwargs)
+        if self._atlas_image:
+            self.texture_scale, self.texture_offset = random_image_atlas().texture_scale_and_offset(self._atlas_image)
+        if is_video(self.participant_image):
+            video_textures.attach(self.participant_image, self)
         # Maximum rotation speed in degrees per second?
         self.max_rotation_speed = 100
         self._rotation_speed = Vec3(0, 0, 0)
         self.rotate_randomly()
         return
 
+    @profiler.timed('ScrumParticipant.which_texture')
     def which_texture(self, possible_texture):
         if possible_texture is not None:
             texture = possible_texture
         elif self.participant_image == 'random':
-            texture = Texture(
-                random_image(width=200, height=200, path=Path(application.textures_folder), minimum_count=30))
+            self._atlas_image = random_image(width=200, height=200, path=Path(application.textures_folder),
+                                             minimum_count=30)
+            texture = random_image_atlas().texture
+        elif is_video(self.participant_image):
+            # Shared with anyone else using the same clip, and only decoded while visible
+            texture = video_textures.clip(self.participant_image).texture
         else:
-            texture = Texture(self.participant_image)
+            texture = texture_cache.texture(self.participant_image)
         return texture
 
     @property
@@ -57,6 +118,7 @@ class ScrumParticipant(Button):
     @rotation_speed.setter
     def rotation_speed(self, rotation_speed: Vec3):
         self._rotation_speed = rotation_speed
+        kinematics.set_velocity(self, angular=rotation_speed)
         return
 
     def rotating(self):
@@ -82,14 +144,13 @@ class ScrumParticipant(Button):
                 scrum_list.select_participant('previous')
         return
 
-    def update(self):
-        self.rotation_x += time.dt * self._rotation_speed.x
-        self.rotation_y += time.dt * self._rotation_speed.y
-        self.rotation_z += time.dt * self._rotation_speed.z
+    def on_destroy(self):
+        video_textures.detach(self)
+        kinematics.remove(self)
         return
 
 
-class ScrumList(Text):
+class ScrumList(CellText):
     ALL_PARTICIPANTS = [
         # {'name': 'Mark Carlson', 'model': 'untitled', 'image': 'textures/untitled.png'},
         # {'name': 'Mark Carlson', 'image': 'textures/mark.jpg'},
@@ -108,10 +169,16 @@ class ScrumList(Text):
         {'name': 'Jannalie Taylor', 'image': 'textures/jannalie.jpg'},
     ]
 
-    def __init__(self):
+    def __init__(self, participants: Optional[List[Dict[str, Any]]] = None):
+        """
+        :param participants: Everyone in the meeting, like ALL_PARTICIPANTS (which is the default)
+        """
+        self.all_participants = participants or self.ALL_PARTICIPANTS
         self.current_participant = 0
-        self.shuffled_participants = deepcopy(self.ALL_PARTICIPANTS)
-        self.preload_models()
+        self.shuffled_participants = deepcopy(self.all_participants)
+        # Participants that have been shown, kept so they can be shown again without loading anything
+        self._participant_entities: Dict[int, ScrumParticipant] = {}
+        self._prewarm_pool = ThreadPoolExecutor(max_workers=1)
         random.shuffle(self.shuffled_participants)
         super().__init__(text='',
                          name='scrum_list',
@@ -122,26 +189,29 @@ class ScrumList(Text):
                          # origin=(0, 0),
                          # scale = (.05, .025),
                          color=color.green.tint(-.2),
-                         font='VeraMono.ttf'
+                         font='VeraMono.ttf',
+                         columns=24,
+                         rows=len(self.all_participants)
                          )
         self.set_text_for_current_participant()
         return
 
     def attendee_names(self) -> List[str]:
         return list(set(
-            [p['name'] for p in self.ALL_PARTICIPANTS]
+            [p['name'] for p in self.all_participants]
         ))
 
     def preload_models(self):
         """
-        Create .ursinamesh files for all of the models so they load faster next time.
+        Convert all of the models that have not been converted yet (all at once), and load them.
+        Safe to call from a worker thread.
         """
-        for d in self.ALL_PARTICIPANTS:
-            model = d.get('model', None)
-            if model:
-                print(f'loading model: {model}')
+        models = set(d['model'] for d in self.all_participants if d.get('model', None))
+        model_cache.build(models)
+        for model in models:
+            print(f'loading model: {model}')
+            if model_cache.load(model) is None:
                 load_model(model)
-
         return
 
     def select_participant(self, which='next'):
@@ -151,7 +221,7 @@ class ScrumList(Text):
             self.current_participant -= 1
         else:
             self.current_participant = which
-        total = len(self.ALL_PARTICIPANTS)
+        total = len(self.all_participants)
         if self.current_participant < 0:
             self.current_participant = total - 1
         elif self.current_participant >= total:
@@ -169,16 +239,36 @@ class ScrumList(Text):
             text += f'{participant["name"]}\n'
             i += 1
         self.text = text
-        self.create_background()
         return
 
     def show_selected_participant(self):
         current_participant_entity = objects.get('participant', None)
         if current_participant_entity:
-            destroy(current_participant_entity)
-        current_participant = self.shuffled_participants[self.current_participant]
-        kwargs = deepcopy(current_participant)
-        objects['participant'] = ScrumParticipant(**kwargs)
+            # Hidden participants do not need to spin, and get a new speed when they are shown again
+            current_participant_entity.rotation_speed = Vec3(0, 0, 0)
+            current_participant_entity.enabled = False
+        participant_entity = self._participant_entities.get(self.current_participant, None)
+        if participant_entity:
+            participant_entity.enabled = True
+            participant_entity.rotate_randomly()
+        else:
+            current_participant = self.shuffled_participants[self.current_participant]
+            kwargs = deepcopy(current_participant)
+            participant_entity = ScrumParticipant(**kwargs)
+            self._participant_entities[self.current_participant] = participant_entity
+        objects['participant'] = participant_entity
+        self.prewarm_neighbours()
+        return
+
+    def prewarm_neighbours(self):
+        """
+        Load the next and previous participants' textures and models in the background
+        """
+        total = len(self.shuffled_participants)
+        for offset in (1, -1):
+            index = (self.current_participant + offset) % total
+            if index not in self._participant_entities:
+                self._prewarm_pool.submit(prewarm_participant, self.shuffled_participants[index])
         return
 
 
@@ -189,7 +279,7 @@ def set_debug_text(text: str):
     text_box = objects.get('debug_console', None)
     if DEBUG:
         if not text_box:
-            text_box = Text(
+            text_box = CellText(
                 name='debug_console',
                 position=window.top_left,
                 z=-999,
@@ -200,76 +290,159 @@ def set_debug_text(text: str):
                 color=color.red.tint(-.2),
                 text=text)
             objects['debug_console'] = text_box
+        # Only the characters that changed are rewritten
         text_box.text = text
-        text_box.create_background()
     return
 
 
-def init():
+def init(participants: Optional[List[Dict[str, Any]]] = None, cheer_state=None):
+    """
+    Show the window straight away. Everything that has to be loaded first is loaded in the background, and shown
+    once it is ready (see startup).
+    :param participants: Everyone in the meeting, or None for ScrumList.ALL_PARTICIPANTS
+    :param cheer_state: A replica CheerState to show, for a board in multi-board mode, where the board's hub
+                        runs the Slack bot and owns the cheer data
+    """
     global slack_thread
+    if PROFILE:
+        profiler.enable()
+    if USE_PROCEDURAL_IMAGES:
+        from procedural_image import ProceduralImageSource
+        set_image_source(ProceduralImageSource())
     # Create a single cube
     Text.default_resolution = 1080 * Text.size
     window.exit_button.visible = False
-    scrum_list = ScrumList()
+    scrum_list = ScrumList(participants)
     objects['scrum_list'] = scrum_list
-    scrum_list.show_selected_participant()
-    if USE_SLACK_BOT:
+    startup.add('first participant', load=lambda: prewarm_participant(scrum_list.shuffled_participants[0]),
+                attach=lambda _: show_first_participant())
+    startup.add('models', load=scrum_list.preload_models)
+    if cheer_state is not None:
+        # The hub adds everyone to the cheer data, which has every board's participants in it
+        objects['cheer_scoreboard'] = CheerScoreboard(attendees={}, state=cheer_state,
+                                                      participant_names=scrum_list.attendee_names())
+    elif USE_SLACK_BOT:
         from slack_bot import init as slack_bot_init
-        from slack_bot import user_info
-        slack_bot_init(objects, textures=cheers_textures)
-        info = user_info()
-        names = scrum_list.attendee_names()
-        attendees = {}
-        for name in names:
-            for username in info.keys():
-                if name == info[username]:
-                    attendees[info[username]] = username
-        cheer_scoreboard = CheerScoreboard(attendees=attendees)
-        objects['cheer_scoreboard'] = cheer_scoreboard
+        from slack_bot import directory
+        # The directory is refreshed on the bot's thread, so add anyone new from the main loop
+        directory.add_listener(lambda d: main_thread_commands.put(add_new_attendees, d))
+        startup.add('user directory', load=directory.load)
+        startup.add('cheer state', load=lambda: CheerState.open(
+            cheers.cheer_data_filename, cheers.cheer_journal_filename, cheers.cheer_ledger_filename))
+        # Started once the directory is loaded, so a refresh is not overwritten by the older copy on disk
+        startup.add('slack bot', attach=lambda _: slack_bot_init(objects, load_directory=False),
+                    after=['user directory'])
+        startup.add('scoreboard', attach=lambda _: show_scoreboard(directory),
+                    after=['user directory', 'cheer state'])
+    return
+
+
+def show_first_participant():
+    """
+    Show the first participant, unless someone has been shown already
+    """
+    if 'participant' not in objects:
+        objects['scrum_list'].show_selected_participant()
+    return
+
+
+def show_scoreboard(directory):
+    """
+    Show the scoreboard, once the user directory and the cheer state are loaded
+    :param directory: The slack_bot UserDirectory
+    """
+    attendees = directory.find_attendees(objects['scrum_list'].attendee_names())
+    objects['cheer_scoreboard'] = CheerScoreboard(attendees=attendees, state=startup.result('cheer state'))
+    return
+
+
+def add_new_attendees(directory):
+    """
+    Add participants to the scoreboard once they show up in the user directory
+    :param directory: The slack_bot UserDirectory
+    """
+    cheer_scoreboard = objects.get('cheer_scoreboard', None)
+    if cheer_scoreboard is None:
+        # The scoreboard finds everyone in the directory when it is shown
+        return
+    for name, username in directory.find_attendees(objects['scrum_list'].attendee_names()).items():
+        cheer_scoreboard.add_attendee(username, name)
+    cheer_scoreboard.update_cheer_text()
     return
 
 
 def input(key):
     print(f'{key=}')
+    # Either of these could still be loading
+    participant = objects.get('participant', None)
+    cheer_scoreboard = objects.get('cheer_scoreboard', None)
     if key == 'escape':
         print('Bye')
+        startup.close()
         if USE_SLACK_BOT:
             from slack_bot import stop
             stop()
+            if cheer_scoreboard:
+                cheer_scoreboard.close()
+        if profiler.frames:
+            profiler.export(PROFILE_FILENAME)
         application.quit()
     elif key == 'scroll up':
         camera.z += 2
     elif key == 'scroll down':
         camera.z -= 2
     elif key == 'space':
-        camera.look_at(objects['participant'].origin)
-        objects['participant'].rotate_randomly()
+        if participant:
+            camera.look_at(participant.origin)
+            participant.rotate_randomly()
+    elif key == 'f3':
+        profiler.toggle()
+    elif key == 'f4':
+        profiler.export(PROFILE_FILENAME)
+        print(f'Exported the profile to {PROFILE_FILENAME}')
+    elif not cheer_scoreboard:
+        pass
     elif key == 'g':
-        objects['cheer_scoreboard'].give_everyone_points(5)
-    elif key == 't':
-        # deleteme
-        objects['cheer_scoreboard'].transfer_points('Mark', 'Scott', 5)
+        cheer_scoreboard.give_everyone_points(5)
     elif key == '1':
-        objects['cheer_scoreboard'].set_sort_key("cheer_available")
+        cheer_scoreboard.set_sort_key("cheer_available")
     elif key == '2':
-        objects['cheer_scoreboard'].set_sort_key("cheer_given")
+        cheer_scoreboard.set_sort_key("cheer_given")
+    elif key == '3':
+        cheer_scoreboard.set_sort_key("given_this_week")
+    elif key == '4':
+        cheer_scoreboard.set_sort_key("received_this_week")
+    elif key == '5':
+        cheer_scoreboard.set_sort_key("given_today")
     elif key == 'c':
-        objects['cheer_scoreboard'].add_cheers(10, 'textures/cheers/star')
+        cheer_scoreboard.add_cheers(10, 'textures/cheers/star')
     return
 
 
 def update():
+    startup.update()
+    with profiler.section('video textures'):
+        video_textures.update(time.dt)
+    kinematics.update(time.dt)
+    cheer_scoreboard = objects.get('cheer_scoreboard', None)
+    if cheer_scoreboard and len(main_thread_commands):
+        with profiler.section('slack commands'), cheer_scoreboard.batch():
+            main_thread_commands.drain(COMMAND_BUDGET)
     text = f'Camera position: {camera.position}'
     text += f'\nCamera rotation: {camera.rotation}'
     set_debug_text(text)
     return
 
 
-def main():
+def main(participants: Optional[List[Dict[str, Any]]] = None, cheer_state=None):
+    """
+    :param participants: Everyone in the meeting, or None for ScrumList.ALL_PARTICIPANTS
+    :param cheer_state: A replica CheerState to show, for a board in multi-board mode
+    """
     global player
     window.size = (1024, 768)
     window.borderless = False
-    init()
+    init(participants=participants, cheer_state=cheer_state)
     # player = FirstPersonController(
     #     position=Vec3(0, -1, 7),
     #     rotation=Vec3(0, -180, 0)
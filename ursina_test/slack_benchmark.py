@@ -0,0 +1,232 @@
+#
+# End-to-end benchmark of the Slack bot and cheer scoreboard against fake_slack, so it runs offline.
+# Usage: python slack_benchmark.py --rates 25,50,100,200,400 --duration 5 --report slack_benchmark.json
+#
+
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, List
+
+from ursina import *
+import cheers
+import slack_bot
+from cheers import CheerScoreboard
+from command_queue import main_thread_commands
+from fake_slack import BOT_USER_ID, FakeSlack, fake_members
+from frame_profiler import percentile
+
+
+class BenchmarkScoreboard(CheerScoreboard):
+    """
+    A CheerScoreboard that notes when each give was applied and when it was written to disk.
+    Each give is tagged through its texture name, which passes through the bot unchanged.
+    """
+    def __init__(self, *args, **kwargs):
+        self.applied: Dict[str, float] = {}
+        self.persisted: Dict[str, float] = {}
+        self.applied_this_frame: List[str] = []
+        # (journal record number, tag) waiting to be written
+        self._unwritten = deque()
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+        self.state.journal.on_write = self._written
+        return
+
+    def transfer_many(self, name_from, transfers, texture):
+        super().transfer_many(name_from, transfers, texture)
+        self.applied_this_frame.append(texture)
+        with self._lock:
+            self._unwritten.append((self.state.journal.recorded, texture))
+        return
+
+    def _written(self, written: int):
+        now = time.perf_counter()
+        with self._lock:
+            while self._unwritten and self._unwritten[0][0] <= written:
+                self.persisted[self._unwritten.popleft()[1]] = now
+        return
+
+
+def run_frame(app, scoreboard: BenchmarkScoreboard, budget: float):
+    """
+    One frame of the main loop, as in scrum_meeting.update
+    """
+    with scoreboard.batch():
+        main_thread_commands.drain(budget)
+    app.step()
+    # The scoreboard is on screen once the frame is drawn
+    now = time.perf_counter()
+    for tag in scoreboard.applied_this_frame:
+        scoreboard.applied[tag] = now
+    scoreboard.applied_this_frame.clear()
+    return
+
+
+def check_direct_messages(app, fake: FakeSlack, scoreboard: BenchmarkScoreboard, members, wait: float = 2):
+    """
+    Check that the bot answers "help" in a direct message once, and ignores small talk and its own replies,
+    which fake_slack echoes back as Slack does
+    :param wait: How long to give a reply loop to show itself, in seconds
+    """
+    fake.echo_bot_messages = True
+    first_reply = len(fake.replies)
+    channel = 'D00000'
+    fake.send_message('hello, how are you?', user=members[0]['id'], channel=channel)
+    fake.send_message('help', user=members[0]['id'], channel=channel)
+    deadline = time.perf_counter() + wait
+    while time.perf_counter() < deadline:
+        run_frame(app, scoreboard, budget=.004)
+    fake.echo_bot_messages = False
+    replies = len(fake.replies) - first_reply
+    if replies != 1:
+        raise RuntimeError(f'Expected one reply to the direct messages, got {replies}')
+    print('Direct messages: answered help once, ignored small talk and the bot\'s own replies')
+    return
+
+
+def run_rate(app, fake: FakeSlack, scoreboard: BenchmarkScoreboard, members, rate: float, duration: float,
+             help_ratio: float, budget: float, grace: float) -> Dict[str, float]:
+    """
+    Send messages at a steady rate and measure how long each takes to show up and be saved
+    :param rate: Messages per second
+    :param duration: How long to send for, in seconds
+    :param help_ratio: The fraction of messages that are help rather than give
+    :param grace: How long to wait for the backlog after sending stops, in seconds
+    """
+    count = max(1, int(rate * duration))
+    sent: Dict[str, float] = {}
+    help_sent: Dict[str, float] = {}
+    first_reply = len(fake.replies)
+    give_tags = []
+
+    def send():
+        start = time.perf_counter()
+        for i in range(count):
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sender = random.choice(members)['id']
+            if random.random() < help_ratio:
+                ts = fake.send_message(f'<@{BOT_USER_ID}> help', user=sender)
+                help_sent[ts] = time.perf_counter()
+            else:
+                tag = f'bench{rate:g}_{i}'
+                receivers = ' '.join(f'<@{m["id"]}>' for m in random.sample(members, random.randint(1, 3)))
+                give_tags.append(tag)
+                sent[tag] = time.perf_counter()
+                fake.send_message(f'<@{BOT_USER_ID}> give {receivers} 1 {tag}', user=sender)
+        return
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    deadline = time.perf_counter() + duration + grace
+    frames = 0
+    while time.perf_counter() < deadline:
+        run_frame(app, scoreboard, budget)
+        frames += 1
+        if not sender.is_alive() and all(tag in scoreboard.persisted for tag in give_tags) \
+                and len(fake.replies) - first_reply >= len(help_sent):
+            break
+    sender.join()
+    applied = [scoreboard.applied[tag] - sent[tag] for tag in give_tags if tag in scoreboard.applied]
+    persisted = [scoreboard.persisted[tag] - sent[tag] for tag in give_tags if tag in scoreboard.persisted]
+    helped = [arrived - help_sent[reply['thread_ts']] for arrived, reply in fake.replies[first_reply:]
+              if reply.get('thread_ts') in help_sent]
+    handled = [scoreboard.applied[tag] for tag in give_tags if tag in scoreboard.applied]
+    elapsed = max(handled) - min(sent.values()) if handled and sent else float('nan')
+    return {
+        'rate': rate,
+        'gives_sent': len(give_tags),
+        'gives_applied': len(applied),
+        'gives_persisted': len(persisted),
+        'helps_sent': len(help_sent),
+        'helps_answered': len(helped),
+        'applied_p50': percentile(applied, .5),
+        'applied_p99': percentile(applied, .99),
+        'persisted_p50': percentile(persisted, .5),
+        'persisted_p99': percentile(persisted, .99),
+        'help_p50': percentile(helped, .5),
+        'help_p99': percentile(helped, .99),
+        'achieved_rate': len(handled) / elapsed if elapsed == elapsed and elapsed > 0 else float('nan'),
+        'frames': frames,
+        'dropped_commands': main_thread_commands.dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Slack bot and cheer scoreboard offline')
+    parser.add_argument('--rates', default='25,50,100,200,400', help='Messages per second to try, in order')
+    parser.add_argument('--duration', type=float, default=5, help='How long to run each rate, in seconds')
+    parser.add_argument('--users', type=int, default=200, help='How many members the fake workspace has')
+    parser.add_argument('--help-ratio', type=float, default=.1, help='The fraction of messages that are help')
+    parser.add_argument('--budget', type=float, default=.004, help='Command time budget per frame, in seconds')
+    parser.add_argument('--max-p99', type=float, default=.5,
+                        help='The slowest p99 (message to scoreboard) that still counts as keeping up')
+    parser.add_argument('--warmup', type=float, default=3,
+                        help='How long to run before measuring, so shaders and textures are loaded, in seconds')
+    parser.add_argument('--report', default=None, help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    app = Ursina(window_type='offscreen')
+    # Keep the benchmark's data away from the real data
+    data_folder = Path(tempfile.mkdtemp(prefix='slack_benchmark_'))
+    cheers.cheer_data_filename = str(data_folder / 'cheer.json')
+    cheers.cheer_journal_filename = str(data_folder / 'cheer.journal')
+    cheers.cheer_ledger_filename = str(data_folder / 'cheer_ledger.sqlite')
+    slack_bot.directory.filename = str(data_folder / 'slack_users.json')
+
+    members = fake_members(args.users)
+    fake = FakeSlack(members)
+    fake.start()
+    scoreboard = BenchmarkScoreboard(attendees={m['real_name']: m['name'] for m in members})
+    scoreboard.give_everyone_points(10 ** 9)
+    slack_bot.init({'cheer_scoreboard': scoreboard}, token='xoxb-fake',
+                   base_url=fake.base_url)
+    if not fake.wait_for_connection():
+        raise RuntimeError('The bot did not connect to the fake Slack server')
+    while len(slack_bot.directory) < len(members):
+        time.sleep(.05)
+
+    check_direct_messages(app, fake, scoreboard, members)
+
+    # The first cheers and redraws compile shaders and upload textures, which would swamp the measurements
+    run_rate(app, fake, scoreboard, members, rate=10, duration=args.warmup, help_ratio=args.help_ratio,
+             budget=args.budget, grace=2)
+    main_thread_commands.dropped = 0
+
+    results = []
+    max_sustained_rate = 0
+    for rate in [float(r) for r in args.rates.split(',')]:
+        result = run_rate(app, fake, scoreboard, members, rate=rate, duration=args.duration,
+                          help_ratio=args.help_ratio, budget=args.budget, grace=2)
+        result['sustained'] = (result['gives_applied'] == result['gives_sent']
+                               and result['helps_answered'] == result['helps_sent']
+                               and result['applied_p99'] <= args.max_p99)
+        results.append(result)
+        print(f'{rate:g} msgs/s: applied p50 {result["applied_p50"] * 1000:.1f} ms '
+              f'p99 {result["applied_p99"] * 1000:.1f} ms, persisted p50 {result["persisted_p50"] * 1000:.1f} ms '
+              f'p99 {result["persisted_p99"] * 1000:.1f} ms, help p99 {result["help_p99"] * 1000:.1f} ms, '
+              f'{"kept up" if result["sustained"] else "fell behind"}')
+        if not result['sustained']:
+            break
+        max_sustained_rate = rate
+
+    report = {'max_sustained_rate': max_sustained_rate, 'users': args.users, 'duration': args.duration,
+              'help_ratio': args.help_ratio, 'results': results}
+    print(f'Max sustained rate: {max_sustained_rate:g} msgs/s')
+    if args.report:
+        json.dump(report, open(args.report, 'w'), indent=2)
+    slack_bot.stop()
+    scoreboard.close()
+    fake.stop()
+    return
+
+
+if __name__ == '__main__':
+    main()
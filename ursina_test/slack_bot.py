@@ -4,117 +4,271 @@ from slack import RTMClient
 from slack import WebClient
 from slack.errors import SlackApiError
 import threading
-from typing import Dict, List
+from typing import List, Optional
+import cheer_state
+from command_queue import main_thread_commands
+from user_directory import UserDirectory
+from command_router import CommandRouter
+from frame_profiler import profiler
 
-SLACK_TOKEN = open('slack_bot_token.txt').read().strip()
-MENTION_REGEX = "^<@(|[WU].+?)>(.*)"
+# Where the bot's token is kept
+SLACK_TOKEN_FILENAME = 'slack_bot_token.txt'
+USER_MENTION_REGEX = re.compile(r'<@([^>|\s]+)[^>]*>')
 
 objects = None
 
-# A cached list of users for id->name lookup
-users_list = {}
+# Everyone in the workspace, for id->name lookup
+directory = UserDirectory()
 
 # The thread that the slack bot is running in
 thread = None
 
-# All of the available textures (set elsewhere)
-cheers_textures = []
+# All of the available textures, or None to find them when they are first needed
+cheers_textures = None
 
 
-def init(ursina_objects, textures:List[str]):
-    global thread, objects, web_client, users_list, cheers_textures
+def slack_token() -> str:
+    return open(SLACK_TOKEN_FILENAME).read().strip()
+
+
+def init(ursina_objects, textures: Optional[List[str]] = None, token: Optional[str] = None,
+         base_url: str = WebClient.BASE_URL, load_directory: bool = True):
+    """
+    Start the bot. The user directory is loaded from disk and refreshed in the background, so this does not
+    wait for Slack.
+    :param textures: The cheers textures for the help, or None to find them when the help is first asked for
+    :param token: The bot's token, or None to read it from SLACK_TOKEN_FILENAME
+    :param base_url: The Slack Web API to use, which can be a local stand-in such as fake_slack
+    :param load_directory: Whether to load the user directory from disk, or whether that has been done already
+    """
+    global thread, objects, cheers_textures
     objects = ursina_objects
     cheers_textures = textures
-    thread = SlackThread()
+    if load_directory:
+        directory.load()
+    thread = SlackThread(token=token or slack_token(), base_url=base_url)
     thread.start()
-    web_client = WebClient(SLACK_TOKEN)
-    users = web_client.users_list()
-    for member in users.data['members']:
-        users_list[member['id']] = member
     return
 
 
 def stop():
     global thread
-    thread.stop()
+    # Not started yet, if the app is closed while it is starting up
+    if thread is not None:
+        thread.stop()
+    if directory.dirty:
+        directory.save()
     return
 
 
-def user_info() -> Dict[str, str]:
-    info = {}
-    for user_id in users_list.keys():
-        user = users_list[user_id]
-        if 'real_name' in user and not user.get('deleted', True):
-            info[user['name']] = user['real_name']
-    return info
+async def keep_directory_fresh(web_client: WebClient, interval: float = 60):
+    """
+    Download the user directory again whenever it gets older than its TTL, and save changes from events
+    :param web_client: A WebClient made with run_async=True
+    :param interval: How often to check, in seconds
+    """
+    while True:
+        try:
+            if directory.stale:
+                await directory.refresh(web_client)
+                print(f'Refreshed the user directory: {len(directory)} users')
+            elif directory.dirty:
+                directory.save()
+        except Exception as e:
+            print(f'Could not refresh the user directory: {e!r}')
+        await asyncio.sleep(interval)
+
+
+router = CommandRouter()
+
+
+def scoreboard_for(data: dict):
+    """
+    Get the scoreboard a message is about. multi_board replaces this to pick one by channel.
+    :param data: The message data
+    :return: The scoreboard, or None if the message is not about any scoreboard
+    """
+    return objects['cheer_scoreboard']
 
 
 def help_text() -> str:
     s = 'Usage:\n'
-    s += '@Scrum Bot give @<user> <points> <texture>\n'
+    for usage in router.usages():
+        s += f'@Scrum Bot {usage}\n'
     s += 'Currently available cheers textures:\n'
-    for name in cheers_textures:
+    for name in cheers_textures if cheers_textures is not None else cheer_state.cheers_textures():
         s += f'- {name}\n'
     return s
 
 
+async def reply(web_client: WebClient, data: dict, text: str):
+    """
+    Reply in a thread on the message a command came from
+    :param web_client: A WebClient made with run_async=True
+    :param data: The message data
+    :param text: The reply
+    """
+    try:
+        response = await web_client.chat_postMessage(
+            channel=data['channel'],
+            text=text,
+            thread_ts=data['ts']
+        )
+    except SlackApiError as e:
+        # You will get a SlackApiError if "ok" is False
+        assert e.response["ok"] is False
+        assert e.response["error"]  # str like 'invalid_auth', 'channel_not_found'
+        print(f"Got an error: {e.response['error']}")
+    return
+
+
+@router.command('give', r'(?P<give_to>(<@[^>\s]+>\s+)+)(?P<how_much>[0-9]+)\s*(?P<texture>\S*)',
+                usage='give @<user> [@<user> ...] <points> <texture>')
+async def give_command(match, data: dict, web_client: WebClient):
+    cheer_scoreboard = scoreboard_for(data)
+    if cheer_scoreboard is None:
+        return
+    try:
+        # Anyone who joined since the directory was refreshed is looked up on their own
+        name_from = (await directory.fetch_member(web_client, data['user']))['name']
+        names_to = [(await directory.fetch_member(web_client, user_id))['name']
+                    for user_id in USER_MENTION_REGEX.findall(match.group('give_to'))]
+    except SlackApiError as e:
+        print(f"Could not look up users: {e.response['error']}")
+        return
+    points = int(match.group('how_much'))
+    texture = match.group('texture')
+    print(f'Giving {points} from {name_from} to {", ".join(names_to)}')
+    # The scoreboard is part of the scene, so it is only changed from the main loop
+    main_thread_commands.put(cheer_scoreboard.transfer_many, name_from,
+                             [(name_to, points) for name_to in names_to], texture=texture)
+    return
+
+
+@router.command('stats', r'(<@(?P<user>[^>|\s]+)[^>]*>)?', usage='stats [@<user>]')
+async def stats_command(match, data: dict, web_client: WebClient):
+    cheer_scoreboard = scoreboard_for(data)
+    if cheer_scoreboard is None:
+        return
+    try:
+        username = (await directory.fetch_member(web_client, match.group('user') or data['user']))['name']
+    except SlackApiError as e:
+        print(f"Could not look up users: {e.response['error']}")
+        return
+    # The scoreboard is read on the main loop, which then posts the reply through the bot's thread
+    main_thread_commands.put(reply_from_main_thread, data, cheer_scoreboard.stats_text, username)
+    return
+
+
+@router.command('sort', r'(?P<sort_key>\w+)', usage='sort <cheer_available|cheer_given|given_this_week|...>')
+async def sort_command(match, data: dict, web_client: WebClient):
+    cheer_scoreboard = scoreboard_for(data)
+    if cheer_scoreboard is None:
+        return
+    sort_key = match.group('sort_key').lower()
+    if sort_key not in cheer_scoreboard.sort_keys():
+        await reply(web_client, data, f'Sort by one of: {", ".join(cheer_scoreboard.sort_keys())}')
+        return
+    main_thread_commands.put(cheer_scoreboard.set_sort_key, sort_key)
+    return
+
+
+@router.command('help')
+async def help_command(match, data: dict, web_client: WebClient):
+    await reply(web_client, data, help_text())
+    return
+
+
+router.fallback = help_command
+
+
+def reply_from_main_thread(data: dict, make_text, *args):
+    """
+    Work out a reply on the main loop, and post it from the bot's thread
+    :param data: The message data to reply to
+    :param make_text: Called with args to get the reply
+    """
+    text = make_text(*args)
+    asyncio.run_coroutine_threadsafe(reply(thread.web_client, data, text), thread.loop)
+    return
+
+
 # It does not look like there is a way to have this be a member of SlackThread, since 'self' will never
 # be passed to the method
 @RTMClient.run_on(event='message')
 @RTMClient.run_on(event='app_mention')
-def handle_message(**payload):
+async def handle_message(**payload):
     data = payload['data']
+    if 'subtype' in data:
+        # Edits, joins, bot messages and so on
+        return
+    if 'bot_id' in data or (router.bot_user_id is not None and data.get('user', None) == router.bot_user_id):
+        # The bot's own replies come back as plain messages, and answering them would never end
+        return
     web_client = payload['web_client']
-    rtm_client = payload['rtm_client']
     text = data.get('text', '')
-    give_matches = re.search(r'give\s<@(?P<give_to>\S*)>\s(?P<how_much>[0-9]+)\s*(?P<texture>\S*)?', text)
-    if give_matches:
-        name_from = users_list[data['user']]['name']
-        name_to = users_list[give_matches.group('give_to')]['name']
-        points = int(give_matches.group('how_much'))
-        texture = give_matches.group('texture')
-        print(f'Giving {points} from {name_from} to {name_to}')
-        objects['cheer_scoreboard'].transfer_points(name_from, name_to, points, texture=texture)
-    elif 'help' in text:
-        text = help_text()
-        channel_id = data['channel']
-        thread_ts = data['ts']
-        user = data['user']
+    # Direct message channels start with D, and do not need the bot to be mentioned
+    direct = data.get('channel', '').startswith('D')
+    with profiler.section('slack message'):
+        await router.dispatch(text, data, web_client, direct=direct)
+    return
 
-        try:
-            response = web_client.chat_postMessage(
-                channel=channel_id,
-                text=text,
-                thread_ts=thread_ts
-            )
-        except SlackApiError as e:
-            # You will get a SlackApiError if "ok" is False
-            assert e.response["ok"] is False
-            assert e.response["error"]  # str like 'invalid_auth', 'channel_not_found'
-            print(f"Got an error: {e.response['error']}")
 
+@RTMClient.run_on(event='open')
+async def handle_open(**payload):
+    router.bot_user_id = payload['data']['self']['id']
+    return
+
+
+@RTMClient.run_on(event='user_change')
+@RTMClient.run_on(event='team_join')
+async def handle_user_change(**payload):
+    directory.update_member(payload['data']['user'])
     return
 
 
 class SlackThread(threading.Thread):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, token: str, base_url: str = WebClient.BASE_URL):
+        """
+        :param token: The bot's token
+        :param base_url: The Slack Web API to use
+        """
+        super().__init__(daemon=True)
+        self._token = token
+        self._base_url = base_url
         self._running = False
         self._bot_id = None
         self._loop = asyncio.new_event_loop()
+        self._rtm_client = None
+        self.web_client = None
         return
 
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
     def run(self):
         self._running = True
         asyncio.set_event_loop(self._loop)
-        rtm_client = RTMClient(token=SLACK_TOKEN)
+        self._rtm_client = RTMClient(token=self._token, base_url=self._base_url, run_async=True, loop=self._loop)
+        self.web_client = WebClient(token=self._token, base_url=self._base_url, run_async=True, loop=self._loop)
+        asyncio.ensure_future(keep_directory_fresh(self.web_client), loop=self._loop)
         # rtm_client.start() does not like being run in a thread,
         # so just do the parts of it that work in a thread manually....
-        future = asyncio.ensure_future(rtm_client._connect_and_read(), loop=self._loop)
-        self._loop.run_until_complete(future)
+        future = asyncio.ensure_future(self._rtm_client._connect_and_read(), loop=self._loop)
+        try:
+            self._loop.run_until_complete(future)
+        except RuntimeError:
+            # stop() had to stop the loop itself
+            pass
         return
 
     def stop(self) -> None:
-        self._loop.stop()
-        self.join()
+        # The loop belongs to this thread, so ask it to stop rather than stopping it from outside
+        if self._rtm_client is not None:
+            self._loop.call_soon_threadsafe(self._rtm_client.stop)
+            self.join(timeout=5)
+        if self.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self.join()
         return
@@ -0,0 +1,185 @@
+#
+# Start up in steps that run at the same time, each attached to the scene as soon as it is ready, so the first
+# frame does not wait for the disk or the network
+#
+
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Sequence
+
+# As close to when the process started as this module can know, since it is imported first
+PROCESS_STARTED = time.perf_counter()
+
+
+class StartupStep:
+    def __init__(self, name: str, load: Optional[Callable[[], Any]], attach: Optional[Callable[[Any], None]],
+                 after: Sequence[str]):
+        self.name = name
+        self.load = load
+        self.attach = attach
+        self.after = list(after)
+        self.future: Optional[Future] = None
+        # What load returned, once the step is attached
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.attached = False
+        # When each part happened, relative to PROCESS_STARTED, in seconds
+        self.queued_at: Optional[float] = None
+        self.load_started_at: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+        self.attached_at: Optional[float] = None
+        return
+
+    def timings(self) -> Dict[str, Any]:
+        def between(start, end):
+            return end - start if start is not None and end is not None else None
+        return {
+            'after': self.after,
+            'queued_at': self.queued_at,
+            'load': between(self.load_started_at, self.loaded_at),
+            'waited': between(self.queued_at, self.load_started_at),
+            'attach': between(self.loaded_at, self.attached_at),
+            'ready_at': self.attached_at,
+            'error': repr(self.error) if self.error else None,
+        }
+
+
+class Startup:
+    """
+    Steps to start the app. Each step has a load, which runs on a worker thread (so it must not touch the scene),
+    and an attach, which runs on the main loop with what the load returned. A step starts loading once the steps
+    it comes after are attached. update() must be called every frame.
+    """
+    def __init__(self, workers: int = 4):
+        """
+        :param workers: How many loads can run at once
+        """
+        self._workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._steps: Dict[str, StartupStep] = {}
+        self.first_frame_at: Optional[float] = None
+        self.reported = False
+        return
+
+    def add(self, name: str, load: Optional[Callable[[], Any]] = None,
+            attach: Optional[Callable[[Any], None]] = None, after: Sequence[str] = ()):
+        """
+        Add a step, which starts loading right away unless it comes after other steps
+        :param name: The step's name, for the report and for other steps' `after`
+        :param load: Called on a worker thread, or None to only attach
+        :param attach: Called on the main loop with what load returned, or None to only load
+        :param after: The steps that must be attached first, which must have been added already
+        """
+        # A step after one that is never added would never start, and startup would never be done
+        unknown = [other for other in after if other not in self._steps]
+        if unknown:
+            raise ValueError(f'Startup step {name} comes after steps that have not been added: {", ".join(unknown)}')
+        step = StartupStep(name, load, attach, after)
+        step.queued_at = time.perf_counter() - PROCESS_STARTED
+        self._steps[name] = step
+        self._start_ready_steps()
+        return
+
+    @property
+    def done(self) -> bool:
+        return all(step.attached or step.error for step in self._steps.values())
+
+    def ready(self, name: str) -> bool:
+        step = self._steps.get(name, None)
+        return step is not None and step.attached
+
+    def result(self, name: str) -> Any:
+        """
+        Get what a step's load returned, for the steps that come after it
+        """
+        step = self._steps[name]
+        if not step.attached:
+            raise RuntimeError(f'Startup step {name} is not ready')
+        return step.result
+
+    def _start_ready_steps(self):
+        changed = True
+        while changed:
+            changed = False
+            for step in self._steps.values():
+                if step.future is not None or step.error:
+                    continue
+                failed = [name for name in step.after if self._steps[name].error]
+                if failed:
+                    # Nothing that depends on a failed step can start either
+                    step.error = RuntimeError(f'{", ".join(failed)} failed')
+                    changed = True
+                elif all(self._steps[name].attached for name in step.after):
+                    if self._pool is None:
+                        self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='startup')
+                    step.future = self._pool.submit(self._load, step)
+        return
+
+    @staticmethod
+    def _load(step: StartupStep) -> Any:
+        step.load_started_at = time.perf_counter() - PROCESS_STARTED
+        try:
+            return step.load() if step.load is not None else None
+        finally:
+            step.loaded_at = time.perf_counter() - PROCESS_STARTED
+
+    def update(self):
+        """
+        Attach every step that has finished loading, and start the ones that were waiting on them
+        """
+        if self.first_frame_at is None:
+            self.first_frame_at = time.perf_counter() - PROCESS_STARTED
+        changed = False
+        for step in self._steps.values():
+            if step.attached or step.error or step.future is None or not step.future.done():
+                continue
+            try:
+                step.result = step.future.result()
+                if step.attach is not None:
+                    step.attach(step.result)
+                step.attached = True
+            except Exception as e:
+                step.error = e
+                print(f'Startup step {step.name} failed: {e!r}')
+            step.attached_at = time.perf_counter() - PROCESS_STARTED
+            changed = True
+        if changed:
+            self._start_ready_steps()
+        if not self.reported and self._steps and self.done:
+            self.reported = True
+            print(self.report())
+        return
+
+    def timings(self) -> Dict[str, Any]:
+        """
+        Get when the first frame was shown and how long each step took, in seconds
+        """
+        return {
+            'first_frame_at': self.first_frame_at,
+            'ready_at': max((step.attached_at or 0 for step in self._steps.values()), default=None),
+            'steps': {name: step.timings() for name, step in self._steps.items()},
+        }
+
+    def report(self) -> str:
+        def ms(seconds):
+            return f'{seconds * 1000:7.1f}' if seconds is not None else '      -'
+        timings = self.timings()
+        text = f'Startup: first frame at {ms(timings["first_frame_at"])} ms, ' \
+               f'ready at {ms(timings["ready_at"])} ms\n'
+        text += f'{"step":<20} {"waited":>7} {"load":>7} {"attach":>7} {"ready at":>8}\n'
+        for name, step in timings['steps'].items():
+            text += f'{name:<20} {ms(step["waited"])} {ms(step["load"])} {ms(step["attach"])} ' \
+                    f'{ms(step["ready_at"])}{"  " + step["error"] if step["error"] else ""}\n'
+        return text
+
+    def close(self):
+        """
+        Stop loading anything that has not started yet
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        return
+
+
+# Starting up the app
+startup = Startup()
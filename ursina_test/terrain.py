@@ -0,0 +1,242 @@
+#
+# Procedural terrain, generated a whole chunk at a time, and streamed in around the player
+#
+
+import queue
+import threading
+import numpy as np
+from ursina import *
+from typing import List, Optional, Set
+
+from voxel_world import CHUNK_SIZE, AIR, ChunkKey, VoxelWorld, chunk_key
+
+# Block IDs used by the terrain
+GRASS = 1
+DIRT = 2
+STONE = 3
+
+# Colours for the terrain block IDs, to pass to VoxelWorld
+TERRAIN_BLOCK_COLORS = np.ones((256, 4), dtype=np.float32)
+TERRAIN_BLOCK_COLORS[GRASS] = (.45, .75, .35, 1)
+TERRAIN_BLOCK_COLORS[DIRT] = (.55, .4, .25, 1)
+TERRAIN_BLOCK_COLORS[STONE] = (.55, .55, .55, 1)
+
+
+def _lattice_values(ix: np.ndarray, iz: np.ndarray, seed: int) -> np.ndarray:
+    """
+    Hash integer lattice coordinates to random values between 0 and 1
+    """
+    h = (ix * 374761393 + iz * 668265263 + seed * 144665) & 0xffffffff
+    h = ((h ^ (h >> 13)) * 1274126177) & 0xffffffff
+    h ^= h >> 16
+    return h / 0xffffffff
+
+
+def value_noise(xs: np.ndarray, zs: np.ndarray, seed: int) -> np.ndarray:
+    """
+    Smoothly interpolated value noise, for whole arrays of coordinates at once
+    :param xs: The x coordinates
+    :param zs: The z coordinates
+    :param seed: The seed for the noise
+    :return: Values between 0 and 1, with the same shape as xs and zs
+    """
+    x0 = np.floor(xs)
+    z0 = np.floor(zs)
+    tx = xs - x0
+    tz = zs - z0
+    # Smoothstep, so the lattice does not show
+    tx = tx * tx * (3 - 2 * tx)
+    tz = tz * tz * (3 - 2 * tz)
+    ix = x0.astype(np.int64)
+    iz = z0.astype(np.int64)
+    v00 = _lattice_values(ix, iz, seed)
+    v10 = _lattice_values(ix + 1, iz, seed)
+    v01 = _lattice_values(ix, iz + 1, seed)
+    v11 = _lattice_values(ix + 1, iz + 1, seed)
+    top = v00 + (v10 - v00) * tx
+    bottom = v01 + (v11 - v01) * tx
+    return top + (bottom - top) * tz
+
+
+def fractal_noise(xs: np.ndarray, zs: np.ndarray, seed: int, octaves: int = 4) -> np.ndarray:
+    """
+    Several octaves of value noise added together
+    :param xs: The x coordinates
+    :param zs: The z coordinates
+    :param seed: The seed for the noise
+    :param octaves: How many octaves to add
+    :return: Values between 0 and 1, with the same shape as xs and zs
+    """
+    total = np.zeros(np.shape(xs), dtype=np.float64)
+    amplitude = 1.0
+    frequency = 1.0
+    amplitudes = 0.0
+    for octave in range(octaves):
+        total += value_noise(xs * frequency, zs * frequency, seed + octave) * amplitude
+        amplitudes += amplitude
+        amplitude *= .5
+        frequency *= 2
+    return total / amplitudes
+
+
+class TerrainGenerator:
+    """
+    Generates the blocks for a chunk from a seed, the same way every time
+    """
+    def __init__(self, seed: int = 0, base_height: int = 0, height_range: int = 24, feature_size: float = 48):
+        self.seed = seed
+        self.base_height = base_height
+        self.height_range = height_range
+        self.feature_size = feature_size
+        return
+
+    def heightmap(self, chunk_x: int, chunk_z: int) -> np.ndarray:
+        """
+        Get the height of the ground for every column in a chunk
+        :param chunk_x: The x chunk coordinate
+        :param chunk_z: The z chunk coordinate
+        :return: A (CHUNK_SIZE, CHUNK_SIZE) array of heights, indexed by x then z
+        """
+        offsets = np.arange(CHUNK_SIZE)
+        xs, zs = np.meshgrid(chunk_x * CHUNK_SIZE + offsets, chunk_z * CHUNK_SIZE + offsets, indexing='ij')
+        noise = fractal_noise(xs / self.feature_size, zs / self.feature_size, self.seed)
+        heights = self.base_height + (noise - .5) * self.height_range
+        return np.floor(heights).astype(np.int64)
+
+    def generate_chunk(self, key: ChunkKey) -> np.ndarray:
+        """
+        Generate the block IDs for a whole chunk
+        :param key: The chunk to generate
+        """
+        chunk_x, chunk_y, chunk_z = key
+        heights = self.heightmap(chunk_x, chunk_z)[:, None, :]
+        ys = (chunk_y * CHUNK_SIZE + np.arange(CHUNK_SIZE))[None, :, None]
+        blocks = np.full((CHUNK_SIZE,) * 3, AIR, dtype=np.uint8)
+        blocks[ys <= heights] = DIRT
+        blocks[ys == heights] = GRASS
+        blocks[ys < heights - 3] = STONE
+        return blocks
+
+
+class ChunkStreamer(Entity):
+    """
+    Loads chunks near a target (usually the player) on a background thread, and unloads the ones
+    that are too far away, so the number of chunks in memory stays bounded.
+    """
+    def __init__(self, world: VoxelWorld, generator: TerrainGenerator, target: Entity,
+                 radius: int = 4, min_chunk_y: int = -2, max_chunk_y: int = 1,
+                 max_loads_per_frame: int = 4, **kwargs):
+        super().__init__(**kwargs)
+        self.world = world
+        self.generator = generator
+        self.target = target
+        self.radius = radius
+        self.min_chunk_y = min_chunk_y
+        self.max_chunk_y = max_chunk_y
+        self.max_loads_per_frame = max_loads_per_frame
+        # Chunks that have been generated and handed to the world (including empty ones)
+        self.loaded: Set[ChunkKey] = set()
+        self._wanted: Set[ChunkKey] = set()
+        self._pending: Set[ChunkKey] = set()
+        self._centre = None
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        self._running = True
+        self._thread = threading.Thread(target=self._generate_chunks, daemon=True)
+        self._thread.start()
+        return
+
+    def _generate_chunks(self):
+        while self._running:
+            key = self._requests.get()
+            if key is None:
+                break
+            if key not in self._wanted:
+                # The target moved away before this chunk was reached
+                self._results.put((key, None))
+                continue
+            self._results.put((key, self.chunk_blocks(key)))
+        return
+
+    def stop(self):
+        self._running = False
+        self._requests.put(None)
+        return
+
+    def on_destroy(self):
+        self.stop()
+        return
+
+    def wanted_chunks(self, centre: ChunkKey) -> List[ChunkKey]:
+        """
+        Get the chunks that should be loaded around a chunk, nearest first
+        :param centre: The chunk the target is in
+        """
+        keys = []
+        for dx in range(-self.radius, self.radius + 1):
+            for dz in range(-self.radius, self.radius + 1):
+                for y in range(self.min_chunk_y, self.max_chunk_y + 1):
+                    keys.append((centre[0] + dx, y, centre[2] + dz))
+        keys.sort(key=lambda k: (k[0] - centre[0]) ** 2 + (k[2] - centre[2]) ** 2)
+        return keys
+
+    def preload(self, radius: int = 1):
+        """
+        Generate the chunks right around the target immediately, so there is ground to stand on
+        :param radius: How many chunks around the target to generate
+        """
+        centre = chunk_key(self.target.position)
+        for dx in range(-radius, radius + 1):
+            for dz in range(-radius, radius + 1):
+                for y in range(self.min_chunk_y, self.max_chunk_y + 1):
+                    key = (centre[0] + dx, y, centre[2] + dz)
+                    if key not in self.loaded:
+                        self._load(key, self.chunk_blocks(key))
+        return
+
+    def chunk_blocks(self, key: ChunkKey) -> np.ndarray:
+        """
+        Get the blocks for a chunk, from the world's store if it was saved, otherwise from the generator
+        :param key: The chunk to get
+        """
+        blocks = self.world.store.saved_chunk(key)
+        if blocks is None:
+            blocks = self.generator.generate_chunk(key)
+        return blocks
+
+    def _load(self, key: ChunkKey, blocks: Optional[np.ndarray]):
+        self.loaded.add(key)
+        if blocks is not None and blocks.any():
+            self.world.load_chunk(key, blocks)
+        return
+
+    def update(self):
+        centre = chunk_key(self.target.position)
+        if centre != self._centre:
+            self._centre = centre
+            wanted = self.wanted_chunks(centre)
+            self._wanted = set(wanted)
+            for key in wanted:
+                if key not in self.loaded and key not in self._pending:
+                    self._pending.add(key)
+                    self._requests.put(key)
+            # Unload anything that is no longer wanted
+            for key in list(self.loaded - self._wanted):
+                self.loaded.discard(key)
+                self.world.unload_chunk(key)
+        for i in range(self.max_loads_per_frame):
+            try:
+                key, blocks = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._pending.discard(key)
+            # The target may have moved on while this chunk was being generated
+            if key not in self._wanted or key in self.loaded:
+                continue
+            if blocks is None:
+                # Skipped by the worker, but wanted again since then
+                self._pending.add(key)
+                self._requests.put(key)
+            else:
+                self._load(key, blocks)
+        return
@@ -0,0 +1,147 @@
+#
+# Share textures between entities, instead of loading the same file again for each one
+#
+
+import math
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Tuple
+from PIL import Image
+from ursina import *
+
+# (u0, v0, u1, v1)
+UVRect = Tuple[float, float, float, float]
+
+
+class TextureAtlas:
+    """
+    Several small images packed into one texture, so entities using any of them can share one texture
+    binding. The first tile is plain white, for things that should only be coloured.
+    """
+    def __init__(self, paths: List[Path], tile_size: Tuple[int, int]):
+        """
+        :param paths: The images to pack
+        :param tile_size: The size of each tile, in pixels. Images of other sizes are scaled to fit.
+        """
+        tile_width, tile_height = tile_size
+        tile_count = len(paths) + 1
+        columns = math.ceil(math.sqrt(tile_count))
+        rows = math.ceil(tile_count / columns)
+        width = columns * tile_width
+        height = rows * tile_height
+        image = Image.new('RGBA', (width, height), (255, 255, 255, 255))
+        self._uvs: Dict[str, UVRect] = {}
+        for i, path in enumerate(paths):
+            tile = i + 1
+            column = tile % columns
+            row = tile // columns
+            with Image.open(path) as tile_image:
+                tile_image = tile_image.convert('RGBA')
+                if tile_image.size != tile_size:
+                    tile_image = tile_image.resize(tile_size)
+                image.paste(tile_image, (column * tile_width, row * tile_height))
+            self._uvs[str(path)] = self._tile_uv(column, row, columns, rows, width, height)
+        self.white_uv = self._tile_uv(0, 0, columns, rows, width, height)
+        self.texture = Texture(image)
+        self.size_bytes = width * height * 4
+        return
+
+    @staticmethod
+    def _tile_uv(column: int, row: int, columns: int, rows: int, width: int, height: int) -> UVRect:
+        # Pull in by half a texel so neighbouring tiles don't bleed in. Rows count down from the top
+        # of the image, but v counts up from the bottom.
+        inset_u = .5 / width
+        inset_v = .5 / height
+        u0 = column / columns + inset_u
+        u1 = (column + 1) / columns - inset_u
+        v1 = 1 - row / rows - inset_v
+        v0 = 1 - (row + 1) / rows + inset_v
+        return u0, v0, u1, v1
+
+    def uv_rect(self, path: Path) -> UVRect:
+        """
+        Get the part of the atlas an image was packed into
+        :param path: The image
+        """
+        return self._uvs[str(path)]
+
+    def texture_scale_and_offset(self, path: Path) -> Tuple[Vec2, Vec2]:
+        """
+        Get the texture_scale and texture_offset that make an entity show one image from the atlas
+        :param path: The image
+        """
+        u0, v0, u1, v1 = self.uv_rect(path)
+        return Vec2(u1 - u0, v1 - v0), Vec2(u0, v0)
+
+
+class TextureCache:
+    """
+    Textures keyed by path and modification time, so a changed file is loaded again.
+    The least recently used textures are dropped when they take up more than the memory budget.
+    Textures can be loaded from worker threads, to have them ready before they are needed.
+    """
+    def __init__(self, budget_bytes: int = 256 * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self._textures = OrderedDict()
+        self._lock = threading.Lock()
+        return
+
+    def _add(self, key, value, size_bytes: int):
+        with self._lock:
+            if key in self._textures:
+                # Another thread loaded it first
+                self._textures.move_to_end(key)
+                return self._textures[key][0]
+            self._textures[key] = (value, size_bytes)
+            self.used_bytes += size_bytes
+            # Always keep the newest one, even if it is over budget on its own
+            while self.used_bytes > self.budget_bytes and len(self._textures) > 1:
+                old_key, (old_value, old_size) = self._textures.popitem(last=False)
+                self.used_bytes -= old_size
+        return value
+
+    def _get(self, key):
+        with self._lock:
+            value = self._textures.get(key, None)
+            if value is None:
+                return None
+            self._textures.move_to_end(key)
+        return value[0]
+
+    def texture(self, path) -> Texture:
+        """
+        Get the texture for a file, loading it only if it is not already cached
+        :param path: The file to load
+        """
+        path = Path(path)
+        key = ('texture', str(path), path.stat().st_mtime_ns)
+        texture = self._get(key)
+        if texture is None:
+            texture = Texture(str(path))
+            texture = self._add(key, texture, texture.width * texture.height * 4)
+        return texture
+
+    def atlas(self, paths: List[Path], tile_size: Tuple[int, int]) -> TextureAtlas:
+        """
+        Get an atlas of images, packing it only if it is not already cached
+        :param paths: The images to pack
+        :param tile_size: The size of each tile, in pixels
+        """
+        key = ('atlas', tile_size) + tuple((str(p), Path(p).stat().st_mtime_ns) for p in paths)
+        atlas = self._get(key)
+        if atlas is None:
+            atlas = TextureAtlas(paths, tile_size)
+            atlas = self._add(key, atlas, atlas.size_bytes)
+        return atlas
+
+    def clear(self):
+        with self._lock:
+            self._textures.clear()
+            self.used_bytes = 0
+        return
+
+
+# The texture cache for the whole process
+texture_cache = TextureCache()
@@ -0,0 +1,190 @@
+#
+# Slack users, cached on disk and kept up to date from events, with indexes for looking people up by name
+#
+
+import json
+import os
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+# The parts of each Slack member that are kept
+MEMBER_FIELDS = ('id', 'name', 'real_name', 'deleted')
+
+Member = Dict[str, Any]
+
+
+def normalize_name(name: str) -> str:
+    """
+    Make a name comparable regardless of case, accents and spacing, so "José  Núñez" matches "jose nunez"
+    :param name: A real name or username
+    """
+    decomposed = unicodedata.normalize('NFKD', name)
+    without_accents = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(without_accents.casefold().split())
+
+
+class UserDirectory:
+    """
+    The members of a Slack workspace by id, plus indexes by normalized username and real name.
+    It is saved to disk so startup does not have to wait for Slack, refreshed in full once it is older than
+    its TTL, and changed one member at a time from user_change and team_join events in between.
+    Safe to read from the main thread while the bot thread updates it.
+    """
+    def __init__(self, filename: str = 'slack_users.json', ttl: float = 12 * 60 * 60):
+        """
+        :param filename: Where the directory is cached
+        :param ttl: How old the directory can get before it is downloaded again, in seconds
+        """
+        self.filename = filename
+        self.ttl = ttl
+        self.fetched_at = 0.0
+        self.dirty = False
+        self._members: Dict[str, Member] = {}
+        self._by_username: Dict[str, str] = {}
+        self._by_real_name: Dict[str, str] = {}
+        self._listeners: List[Callable[['UserDirectory'], None]] = []
+        self._lock = threading.Lock()
+        return
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    @property
+    def stale(self) -> bool:
+        return time.time() - self.fetched_at > self.ttl
+
+    def load(self):
+        """
+        Load the cached directory, if there is one
+        """
+        if not Path(self.filename).exists():
+            return
+        try:
+            cached = json.load(open(self.filename, 'r'))
+        except json.JSONDecodeError:
+            print(f'Ignoring a damaged user directory: {self.filename}')
+            return
+        self._replace(cached['members'], cached['fetched_at'])
+        return
+
+    def save(self):
+        """
+        Write the directory to disk, replacing the old one atomically
+        """
+        with self._lock:
+            cached = {'fetched_at': self.fetched_at, 'members': list(self._members.values())}
+            self.dirty = False
+        temp_filename = f'{self.filename}.tmp'
+        with open(temp_filename, 'w+') as f:
+            json.dump(cached, f)
+        os.replace(temp_filename, self.filename)
+        return
+
+    def add_listener(self, listener: Callable[['UserDirectory'], None]):
+        """
+        Call a function whenever the directory changes. It is called from whichever thread changed it.
+        :param listener: Called with the directory
+        """
+        self._listeners.append(listener)
+        return
+
+    def _changed(self):
+        for listener in self._listeners:
+            listener(self)
+        return
+
+    def _index(self, member: Member):
+        self._by_username[normalize_name(member['name'])] = member['id']
+        if member.get('real_name') and not member.get('deleted', True):
+            self._by_real_name[normalize_name(member['real_name'])] = member['id']
+        return
+
+    def _replace(self, members: List[Member], fetched_at: float):
+        members = {m['id']: {k: m[k] for k in MEMBER_FIELDS if k in m} for m in members}
+        with self._lock:
+            self._members = members
+            self._by_username = {}
+            self._by_real_name = {}
+            for member in members.values():
+                self._index(member)
+            self.fetched_at = fetched_at
+        self._changed()
+        return
+
+    def update_member(self, member: Member):
+        """
+        Add or change one member, such as from a user_change or team_join event
+        :param member: The member, as Slack sends it
+        """
+        member = {k: member[k] for k in MEMBER_FIELDS if k in member}
+        with self._lock:
+            old_member = self._members.get(member['id'], None)
+            if old_member is not None:
+                # Drop the old names, in case they changed
+                if self._by_username.get(normalize_name(old_member['name'])) == member['id']:
+                    del self._by_username[normalize_name(old_member['name'])]
+                old_real_name = normalize_name(old_member.get('real_name') or '')
+                if self._by_real_name.get(old_real_name) == member['id']:
+                    del self._by_real_name[old_real_name]
+            self._members[member['id']] = member
+            self._index(member)
+            self.dirty = True
+        self._changed()
+        return
+
+    async def refresh(self, web_client, page_size: int = 200):
+        """
+        Download the whole directory a page at a time
+        :param web_client: A WebClient made with run_async=True
+        :param page_size: How many members to ask for at once
+        """
+        fetched_at = time.time()
+        members = []
+        cursor = None
+        while True:
+            response = await web_client.users_list(cursor=cursor, limit=page_size)
+            members.extend(response['members'])
+            cursor = response.get('response_metadata', {}).get('next_cursor', None)
+            if not cursor:
+                break
+        self._replace(members, fetched_at)
+        self.save()
+        return
+
+    async def fetch_member(self, web_client, user_id: str) -> Optional[Member]:
+        """
+        Get a member who is not in the directory yet, such as someone who joined since it was refreshed
+        :param web_client: A WebClient made with run_async=True
+        :param user_id: Their Slack id
+        """
+        member = self.by_id(user_id)
+        if member is None:
+            response = await web_client.users_info(user=user_id)
+            self.update_member(response['user'])
+            member = self.by_id(user_id)
+        return member
+
+    def by_id(self, user_id: str) -> Optional[Member]:
+        return self._members.get(user_id, None)
+
+    def by_username(self, username: str) -> Optional[Member]:
+        return self._members.get(self._by_username.get(normalize_name(username), None), None)
+
+    def by_real_name(self, real_name: str) -> Optional[Member]:
+        return self._members.get(self._by_real_name.get(normalize_name(real_name), None), None)
+
+    def find_attendees(self, names: List[str]) -> Dict[str, str]:
+        """
+        Find the Slack usernames of meeting participants
+        :param names: The participants' real names
+        :return: Usernames, by name, for the participants that are in the directory
+        """
+        attendees = {}
+        for name in names:
+            member = self.by_real_name(name)
+            if member:
+                attendees[name] = member['name']
+        return attendees
@@ -0,0 +1,242 @@
+#
+# Video textures that only decode what is visible, at the size it is shown at
+#
+
+import math
+import threading
+import numpy as np
+from collections import deque
+from pathlib import Path
+from typing import Dict, List
+from panda3d.core import Filename, MovieVideo, Texture as PandaTexture
+from ursina import *
+
+# File extensions that are played as video
+VIDEO_SUFFIXES = ('.mp4', '.avi', '.mov', '.webm')
+
+
+def is_video(path) -> bool:
+    return Path(str(path)).suffix.lower() in VIDEO_SUFFIXES
+
+
+def on_screen_height(entity: Entity) -> float:
+    """
+    Roughly how tall an entity is on screen
+    :param entity: The entity
+    :return: The height, in pixels
+    """
+    distance = (entity.world_position - camera.world_position).length()
+    window_height = window.size[1]
+    if distance <= 0:
+        return window_height
+    size = max(entity.world_scale)
+    return size / (2 * distance * math.tan(math.radians(camera.fov) / 2)) * window_height
+
+
+def downscale(frame: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Shrink a frame by averaging blocks of pixels
+    :param frame: A (height, width, 3) uint8 array
+    :param factor: How many pixels, in each direction, become one
+    """
+    if factor <= 1:
+        return frame
+    height = frame.shape[0] // factor * factor
+    width = frame.shape[1] // factor * factor
+    blocks = frame[:height, :width].reshape(height // factor, factor, width // factor, factor, 3)
+    return blocks.mean(axis=(1, 3)).astype(np.uint8)
+
+
+class VideoClip:
+    """
+    One video file, decoded on its own thread into a small ring buffer of downscaled frames.
+    Every entity showing the clip shares its decoder and texture, and decoding stops while none of them
+    are visible.
+    """
+    def __init__(self, path, fps: float = 30, ring_size: int = 4):
+        """
+        :param path: The video file
+        :param fps: How many frames per second to decode
+        :param ring_size: The most decoded frames to hold at once
+        """
+        self.path = str(path)
+        self.fps = fps
+        self.ring_size = ring_size
+        # The entities showing the clip, which the main thread and workers both change (see add_user())
+        self.users: List[Entity] = []
+        self._cursor = MovieVideo.get(Filename.from_os_specific(self.path)).open()
+        self._length = self._cursor.length()
+        self.native_size = (self._cursor.size_x(), self._cursor.size_y())
+        # How much to shrink decoded frames by, set from how big the users are on screen
+        self._factor = 1
+        self._frames = deque()
+        self._condition = threading.Condition()
+        self._playing = False
+        self._running = True
+        self._playback_time = 0.0
+        self._shown_size = None
+        self._panda_texture = PandaTexture(Path(self.path).name)
+        self.texture = Texture(self._panda_texture)
+        self._thread = threading.Thread(target=self._decode, daemon=True)
+        self._thread.start()
+        return
+
+    def _wait_for_room(self) -> bool:
+        with self._condition:
+            # Keep one frame ready even while paused, so showing the clip again is instant
+            while self._running and (len(self._frames) >= self.ring_size
+                                     or (not self._playing and self._frames)):
+                self._condition.wait()
+        return self._running
+
+    def _decode(self):
+        scratch = PandaTexture()
+        self._cursor.setup_texture(scratch)
+        width, height = self.native_size
+        frame_index = 0
+        while self._wait_for_room():
+            timestamp = frame_index / self.fps
+            self._cursor.set_time(timestamp % self._length if self._length else 0, 1)
+            buffer = self._cursor.fetch_buffer()
+            frame_index += 1
+            if buffer is None:
+                continue
+            self._cursor.apply_to_texture(buffer, scratch, 0)
+            data = np.frombuffer(scratch.get_ram_image_as('RGB').get_data(), dtype=np.uint8)
+            # The texture may be padded past the size of the video
+            frame = data.reshape(scratch.get_y_size(), scratch.get_x_size(), 3)[:height, :width]
+            frame = downscale(frame, self._factor)
+            with self._condition:
+                self._frames.append((timestamp, frame))
+                self._condition.notify_all()
+        return
+
+    def add_user(self, entity: Entity):
+        with self._condition:
+            if entity not in self.users:
+                self.users.append(entity)
+        return
+
+    def remove_user(self, entity: Entity) -> bool:
+        """
+        :return: Whether the entity was a user
+        """
+        with self._condition:
+            if entity not in self.users:
+                return False
+            self.users.remove(entity)
+        return True
+
+    def in_use(self) -> bool:
+        with self._condition:
+            return bool(self.users)
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        return
+
+    def _upload(self, frame: np.ndarray):
+        height, width = frame.shape[:2]
+        if self._shown_size != (width, height):
+            self._panda_texture.setup_2d_texture(width, height, PandaTexture.T_unsigned_byte, PandaTexture.F_rgb8)
+            self._shown_size = (width, height)
+        self._panda_texture.set_ram_image_as(frame.tobytes(), 'RGB')
+        return
+
+    def update(self, dt: float):
+        """
+        Show the frame for the current time. Call once per frame, from the main thread.
+        :param dt: The time since the last frame, in seconds
+        """
+        with self._condition:
+            users = list(self.users)
+        visible = [u for u in users if u.enabled and u.visible]
+        playing = bool(visible)
+        if playing:
+            target_height = max(16, max(on_screen_height(u) for u in visible))
+            self._factor = max(1, int(self.native_size[1] // target_height))
+        with self._condition:
+            if playing != self._playing:
+                self._playing = playing
+                self._condition.notify_all()
+            if playing:
+                self._playback_time += dt
+            frame = None
+            # Skip to the newest frame that is due
+            while self._frames and self._frames[0][0] <= self._playback_time:
+                timestamp, frame = self._frames.popleft()
+            if frame is None and self._shown_size is None and self._frames:
+                # Nothing has been shown yet, so show the first frame straight away
+                timestamp, frame = self._frames.popleft()
+            if frame is not None:
+                self._condition.notify_all()
+        if frame is not None:
+            self._upload(frame)
+        return
+
+
+class VideoTextureManager:
+    """
+    Hands out one VideoClip per video file
+    """
+    def __init__(self):
+        self._clips: Dict[str, VideoClip] = {}
+        self._lock = threading.Lock()
+        return
+
+    def clip(self, path) -> VideoClip:
+        """
+        Get the clip for a video file, opening it if needed. Can be called from a worker thread to prewarm it.
+        :param path: The video file
+        """
+        with self._lock:
+            return self._clip(path)
+
+    def _clip(self, path) -> VideoClip:
+        clip = self._clips.get(str(path), None)
+        if clip is None:
+            clip = VideoClip(path)
+            self._clips[str(path)] = clip
+        return clip
+
+    def attach(self, path, entity: Entity) -> Texture:
+        """
+        Start showing a video on an entity
+        :param path: The video file
+        :param entity: The entity that will use the texture
+        :return: The texture to give the entity
+        """
+        # Under the lock, so the clip cannot be closed by detach() before the entity is using it
+        with self._lock:
+            clip = self._clip(path)
+            clip.add_user(entity)
+        return clip.texture
+
+    def detach(self, entity: Entity):
+        """
+        Stop showing any video on an entity, closing clips that nothing else is using
+        :param entity: The entity
+        """
+        with self._lock:
+            for path, clip in list(self._clips.items()):
+                if clip.remove_user(entity) and not clip.in_use():
+                    clip.stop()
+                    del self._clips[path]
+        return
+
+    def update(self, dt: float):
+        """
+        Advance every clip. Call once per frame, from the main thread.
+        :param dt: The time since the last frame, in seconds
+        """
+        with self._lock:
+            clips = list(self._clips.values())
+        for clip in clips:
+            clip.update(dt)
+        return
+
+
+# The video textures for the whole process
+video_textures = VideoTextureManager()
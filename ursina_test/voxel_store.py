@@ -0,0 +1,222 @@
+#
+# Compact storage for voxel chunks, with a binary snapshot format that is memory-mapped on load
+#
+# Snapshot layout (little endian):
+#   header:   magic, version, chunk size, chunk count, metadata length
+#   metadata: UTF-8 JSON
+#   index:    one INDEX_DTYPE record per chunk
+#   data:     the encoded chunks, at the offsets given in the index
+#
+
+import json
+import os
+import struct
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+ChunkKey = Tuple[int, int, int]
+
+MAGIC = b'VOXS'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+
+# Every block in the chunk has the same ID (stored in the index, no data)
+ENCODING_UNIFORM = 0
+# Run-length encoded: run lengths as uint16, followed by the block ID of each run
+ENCODING_RLE = 1
+# One byte per block, which can be used straight from the memory-mapped file
+ENCODING_RAW = 2
+
+INDEX_DTYPE = np.dtype([
+    ('x', '<i4'), ('y', '<i4'), ('z', '<i4'),
+    ('encoding', 'u1'),
+    ('value', 'u1'),
+    ('offset', '<u8'),
+    ('length', '<u4'),
+])
+
+
+def encode_chunk(blocks: np.ndarray) -> Tuple[int, int, bytes]:
+    """
+    Encode a chunk as compactly as possible
+    :param blocks: The chunk's block IDs
+    :return: The encoding, the uniform block ID (if any) and the encoded data
+    """
+    flat = blocks.ravel()
+    starts = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    if not len(starts):
+        return ENCODING_UNIFORM, int(flat[0]), b''
+    starts = np.concatenate(([0], starts))
+    lengths = np.diff(np.concatenate((starts, [len(flat)])))
+    rle_size = len(starts) * 3
+    if rle_size < len(flat) and lengths.max() <= 0xffff:
+        data = lengths.astype('<u2').tobytes() + flat[starts].astype(np.uint8).tobytes()
+        return ENCODING_RLE, 0, data
+    return ENCODING_RAW, 0, flat.astype(np.uint8).tobytes()
+
+
+def decode_chunk(encoding: int, value: int, data: np.ndarray, chunk_size: int) -> np.ndarray:
+    """
+    Decode a chunk that was encoded with encode_chunk()
+    :param encoding: How the chunk was encoded
+    :param value: The block ID, for uniform chunks
+    :param data: The encoded bytes, as a uint8 array
+    :param chunk_size: The width, height and depth of the chunk
+    :return: The chunk's block IDs
+    """
+    shape = (chunk_size,) * 3
+    if encoding == ENCODING_UNIFORM:
+        return np.full(shape, value, dtype=np.uint8)
+    if encoding == ENCODING_RLE:
+        runs = len(data) // 3
+        lengths = data[:runs * 2].view('<u2')
+        values = data[runs * 2:]
+        return np.repeat(values, lengths).reshape(shape)
+    if encoding == ENCODING_RAW:
+        # A view into the (copy on write) mapping, so nothing is read until it is used
+        return data.reshape(shape)
+    raise ValueError(f'Unknown chunk encoding: {encoding}')
+
+
+class VoxelStore:
+    """
+    One dense uint8 array of block IDs per chunk.
+
+    Chunks that are not in memory can come from a memory-mapped snapshot, or from chunks that were
+    modified and then removed, which are kept encoded so they use a few bytes instead of a full array.
+    """
+    def __init__(self, chunk_size: int = 16, metadata: Optional[Dict[str, Any]] = None):
+        self.chunk_size = chunk_size
+        self.metadata = metadata if metadata is not None else {}
+        # Chunks that are in memory
+        self.chunks: Dict[ChunkKey, np.ndarray] = {}
+        # Chunks in memory that have changed since they were generated
+        self.modified: Set[ChunkKey] = set()
+        # Modified chunks that were removed from memory, encoded
+        self._evicted: Dict[ChunkKey, Tuple[int, int, np.ndarray]] = {}
+        # Chunks in the snapshot this store was loaded from
+        self._mapped = None
+        self._mapped_index: Dict[ChunkKey, np.void] = {}
+        return
+
+    def keys(self) -> Iterator[ChunkKey]:
+        """
+        Get the keys of every chunk, whether it is in memory or not
+        """
+        seen = set(self.chunks)
+        yield from self.chunks
+        for key in list(self._evicted) + list(self._mapped_index):
+            if key not in seen:
+                seen.add(key)
+                yield key
+        return
+
+    def has_saved(self, key: ChunkKey) -> bool:
+        """
+        Get whether a chunk that is not in memory can be restored instead of generated
+        :param key: The chunk to check
+        """
+        return key in self._evicted or key in self._mapped_index
+
+    def saved_chunk(self, key: ChunkKey) -> Optional[np.ndarray]:
+        """
+        Decode a chunk that is not in memory
+        :param key: The chunk to get
+        :return: The chunk's block IDs, or None if it was never saved
+        """
+        evicted = self._evicted.get(key, None)
+        if evicted is not None:
+            encoding, value, data = evicted
+            return decode_chunk(encoding, value, data, self.chunk_size).copy()
+        record = self._mapped_index.get(key, None)
+        if record is not None:
+            encoding, value, data = self._mapped_record(record)
+            return decode_chunk(encoding, value, data, self.chunk_size)
+        return None
+
+    def _mapped_record(self, record) -> Tuple[int, int, np.ndarray]:
+        offset = int(record['offset'])
+        data = self._mapped[offset:offset + int(record['length'])]
+        return int(record['encoding']), int(record['value']), data
+
+    def set_chunk(self, key: ChunkKey, blocks: np.ndarray, modified: bool = False):
+        """
+        Put a chunk in memory
+        :param key: The chunk to set
+        :param blocks: The chunk's block IDs
+        :param modified: Whether the chunk differs from what the generator would make
+        """
+        self.chunks[key] = blocks
+        if modified or key in self._evicted:
+            self.modified.add(key)
+        self._evicted.pop(key, None)
+        return
+
+    def mark_modified(self, key: ChunkKey):
+        self.modified.add(key)
+        return
+
+    def remove_chunk(self, key: ChunkKey):
+        """
+        Remove a chunk from memory, keeping an encoded copy if it was modified
+        :param key: The chunk to remove
+        """
+        blocks = self.chunks.pop(key, None)
+        if blocks is not None and key in self.modified:
+            encoding, value, data = encode_chunk(blocks)
+            self._evicted[key] = (encoding, value, np.frombuffer(data, dtype=np.uint8))
+        self.modified.discard(key)
+        return
+
+    def save(self, path: Path):
+        """
+        Write every chunk to a snapshot file, replacing it atomically
+        :param path: The file to write
+        """
+        path = Path(path)
+        keys = list(self.keys())
+        metadata = json.dumps(self.metadata).encode('utf-8')
+        index = np.zeros(len(keys), dtype=INDEX_DTYPE)
+        offset = HEADER.size + len(metadata) + index.nbytes
+        blobs = []
+        for i, key in enumerate(keys):
+            if key in self.chunks:
+                encoding, value, data = encode_chunk(self.chunks[key])
+            elif key in self._evicted:
+                encoding, value, data = self._evicted[key]
+            else:
+                encoding, value, data = self._mapped_record(self._mapped_index[key])
+            data = bytes(data)
+            index[i] = (key[0], key[1], key[2], encoding, value, offset, len(data))
+            blobs.append(data)
+            offset += len(data)
+        temp_path = path.with_name(f'{path.name}.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.chunk_size, len(keys), len(metadata)))
+            f.write(metadata)
+            f.write(index.tobytes())
+            for data in blobs:
+                f.write(data)
+        os.replace(temp_path, path)
+        return
+
+    @classmethod
+    def load(cls, path: Path) -> 'VoxelStore':
+        """
+        Memory-map a snapshot file. Only the header and index are read; chunks are decoded when used.
+        :param path: The file to load
+        """
+        mapped = np.memmap(path, dtype=np.uint8, mode='c')
+        magic, version, chunk_size, count, metadata_length = HEADER.unpack(mapped[:HEADER.size].tobytes())
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} voxel snapshot')
+        offset = HEADER.size
+        metadata = json.loads(mapped[offset:offset + metadata_length].tobytes().decode('utf-8'))
+        offset += metadata_length
+        index = np.frombuffer(mapped[offset:offset + count * INDEX_DTYPE.itemsize].tobytes(), dtype=INDEX_DTYPE)
+        store = cls(chunk_size=chunk_size, metadata=metadata)
+        store._mapped = mapped
+        keys = zip(index['x'].tolist(), index['y'].tolist(), index['z'].tolist())
+        store._mapped_index = dict(zip(keys, index))
+        return store
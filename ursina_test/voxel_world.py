@@ -0,0 +1,304 @@
+#
+# A voxel world that is drawn as one mesh per chunk, instead of one entity per block
+#
+
+import math
+import numpy as np
+from ursina import *
+from typing import Dict, Optional, Set, Tuple
+
+from voxel_store import VoxelStore
+
+# The width, height and depth of a chunk, in blocks
+CHUNK_SIZE = 16
+# The block ID for empty space
+AIR = 0
+
+ChunkKey = Tuple[int, int, int]
+
+# The direction each face points in, and its corners relative to the centre of the block.
+# The corners go counter-clockwise when seen from outside the block.
+FACE_NORMALS = np.array([
+    (1, 0, 0), (-1, 0, 0),
+    (0, 1, 0), (0, -1, 0),
+    (0, 0, 1), (0, 0, -1),
+], dtype=np.int64)
+FACE_CORNERS = np.array([
+    [(.5, -.5, -.5), (.5, -.5, .5), (.5, .5, .5), (.5, .5, -.5)],
+    [(-.5, -.5, .5), (-.5, -.5, -.5), (-.5, .5, -.5), (-.5, .5, .5)],
+    [(-.5, .5, -.5), (.5, .5, -.5), (.5, .5, .5), (-.5, .5, .5)],
+    [(-.5, -.5, .5), (.5, -.5, .5), (.5, -.5, -.5), (-.5, -.5, -.5)],
+    [(.5, -.5, .5), (-.5, -.5, .5), (-.5, .5, .5), (.5, .5, .5)],
+    [(-.5, -.5, -.5), (.5, -.5, -.5), (.5, .5, -.5), (-.5, .5, -.5)],
+], dtype=np.float32)
+# Simple fixed lighting, so the sides of blocks can be told apart
+FACE_SHADES = np.array([.8, .8, 1.0, .5, .7, .7], dtype=np.float32)
+QUAD_TRIANGLES = np.array([0, 1, 2, 0, 2, 3], dtype=np.int64)
+
+# The texture rectangle (u0, v0, u1, v1) and colour for every block ID
+DEFAULT_BLOCK_UVS = np.tile(np.array([0, 0, 1, 1], dtype=np.float32), (256, 1))
+DEFAULT_BLOCK_COLORS = np.ones((256, 4), dtype=np.float32)
+
+
+def chunk_key(position) -> ChunkKey:
+    """
+    Get the key of the chunk containing a block
+    :param position: The position of the block
+    """
+    x, y, z = (int(round(p)) for p in position)
+    return x // CHUNK_SIZE, y // CHUNK_SIZE, z // CHUNK_SIZE
+
+
+def build_chunk_mesh(padded: np.ndarray,
+                     block_uvs: np.ndarray = DEFAULT_BLOCK_UVS,
+                     block_colors: np.ndarray = DEFAULT_BLOCK_COLORS) -> Dict[str, np.ndarray]:
+    """
+    Build the mesh data for one chunk, only emitting faces that border empty space
+    :param padded: The chunk's block IDs, with a one block border taken from the neighbouring chunks
+    :param block_uvs: The texture rectangle for each block ID
+    :param block_colors: The colour for each block ID
+    :return: The vertices, triangles, uvs and colors, in chunk-local coordinates
+    """
+    size = padded.shape[0] - 2
+    solid = padded != AIR
+    inner = solid[1:-1, 1:-1, 1:-1]
+    vertices = []
+    uvs = []
+    colors = []
+    for face, (dx, dy, dz) in enumerate(FACE_NORMALS):
+        neighbour = solid[1 + dx:size + 1 + dx, 1 + dy:size + 1 + dy, 1 + dz:size + 1 + dz]
+        visible = inner & ~neighbour
+        cells = np.argwhere(visible)
+        if not len(cells):
+            continue
+        block_ids = padded[1:-1, 1:-1, 1:-1][visible]
+        vertices.append(cells[:, None, :] + FACE_CORNERS[face][None, :, :])
+        u0, v0, u1, v1 = block_uvs[block_ids].T
+        uvs.append(np.stack((np.stack((u0, v0), axis=-1),
+                             np.stack((u1, v0), axis=-1),
+                             np.stack((u1, v1), axis=-1),
+                             np.stack((u0, v1), axis=-1)), axis=1))
+        face_colors = block_colors[block_ids] * np.array([FACE_SHADES[face]] * 3 + [1], dtype=np.float32)
+        colors.append(np.repeat(face_colors[:, None, :], 4, axis=1))
+    if not vertices:
+        return dict(vertices=np.empty((0, 3), dtype=np.float32), triangles=np.empty(0, dtype=np.int64),
+                    uvs=np.empty((0, 2), dtype=np.float32), colors=np.empty((0, 4), dtype=np.float32))
+    vertices = np.concatenate(vertices).astype(np.float32)
+    face_count = len(vertices)
+    triangles = (np.arange(face_count)[:, None] * 4 + QUAD_TRIANGLES[None, :]).ravel()
+    return dict(vertices=vertices.reshape(-1, 3),
+                triangles=triangles,
+                uvs=np.concatenate(uvs).reshape(-1, 2),
+                colors=np.concatenate(colors).reshape(-1, 4))
+
+
+class VoxelChunk(Entity):
+    """
+    One chunk of the world, drawn as a single mesh
+    """
+    def __init__(self, key: ChunkKey, **kwargs):
+        self.key = key
+        super().__init__(position=Vec3(*key) * CHUNK_SIZE, **kwargs)
+        return
+
+    def set_mesh_data(self, mesh_data: Dict[str, np.ndarray]):
+        """
+        Replace the chunk's mesh
+        :param mesh_data: The mesh data from build_chunk_mesh()
+        """
+        if not len(mesh_data['vertices']):
+            self.model = None
+            self.collider = None
+            return
+        self.model = Mesh(vertices=mesh_data['vertices'].tolist(),
+                          triangles=mesh_data['triangles'].tolist(),
+                          uvs=mesh_data['uvs'].tolist(),
+                          colors=[Color(*c) for c in mesh_data['colors'].tolist()])
+        self.collider = 'mesh'
+        return
+
+
+class VoxelWorld(Entity):
+    """
+    All of the blocks in the world, stored as one array of block IDs per chunk in a VoxelStore.
+
+    Changing a block only rebuilds the mesh of the chunk it is in (and a neighbouring chunk, if the
+    block is on the border), once per frame.
+    """
+    def __init__(self, texture='white_cube',
+                 block_uvs: np.ndarray = DEFAULT_BLOCK_UVS,
+                 block_colors: np.ndarray = DEFAULT_BLOCK_COLORS,
+                 store: Optional[VoxelStore] = None,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.chunk_texture = texture
+        self.block_uvs = block_uvs
+        self.block_colors = block_colors
+        self.store = store if store is not None else VoxelStore(chunk_size=CHUNK_SIZE)
+        # The chunks that are in memory
+        self.chunks: Dict[ChunkKey, np.ndarray] = self.store.chunks
+        self.chunk_entities: Dict[ChunkKey, VoxelChunk] = {}
+        self._dirty: Set[ChunkKey] = set()
+        return
+
+    def get_block(self, position) -> int:
+        """
+        Get the block ID at a position
+        :param position: The position of the block
+        """
+        key = chunk_key(position)
+        blocks = self.chunks.get(key, None)
+        if blocks is None:
+            return AIR
+        x, y, z = (int(round(p)) % CHUNK_SIZE for p in position)
+        return int(blocks[x, y, z])
+
+    def set_block(self, position, block_id: int):
+        """
+        Set the block ID at a position, and mark the affected chunks for rebuilding
+        :param position: The position of the block
+        :param block_id: The block ID, or AIR to remove the block
+        """
+        key = chunk_key(position)
+        blocks = self.chunks.get(key, None)
+        if blocks is None:
+            if block_id == AIR:
+                return
+            blocks = np.zeros((CHUNK_SIZE,) * 3, dtype=np.uint8)
+            self.store.set_chunk(key, blocks)
+        local = tuple(int(round(p)) % CHUNK_SIZE for p in position)
+        blocks[local] = block_id
+        self.store.mark_modified(key)
+        self._dirty.add(key)
+        # Blocks on the border also change which faces the neighbouring chunk shows
+        for axis in range(3):
+            offset = None
+            if local[axis] == 0:
+                offset = -1
+            elif local[axis] == CHUNK_SIZE - 1:
+                offset = 1
+            if offset is not None:
+                neighbour = list(key)
+                neighbour[axis] += offset
+                neighbour = tuple(neighbour)
+                if neighbour in self.chunks:
+                    self._dirty.add(neighbour)
+        return
+
+    def neighbour_keys(self, key: ChunkKey):
+        """
+        Get the keys of the loaded chunks that share a face with a chunk
+        :param key: The chunk to get the neighbours of
+        """
+        for normal in FACE_NORMALS:
+            neighbour = (key[0] + int(normal[0]), key[1] + int(normal[1]), key[2] + int(normal[2]))
+            if neighbour in self.chunks:
+                yield neighbour
+        return
+
+    def load_chunk(self, key: ChunkKey, blocks: np.ndarray, modified: bool = False):
+        """
+        Add a whole chunk of blocks to the world
+        :param key: The chunk to add
+        :param blocks: The chunk's block IDs
+        :param modified: Whether the chunk differs from what the generator would make
+        """
+        self.store.set_chunk(key, blocks, modified=modified)
+        self._dirty.add(key)
+        self._dirty.update(self.neighbour_keys(key))
+        return
+
+    def unload_chunk(self, key: ChunkKey):
+        """
+        Remove a chunk and its mesh from the world. Modified chunks are kept, encoded, in the store.
+        :param key: The chunk to remove
+        """
+        self.store.remove_chunk(key)
+        self._dirty.discard(key)
+        entity = self.chunk_entities.pop(key, None)
+        if entity is not None:
+            destroy(entity)
+        self._dirty.update(self.neighbour_keys(key))
+        return
+
+    def padded_blocks(self, key: ChunkKey) -> np.ndarray:
+        """
+        Get a chunk's block IDs with a one block border from the neighbouring chunks
+        :param key: The chunk to get
+        """
+        padded = np.zeros((CHUNK_SIZE + 2,) * 3, dtype=np.uint8)
+        padded[1:-1, 1:-1, 1:-1] = self.chunks[key]
+        for axis in range(3):
+            for offset, source, target in ((-1, -1, 0), (1, 0, -1)):
+                neighbour = list(key)
+                neighbour[axis] += offset
+                blocks = self.chunks.get(tuple(neighbour), None)
+                if blocks is None:
+                    continue
+                src = [slice(None)] * 3
+                dst = [slice(1, -1)] * 3
+                src[axis] = source
+                dst[axis] = target
+                padded[tuple(dst)] = blocks[tuple(src)]
+        return padded
+
+    def rebuild_chunk(self, key: ChunkKey):
+        """
+        Rebuild the mesh for one chunk
+        :param key: The chunk to rebuild
+        """
+        entity = self.chunk_entities.get(key, None)
+        if entity is None:
+            entity = VoxelChunk(key, parent=self, texture=self.chunk_texture)
+            self.chunk_entities[key] = entity
+        mesh_data = build_chunk_mesh(self.padded_blocks(key), self.block_uvs, self.block_colors)
+        entity.set_mesh_data(mesh_data)
+        return
+
+    def update(self):
+        for key in self._dirty:
+            if key in self.chunks:
+                self.rebuild_chunk(key)
+        self._dirty.clear()
+        return
+
+    def raycast(self, origin, direction, max_distance: float = 8) -> Optional[Tuple[Vec3, Vec3]]:
+        """
+        Find the first block along a ray, by stepping through the grid one cell at a time
+        (Amanatides & Woo), so the cost depends on the distance and not on the number of blocks.
+        :param origin: Where the ray starts
+        :param direction: The direction of the ray
+        :param max_distance: How far to look
+        :return: The position of the block and the normal of the face that was hit, or None
+        """
+        length = math.sqrt(sum(d * d for d in direction))
+        if not length:
+            return None
+        direction = [d / length for d in direction]
+        # Blocks are centred on whole numbers, so shift by half a block to make cell edges whole numbers
+        start = [p + .5 for p in origin]
+        cell = [math.floor(p) for p in start]
+        step = [0, 0, 0]
+        t_max = [math.inf] * 3
+        t_delta = [math.inf] * 3
+        for axis in range(3):
+            if direction[axis] > 0:
+                step[axis] = 1
+                t_max[axis] = (cell[axis] + 1 - start[axis]) / direction[axis]
+            elif direction[axis] < 0:
+                step[axis] = -1
+                t_max[axis] = (cell[axis] - start[axis]) / direction[axis]
+            if step[axis]:
+                t_delta[axis] = abs(1 / direction[axis])
+        normal = [0, 0, 0]
+        distance = 0
+        while distance <= max_distance:
+            if self.get_block(cell) != AIR:
+                return Vec3(*cell), Vec3(*normal)
+            axis = t_max.index(min(t_max))
+            distance = t_max[axis]
+            cell[axis] += step[axis]
+            t_max[axis] += t_delta[axis]
+            normal = [0, 0, 0]
+            normal[axis] = -step[axis]
+        return None